@@ -1 +1,2 @@
 from redis_cache.cache import RedisCache
+from redis_cache.cluster import RedisClusterCache
@@ -0,0 +1,170 @@
+"""
+Memory analysis of the keys of a cache.
+
+Keys are found with SCAN and inspected with pipelined MEMORY USAGE, OBJECT
+ENCODING and PTTL commands, a few at a time and at most ``rate`` keys per
+second, so it can run against a production server. They are grouped by their
+first ``depth`` segments, after the part of the SCAN pattern common to every
+key (the backend's prefix and version).
+"""
+import heapq
+import random
+
+import redis
+
+from .compat import smart_text
+from .warmup import Throttle, _chunks, _scan, key_pattern
+
+
+# Upper bounds, in seconds, of the TTL buckets of the report
+TTL_BUCKETS = (
+    ('< 1m', 60),
+    ('< 1h', 3600),
+    ('< 1d', 86400),
+    ('< 1w', 604800),
+    ('>= 1w', None),
+)
+NO_TTL = 'no expiry'
+
+
+def _ttl_bucket(pttl):
+    if pttl is None or pttl < 0:
+        return NO_TTL
+    for name, bound in TTL_BUCKETS:
+        if bound is None or pttl < bound * 1000:
+            return name
+
+
+def _percentile(sizes, percent):
+    index = int(round(percent / 100.0 * (len(sizes) - 1)))
+    return sizes[index]
+
+
+class KeyGroup(object):
+    """
+    The statistics of the keys of one group. The percentiles are computed
+    from a uniform sample of at most ``max_samples`` sizes.
+    """
+    def __init__(self, pattern, max_samples=10000):
+        self.pattern = pattern
+        self.max_samples = max_samples
+        self.count = 0
+        self.bytes = 0
+        self.max_bytes = 0
+        self.ttls = dict((name, 0) for name in [NO_TTL] + [name for name, bound in TTL_BUCKETS])
+        self.encodings = {}
+        self._sizes = []
+
+    def add(self, size, encoding, pttl):
+        self.count += 1
+        self.bytes += size
+        self.max_bytes = max(self.max_bytes, size)
+        self.ttls[_ttl_bucket(pttl)] += 1
+        self.encodings[encoding] = self.encodings.get(encoding, 0) + 1
+        if len(self._sizes) < self.max_samples:
+            self._sizes.append(size)
+        else:
+            # Reservoir sampling
+            index = random.randint(0, self.count - 1)
+            if index < self.max_samples:
+                self._sizes[index] = size
+
+    def as_dict(self):
+        sizes = sorted(self._sizes)
+        return {
+            'pattern': self.pattern,
+            'count': self.count,
+            'bytes': self.bytes,
+            'p50': _percentile(sizes, 50),
+            'p90': _percentile(sizes, 90),
+            'p99': _percentile(sizes, 99),
+            'max': self.max_bytes,
+            'ttls': self.ttls,
+            'encodings': self.encodings,
+        }
+
+
+def group_pattern(key, prefix='', depth=2, separator=':'):
+    """
+    Returns the group of ``key``: ``prefix`` followed by the first ``depth``
+    segments of the rest of the key, then ``*`` if the key has more.
+    """
+    if prefix and key.startswith(prefix):
+        key = key[len(prefix):]
+    else:
+        prefix = ''
+    segments = key.split(separator, depth)
+    if len(segments) > depth:
+        segments[depth] = '*'
+    return prefix + separator.join(segments)
+
+
+def _pattern_prefix(pattern):
+    prefix = []
+    chars = iter(pattern)
+    for char in chars:
+        if char == '\\':
+            char = next(chars, '')
+        elif char in '*?[':
+            break
+        prefix.append(char)
+    return ''.join(prefix)
+
+
+def analyze_keys(cache, pattern=None, depth=2, separator=':', sample=1.0, top=10,
+                 chunk_size=100, rate=None):
+    """
+    Inspects the keys matching ``pattern`` (by default, every key of the
+    backend's prefix and version), or a random ``sample`` fraction of them,
+    ``chunk_size`` keys per pipeline and at most ``rate`` keys per second.
+
+    Returns a dict with the number of ``scanned`` and ``analyzed`` keys, their
+    ``bytes``, the ``groups`` sorted by decreasing size, and the ``top``
+    ``largest`` keys as ``(key, bytes)`` pairs.
+    """
+    if pattern is None:
+        pattern = key_pattern(cache)
+    prefix = _pattern_prefix(pattern)
+    client = cache._client
+    throttle = Throttle(rate)
+    groups = {}
+    largest = []
+    scanned = analyzed = 0
+    for keys in _chunks(_scan(client, pattern, chunk_size), chunk_size):
+        scanned += len(keys)
+        if sample < 1:
+            keys = [key for key in keys if random.random() < sample]
+            if not keys:
+                continue
+        throttle.wait(len(keys))
+        pipeline = client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.execute_command('MEMORY USAGE', key)
+            pipeline.execute_command('OBJECT ENCODING', key)
+            pipeline.pttl(key)
+        replies = pipeline.execute(raise_on_error=False)
+        for key, size, encoding, pttl in zip(keys, replies[::3], replies[1::3], replies[2::3]):
+            if isinstance(size, redis.ResponseError):
+                raise size
+            if size is None or isinstance(encoding, Exception):
+                # Expired meanwhile
+                continue
+            key = smart_text(key)
+            group = group_pattern(key, prefix, depth, separator)
+            if group not in groups:
+                groups[group] = KeyGroup(group)
+            groups[group].add(size, smart_text(encoding), pttl)
+            analyzed += 1
+            if len(largest) < top:
+                heapq.heappush(largest, (size, key))
+            elif top:
+                heapq.heappushpop(largest, (size, key))
+    groups = sorted((group.as_dict() for group in groups.values()),
+                    key=lambda group: (-group['bytes'], group['pattern']))
+    return {
+        'scanned': scanned,
+        'analyzed': analyzed,
+        'bytes': sum(group['bytes'] for group in groups),
+        'groups': groups,
+        'largest': [(key, size) for size, key in sorted(largest, reverse=True)],
+    }
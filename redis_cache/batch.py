@@ -0,0 +1,201 @@
+from .client import pop_internal_commands
+from .compat import DEFAULT_TIMEOUT
+
+
+class DeferredResult(object):
+    """
+    The result of an operation queued in a ``CacheBatch``. Reading ``value``
+    sends every pending operation of the batch if it was not sent yet, and
+    raises the error that made the batch fail, if any.
+    """
+    def __init__(self, batch):
+        self._batch = batch
+        self._resolved = False
+        self._value = None
+        self._error = None
+
+    def _resolve(self, value):
+        self._value = value
+        self._resolved = True
+
+    def _fail(self, error):
+        self._error = error
+        self._resolved = True
+
+    @property
+    def value(self):
+        if not self._resolved:
+            self._batch.flush()
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    def __repr__(self):
+        if self._error is not None:
+            return '<DeferredResult: failed with %r>' % (self._error,)
+        if self._resolved:
+            return '<DeferredResult: %r>' % (self._value,)
+        return '<DeferredResult: pending>'
+
+
+class _Operation(object):
+    def __init__(self, queue, resolve, keys=None):
+        self.queue = queue
+        self.resolve = resolve
+        # Only reads carry their keys: they are the ones merged into MGETs
+        self.keys = keys
+
+
+class CacheBatch(object):
+    """
+    Collects cache reads and writes and sends them to Redis in a single
+    pipeline, either when the ``with`` block ends, when ``flush`` is called or
+    when the ``value`` of one of the returned ``DeferredResult`` is read.
+
+    Operations run in the order they were issued, so a ``get`` following a
+    ``set`` of the same key sees the new value. Consecutive reads are merged
+    into one MGET.
+    """
+    def __init__(self, cache):
+        self._cache = cache
+        self._operations = []
+        self._results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        else:
+            self._operations = []
+            self._fail(exc_value if exc_value is not None else exc_type())
+
+    def _add(self, queue, resolve, keys=None):
+        result = DeferredResult(self)
+        self._results.append(result)
+        self._operations.append(_Operation(queue, lambda replies: result._resolve(resolve(replies)), keys))
+        return result
+
+    def get(self, key, default=None, version=None):
+        key = self._cache.make_key(key, version=version)
+
+        def resolve(values):
+            values = self._cache._join_chunked([key], values)
+            if values[0] is None:
+                return default
+            return self._cache.decode(values[0])
+        return self._add(None, resolve, [key])
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        new_keys = [self._cache.make_key(key, version=version) for key in keys]
+
+        def resolve(values):
+            return self._cache._decode_many(keys, self._cache._join_chunked(new_keys, values))
+        return self._add(None, resolve, new_keys)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        def queue(pipeline):
+            self._cache.set(key, value, timeout, version=version, client=pipeline)
+        return self._add(queue, lambda replies: bool(replies and replies[0]))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        def queue(pipeline):
+            self._cache.set(key, value, timeout, version=version, client=pipeline, _add_only=True)
+        return self._add(queue, lambda replies: bool(replies and replies[0]))
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        def queue(pipeline):
+            for key, value in data.items():
+                self._cache.set(key, value, timeout, version=version, client=pipeline)
+        return self._add(queue, lambda replies: None)
+
+    def delete(self, key, version=None):
+        return self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self._cache.make_key(key, version=version) for key in keys]
+
+        def queue(pipeline):
+            if keys:
+                pipeline.delete(*(keys + self._cache._chunk_keys(keys)))
+        return self._add(queue, lambda replies: None)
+
+    def _merged_operations(self):
+        """
+        Merges each run of consecutive reads into a single MGET operation.
+        """
+        merged, reads = [], []
+
+        def merge_reads(reads):
+            keys = []
+            for read in reads:
+                keys.extend(read.keys)
+
+            def queue(pipeline):
+                pipeline.mget(keys)
+
+            def resolve(replies):
+                values = replies[0]
+                for read in reads:
+                    read.resolve(values[:len(read.keys)])
+                    values = values[len(read.keys):]
+            return _Operation(queue, resolve)
+
+        for operation in self._operations:
+            if operation.keys is not None:
+                if operation.keys:
+                    reads.append(operation)
+                else:
+                    operation.resolve([])
+                continue
+            if reads:
+                merged.append(merge_reads(reads))
+                reads = []
+            merged.append(operation)
+        if reads:
+            merged.append(merge_reads(reads))
+        return merged
+
+    def _fail(self, error):
+        results, self._results = self._results, []
+        for result in results:
+            if not result._resolved:
+                result._fail(error)
+
+    def flush(self):
+        """
+        Sends every pending operation in one pipeline and resolves their
+        results. If sending them fails, the error is raised and raised again
+        by the ``value`` of every result of the batch.
+        """
+        try:
+            self._flush()
+        except Exception as e:
+            self._fail(e)
+            raise
+        self._results = []
+
+    def _flush(self):
+        writes = [operation for operation in self._operations if operation.keys is None]
+        operations = self._merged_operations()
+        self._operations = []
+        if not operations:
+            return
+        if self._cache.write_behind is not None:
+            # Reads must see the writes still buffered by the cache
+            self._cache.write_behind.flush()
+        pipeline = self._cache._client.pipeline(transaction=False)
+        spans = []
+        for operation in operations:
+            start = len(pipeline.command_stack)
+            operation.queue(pipeline)
+            spans.append((operation, start, len(pipeline.command_stack)))
+        internal = pop_internal_commands(pipeline)
+        replies = pipeline.execute()
+        if writes:
+            # Reads made meanwhile may have memoized the overwritten values
+            self._cache._forget_all()
+        for operation, start, end in spans:
+            operation.resolve([replies[index] for index in range(start, end) if index not in internal])
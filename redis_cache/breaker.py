@@ -0,0 +1,103 @@
+import threading
+import time
+
+import redis
+from django.dispatch import Signal
+
+
+circuit_breaker_state_changed = Signal(providing_args=['old_state', 'new_state'])
+
+# Errors that mean the server could not be reached in time. Any other error
+# is a reply from the server, so it counts as a success for the breaker.
+CONNECTION_ERRORS = (redis.ConnectionError, getattr(redis, 'TimeoutError', redis.ConnectionError))
+
+
+class CircuitOpenError(redis.ConnectionError):
+    """
+    Raised instead of sending a command while the circuit breaker is open.
+    """
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Counts consecutive connection failures to a Redis server and, once
+    ``failure_threshold`` is reached, opens the circuit: commands then fail
+    immediately with ``CircuitOpenError`` instead of waiting for the socket
+    timeout. After ``recovery_timeout`` seconds a single probe command is let
+    through (half-open state); its success closes the circuit again.
+
+    State changes are sent with the ``circuit_breaker_state_changed`` signal,
+    and ``stats`` holds counters suitable for metrics.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, failure_threshold=5, recovery_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.stats = {'failures': 0, 'rejected': 0, 'opened': 0}
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        old_state, self.state = self.state, state
+        if state == self.OPEN:
+            self._opened_at = time.time()
+            self.stats['opened'] += 1
+        return old_state
+
+    def _notify(self, old_state):
+        if old_state is not None and old_state != self.state:
+            circuit_breaker_state_changed.send(sender=self.__class__, breaker=self,
+                                               old_state=old_state, new_state=self.state)
+
+    def before_call(self):
+        old_state = None
+        with self._lock:
+            if self.state == self.OPEN and time.time() - self._opened_at >= self.recovery_timeout:
+                old_state = self._set_state(self.HALF_OPEN)
+            if self.state == self.OPEN or (self.state == self.HALF_OPEN and self._probing):
+                self.stats['rejected'] += 1
+                raise CircuitOpenError("Circuit breaker for '%s' is open" % self.name)
+            if self.state == self.HALF_OPEN:
+                self._probing = True
+        self._notify(old_state)
+
+    def record_success(self):
+        old_state = None
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            if self.state != self.CLOSED:
+                old_state = self._set_state(self.CLOSED)
+        self._notify(old_state)
+
+    def record_failure(self):
+        old_state = None
+        with self._lock:
+            self._failures += 1
+            self.stats['failures'] += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and
+                                                self._failures >= self.failure_threshold):
+                old_state = self._set_state(self.OPEN)
+        self._notify(old_state)
+
+    def call(self, func, *args, **kwargs):
+        self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except CONNECTION_ERRORS:
+            self.record_failure()
+            raise
+        except Exception:
+            self.record_success()
+            raise
+        self.record_success()
+        return result
@@ -1,22 +1,44 @@
+import logging
+import threading
+from hashlib import sha1
 from django.core.cache.backends.base import BaseCache, InvalidCacheBackendError
 from django.core.exceptions import ImproperlyConfigured
 from django.utils import importlib
 from django.utils.datastructures import SortedDict
-from .compat import (smart_text, smart_bytes, bytes_type,
+from .compat import (smart_text, smart_bytes, bytes_type, intern,
                      python_2_unicode_compatible, DEFAULT_TIMEOUT)
+from .batch import CacheBatch
+from .chunking import (POLICIES as VALUE_SIZE_POLICIES, ADD_CHUNKED_SCRIPT, chunk_key, is_manifest,
+                       read_manifest, split_value)
+from .breaker import CircuitBreaker, CircuitOpenError
+from .client import GuardedRedis, internal_commands, pop_internal_commands
+from .counters import Counter, CounterBuffer
+from .negative import BloomFilter, NegativeCache
+from .retry import RetryPolicy
+from .scripts import ScriptRegistry, is_noscript_error
+from .writebehind import OVERFLOW_POLICIES, WriteBehindBuffer
 
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
 
+try:
+    # Django >= 1.3
+    from django.core.cache.backends.base import default_key_func
+except ImportError:
+    default_key_func = None
+
 try:
     import redis
 except ImportError:
     raise InvalidCacheBackendError(
         "Redis cache backend requires the 'redis-py' library")
+
+logger = logging.getLogger('redis_cache')
 from redis.connection import UnixDomainSocketConnection, Connection
 from redis.connection import DefaultParser
+from redis.client import BasePipeline
 
 
 @python_2_unicode_compatible
@@ -24,14 +46,34 @@ class CacheKey(object):
     """
     A stub string class that we can use to check if a key was created already.
     """
+    # One instance is created per key in bulk operations: keep them small and
+    # convert the key to text and bytes at most once.
+    __slots__ = ('_key', '_text', '_encoded')
+
     def __init__(self, key):
         self._key = key
+        self._text = None
+        self._encoded = None
 
     def __eq__(self, other):
         return self._key == other
 
+    def __ne__(self, other):
+        return not self == other
+
     def __str__(self):
-        return smart_text(self._key)
+        if self._text is None:
+            self._text = smart_text(self._key)
+        return self._text
+
+    @property
+    def encoded(self):
+        """
+        The utf-8 encoded bytes of the key.
+        """
+        if self._encoded is None:
+            self._encoded = smart_bytes(self._key)
+        return self._encoded
 
     def __repr__(self):
         return repr(self._key)
@@ -40,16 +82,48 @@ class CacheKey(object):
         return hash(self._key)
 
 
+def _hashable(value):
+    if isinstance(value, dict):
+        return tuple(sorted(((key, _hashable(item)) for key, item in value.items()), key=repr))
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_hashable(item) for item in value)
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+
+def _options_identifier(options):
+    """
+    Returns a hashable identifier of a dict of options, so that backends
+    configured differently do not share a connection pool or a policy.
+    Nested dicts and lists, e.g. ``socket_keepalive_options``, are frozen.
+    """
+    return _hashable(options or {})
+
+
 class CacheConnectionPool(object):
 
     def __init__(self):
         self._connection_pools = {}
+        self._sentinel_connection_pools = {}
+        self._sentinels = {}
+        self._circuit_breakers = {}
+        self._retry_policies = {}
+        self._write_behind_buffers = {}
+        self._counter_buffers = {}
+        self._negative_caches = {}
+        self._script_registries = {}
 
     def get_connection_pool(self, host='127.0.0.1', port=6379, db=1,
                             password=None, parser_class=None,
                             unix_socket_path=None, connection_pool_class=None,
                             connection_pool_class_kwargs=None):
-        connection_identifier = (host, port, db, parser_class, unix_socket_path, connection_pool_class)
+        connection_identifier = (host, port, db, password, parser_class, unix_socket_path, connection_pool_class,
+                                 _options_identifier(connection_pool_class_kwargs))
         if not self._connection_pools.get(connection_identifier):
             connection_class = (
                 unix_socket_path and UnixDomainSocketConnection or Connection
@@ -70,9 +144,150 @@ class CacheConnectionPool(object):
                 kwargs['path'] = unix_socket_path
             self._connection_pools[connection_identifier] = connection_pool_class(**kwargs)
         return self._connection_pools[connection_identifier]
+
+    def get_sentinel_connection_pool(self, sentinels, service_name, is_master=True, db=1, password=None,
+                                     parser_class=None, connection_pool_class_kwargs=None):
+        """
+        Returns a pool of connections to the master (or the replicas) that the
+        given Sentinels report for ``service_name``.
+        """
+        try:
+            from .sentinel import Sentinel, CacheSentinelConnectionPool
+        except ImportError:
+            raise ImproperlyConfigured("Sentinel support requires redis-py >= 2.9")
+        sentinels = tuple(sentinels)
+        connection_identifier = (sentinels, service_name, is_master, db, password, parser_class,
+                                 _options_identifier(connection_pool_class_kwargs))
+        if not self._sentinel_connection_pools.get(connection_identifier):
+            connection_pool_class_kwargs = dict(connection_pool_class_kwargs or {})
+            sentinel_kwargs = dict((key, value) for key, value in connection_pool_class_kwargs.items()
+                                   if key.startswith('socket_'))
+            sentinel_identifier = (sentinels, _options_identifier(sentinel_kwargs))
+            if not self._sentinels.get(sentinel_identifier):
+                self._sentinels[sentinel_identifier] = Sentinel(sentinels, sentinel_kwargs=sentinel_kwargs)
+            kwargs = {
+                'db': db,
+                'password': password,
+                'parser_class': parser_class,
+                'is_master': is_master,
+            }
+            kwargs.update(connection_pool_class_kwargs)
+            self._sentinel_connection_pools[connection_identifier] = CacheSentinelConnectionPool(
+                service_name, self._sentinels[sentinel_identifier], **kwargs
+            )
+        return self._sentinel_connection_pools[connection_identifier]
+
+    def get_circuit_breaker(self, server, db, failure_threshold=5, recovery_timeout=30):
+        """
+        Returns the circuit breaker shared by every backend talking to the
+        given server and db with the same thresholds.
+        """
+        breaker_identifier = (server, db, failure_threshold, recovery_timeout)
+        if not self._circuit_breakers.get(breaker_identifier):
+            self._circuit_breakers[breaker_identifier] = CircuitBreaker(
+                '%s/%s' % (server, db), failure_threshold, recovery_timeout
+            )
+        return self._circuit_breakers[breaker_identifier]
+
+    def get_retry_policy(self, server, db, **kwargs):
+        """
+        Returns the retry policy shared by every backend talking to the given
+        server and db with the same options.
+        """
+        policy_identifier = (server, db, _options_identifier(kwargs))
+        if not self._retry_policies.get(policy_identifier):
+            self._retry_policies[policy_identifier] = RetryPolicy(**kwargs)
+        return self._retry_policies[policy_identifier]
+
+    def get_write_behind_buffer(self, server, db, client, write, backend_options=None, **kwargs):
+        """
+        Returns the write-behind buffer shared by every backend talking to the
+        given server and db with the same options: its writes are queued by
+        the ``write`` callback of the first of them.
+        """
+        buffer_identifier = (server, db, _options_identifier(kwargs), _options_identifier(backend_options))
+        if buffer_identifier not in self._write_behind_buffers:
+            self._write_behind_buffers[buffer_identifier] = WriteBehindBuffer(client, write, **kwargs)
+        return self._write_behind_buffers[buffer_identifier]
+
+    def get_counter_buffer(self, server, db, client, write, written=None, backend_options=None, **kwargs):
+        """
+        Returns the buffer of counter increments shared by every backend
+        talking to the given server and db with the same options: its
+        increments are queued by the ``write`` callback of the first of them.
+        """
+        buffer_identifier = (server, db, _options_identifier(kwargs), _options_identifier(backend_options))
+        if buffer_identifier not in self._counter_buffers:
+            self._counter_buffers[buffer_identifier] = CounterBuffer(client, write, written=written, **kwargs)
+        return self._counter_buffers[buffer_identifier]
+
+    def get_negative_cache(self, server, db, client, bloom_filter=None, **kwargs):
+        """
+        Returns the negative cache shared by every backend talking to the
+        given server and db with the same negative cache options.
+        """
+        cache_identifier = (server, db, _options_identifier(kwargs), _options_identifier(bloom_filter))
+        if cache_identifier not in self._negative_caches:
+            if bloom_filter is not None:
+                bloom_filter = BloomFilter(client, **bloom_filter)
+            self._negative_caches[cache_identifier] = NegativeCache(bloom_filter=bloom_filter, **kwargs)
+        return self._negative_caches[cache_identifier]
+
+    def get_script_registry(self, server, db):
+        """
+        Returns the scripts registered on the backends talking to the given
+        server and db.
+        """
+        registry_identifier = (server, db)
+        if registry_identifier not in self._script_registries:
+            self._script_registries[registry_identifier] = ScriptRegistry()
+        return self._script_registries[registry_identifier]
 pool = CacheConnectionPool()
 
 
+class RequestMemo(object):
+    """
+    An opt-in, thread local memo of the values read from Redis, so a key read
+    several times while it is active costs a single round trip.
+
+    It is started and stopped around each request by
+    ``redis_cache.middleware.RequestMemoMiddleware``, or used as a context
+    manager. Writes made through the cache backends drop the affected keys,
+    so reads stay consistent with them. The raw replies are memoized, not the
+    unpickled objects, so callers never share mutable values.
+    """
+    def __init__(self):
+        self._local = threading.local()
+
+    def start(self):
+        self._local.stores = {}
+
+    def stop(self):
+        self._local.stores = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def active(self):
+        return getattr(self._local, 'stores', None) is not None
+
+    def store(self, namespace):
+        """
+        Returns the memo dict of the given namespace, or ``None`` if the memo
+        is not active in this thread.
+        """
+        stores = getattr(self._local, 'stores', None)
+        if stores is None:
+            return None
+        return stores.setdefault(namespace, {})
+request_memo = RequestMemo()
+
+
 class CacheClass(BaseCache):
     def __init__(self, server, params):
         """
@@ -84,41 +299,149 @@ class CacheClass(BaseCache):
         super(CacheClass, self).__init__(params)
         self._server = server
         self._params = params
+        self._key_prefixes = {}
+        self._max_key_length = self.max_key_length
+        self._bitfield_ro = True
 
-        unix_socket_path = None
-        if ':' in self.server:
-            host, port = self.server.rsplit(':', 1)
-            try:
-                port = int(port)
-            except (ValueError, TypeError):
-                raise ImproperlyConfigured("port value must be an integer")
+        self.circuit_breaker = self.retry_policy = None
+        if self.circuit_breaker_options is not None:
+            self.circuit_breaker = pool.get_circuit_breaker(self.server, self.db, **self.circuit_breaker_options)
+        if self.retry_options is not None:
+            self.retry_policy = pool.get_retry_policy(self.server, self.db, **self.retry_options)
+        self.value_size_limits = self.max_value_size_options
+        self._init_clients()
+        self._init_write_behind()
+        self._init_counters()
+        self._init_negative_cache()
+
+    def _init_clients(self):
+        if self.sentinel_location is not None:
+            sentinels, service_name = self.sentinel_location
+            self._client = self._create_sentinel_client(sentinels, service_name, is_master=True)
+            self._read_client = self._client
+            if self.options.get('READ_FROM_REPLICAS', False):
+                self._read_client = self._create_sentinel_client(sentinels, service_name, is_master=False)
         else:
-            host, port = None, None
-            unix_socket_path = self.server
+            unix_socket_path = None
+            if ':' in self.server:
+                host, port = self.server.rsplit(':', 1)
+                try:
+                    port = int(port)
+                except (ValueError, TypeError):
+                    raise ImproperlyConfigured("port value must be an integer")
+            else:
+                host, port = None, None
+                unix_socket_path = self.server
+
+            self._client = self._read_client = self._create_client(host, port, unix_socket_path, self.db)
 
+    def _init_negative_cache(self):
+        self.negative_cache = None
+        if self.negative_cache_options is not None:
+            self.negative_cache = pool.get_negative_cache(self.server, self.db, self._client,
+                                                          **self.negative_cache_options)
+
+    def _init_write_behind(self):
+        self.write_behind = None
+        if self.write_behind_options is not None:
+            self.write_behind = pool.get_write_behind_buffer(self.server, self.db, self._client, self._write_pending,
+                                                             self._write_options, **self.write_behind_options)
+
+    @property
+    def _write_options(self):
+        # The options the callbacks of the shared buffers depend on: keys and
+        # values are made and encoded before they are buffered
+        return (self.value_size_limits, self.negative_cache_options)
+
+    def _init_counters(self):
+        # The buffer is only created by the first counter
+        self.counters = None
+        self._counter_client = self._client
+
+    def _counter_buffer(self):
+        if self.counters is None:
+            self.counters = pool.get_counter_buffer(self.server, self.db, self._counter_client,
+                                                    self._write_counter, self._counters_written,
+                                                    self._write_options, **self.counter_options)
+        return self.counters
+
+    def _get_connection_pool_class_kwargs(self, unix_socket_path=None):
+        connection_pool_class_kwargs = dict(self.connection_pool_class_kwargs)
+        if self.socket_timeout is not None:
+            connection_pool_class_kwargs['socket_timeout'] = self.socket_timeout
+        if self.socket_connect_timeout is not None and unix_socket_path is None:
+            connection_pool_class_kwargs['socket_connect_timeout'] = self.socket_connect_timeout
+        return connection_pool_class_kwargs
+
+    def _create_client(self, host, port, unix_socket_path, db):
+        """
+        Returns a client for the given server, using the connection pool,
+        circuit breaker and retry policy from the backend's options.
+        """
         kwargs = {
-            'db': self.db,
+            'db': db,
             'password': self.password,
             'host': host,
             'port': port,
             'unix_socket_path': unix_socket_path,
         }
-
         connection_pool = pool.get_connection_pool(
             parser_class=self.parser_class,
             connection_pool_class=self.connection_pool_class,
-            connection_pool_class_kwargs=self.connection_pool_class_kwargs,
+            connection_pool_class_kwargs=self._get_connection_pool_class_kwargs(unix_socket_path),
             **kwargs
         )
-        self._client = redis.Redis(
+        return self._wrap_client(connection_pool, **kwargs)
+
+    def _create_sentinel_client(self, sentinels, service_name, is_master=True):
+        connection_pool = pool.get_sentinel_connection_pool(
+            sentinels, service_name,
+            is_master=is_master,
+            db=self.db,
+            password=self.password,
+            parser_class=self.parser_class,
+            connection_pool_class_kwargs=self._get_connection_pool_class_kwargs(),
+        )
+        return self._wrap_client(connection_pool)
+
+    def _wrap_client(self, connection_pool, **kwargs):
+        if self.circuit_breaker is None and self.retry_policy is None:
+            return redis.Redis(
+                connection_pool=connection_pool,
+                **kwargs
+            )
+        client = GuardedRedis(
             connection_pool=connection_pool,
             **kwargs
         )
+        client.circuit_breaker = self.circuit_breaker
+        client.retry_policy = self.retry_policy
+        return client
 
     @property
     def server(self):
         return self._server or "127.0.0.1:6379"
 
+    @property
+    def sentinel_location(self):
+        """
+        Returns the Sentinel addresses and the master name given in a
+        ``sentinel://host:port,host:port/master_name`` LOCATION, or ``None``.
+        """
+        if not self.server.startswith('sentinel://'):
+            return None
+        try:
+            addresses, service_name = self.server[len('sentinel://'):].rsplit('/', 1)
+            sentinels = []
+            for address in addresses.split(','):
+                host, port = address.strip().rsplit(':', 1)
+                sentinels.append((host, int(port)))
+        except (ValueError, TypeError):
+            raise ImproperlyConfigured("Sentinel LOCATION must be sentinel://host:port[,host:port...]/master_name")
+        if not service_name:
+            raise ImproperlyConfigured("Sentinel LOCATION must end with the master name")
+        return sentinels, service_name
+
     @property
     def params(self):
         return self._params or {}
@@ -142,6 +465,148 @@ class CacheClass(BaseCache):
     def connection_pool_class_kwargs(self):
         return self.options.get('CONNECTION_POOL_CLASS_KWARGS', {})
 
+    def _get_timeout_option(self, name):
+        _timeout = self.options.get(name, None)
+        if _timeout is None:
+            return None
+        try:
+            return float(_timeout)
+        except (ValueError, TypeError):
+            raise ImproperlyConfigured("%s value must be a number" % name.lower().replace('_', ' '))
+
+    @property
+    def socket_timeout(self):
+        return self._get_timeout_option('SOCKET_TIMEOUT')
+
+    @property
+    def socket_connect_timeout(self):
+        return self._get_timeout_option('SOCKET_CONNECT_TIMEOUT')
+
+    @property
+    def circuit_breaker_options(self):
+        _options = self.options.get('CIRCUIT_BREAKER', None)
+        if _options is None:
+            return None
+        try:
+            return {
+                'failure_threshold': int(_options.get('FAILURE_THRESHOLD', 5)),
+                'recovery_timeout': float(_options.get('RECOVERY_TIMEOUT', 30)),
+            }
+        except (ValueError, TypeError):
+            raise ImproperlyConfigured("circuit breaker options must be numbers")
+
+    @property
+    def retry_options(self):
+        _options = self.options.get('RETRY', None)
+        if _options is None:
+            return None
+        try:
+            return {
+                'max_attempts': int(_options.get('MAX_ATTEMPTS', 3)),
+                'backoff': float(_options.get('BACKOFF', 0.05)),
+                'max_backoff': float(_options.get('MAX_BACKOFF', 1)),
+                'deadline': float(_options.get('DEADLINE', 2)),
+            }
+        except (ValueError, TypeError):
+            raise ImproperlyConfigured("retry options must be numbers")
+
+    @property
+    def write_behind_options(self):
+        _options = self.options.get('WRITE_BEHIND', None)
+        if _options is None:
+            return None
+        if _options.get('OVERFLOW', 'flush') not in OVERFLOW_POLICIES:
+            raise ImproperlyConfigured("write-behind overflow must be one of %s" % ', '.join(OVERFLOW_POLICIES))
+        try:
+            return {
+                'max_size': int(_options.get('MAX_SIZE', 10000)),
+                'flush_size': int(_options.get('FLUSH_SIZE', 1000)),
+                'flush_interval': float(_options.get('FLUSH_INTERVAL', 0.1)),
+                'overflow': _options.get('OVERFLOW', 'flush'),
+            }
+        except (ValueError, TypeError):
+            raise ImproperlyConfigured("write-behind sizes and interval must be numbers")
+
+    @property
+    def counter_options(self):
+        _options = self.options.get('COUNTERS', {})
+        try:
+            return {
+                'max_size': int(_options.get('MAX_SIZE', 10000)),
+                'flush_size': int(_options.get('FLUSH_SIZE', 1000)),
+                'flush_interval': float(_options.get('FLUSH_INTERVAL', 1)),
+            }
+        except (ValueError, TypeError):
+            raise ImproperlyConfigured("counter buffer sizes and interval must be numbers")
+
+    @property
+    def max_value_size_options(self):
+        _options = self.options.get('MAX_VALUE_SIZE', None)
+        if _options is None:
+            return None
+        if not isinstance(_options, dict):
+            _options = {'SIZE': _options}
+        policy = _options.get('POLICY', 'reject')
+        if policy not in VALUE_SIZE_POLICIES:
+            raise ImproperlyConfigured("max value size policy must be one of %s" % ', '.join(VALUE_SIZE_POLICIES))
+        try:
+            _options = {
+                'size': int(_options['SIZE']),
+                'policy': policy,
+                'chunk_bytes': int(_options.get('CHUNK_BYTES', 512 * 1024)),
+                'compress': bool(_options.get('COMPRESS', True)),
+            }
+        except KeyError:
+            raise ImproperlyConfigured("max value size options must include SIZE")
+        except (ValueError, TypeError):
+            raise ImproperlyConfigured("max value sizes must be integers")
+        if _options['size'] < 1 or _options['chunk_bytes'] < 1:
+            raise ImproperlyConfigured("max value sizes must be positive")
+        return _options
+
+    @property
+    def negative_cache_options(self):
+        _options = self.options.get('NEGATIVE_CACHE', None)
+        if _options is None:
+            return None
+        try:
+            negative_cache_options = {
+                'timeout': float(_options.get('TIMEOUT', 1)),
+                'max_size': int(_options.get('MAX_SIZE', 10000)),
+            }
+            bloom_filter = _options.get('BLOOM_FILTER', None)
+            if bloom_filter is not None:
+                negative_cache_options['bloom_filter'] = {
+                    'key': bloom_filter.get('KEY', 'redis_cache:bloom'),
+                    'bits': int(bloom_filter.get('BITS', 2 ** 23)),
+                    'hashes': int(bloom_filter.get('HASHES', 5)),
+                    'refresh_interval': float(bloom_filter.get('REFRESH_INTERVAL', 30)),
+                }
+        except (ValueError, TypeError):
+            raise ImproperlyConfigured("negative cache options must be numbers")
+        return negative_cache_options
+
+    @property
+    def max_key_length(self):
+        _max_key_length = self.options.get('MAX_KEY_LENGTH', None)
+        if _max_key_length is None:
+            return None
+        try:
+            return int(_max_key_length)
+        except (ValueError, TypeError):
+            raise ImproperlyConfigured("max key length value must be an integer")
+
+    @property
+    def chunk_size(self):
+        _chunk_size = self.options.get('CHUNK_SIZE', 1000)
+        try:
+            _chunk_size = int(_chunk_size)
+        except (ValueError, TypeError):
+            raise ImproperlyConfigured("chunk size value must be an integer")
+        if _chunk_size < 1:
+            raise ImproperlyConfigured("chunk size value must be positive")
+        return _chunk_size
+
     @property
     def db(self):
         _db = self.params.get('db', self.options.get('DB', 1))
@@ -171,9 +636,112 @@ class CacheClass(BaseCache):
     def __getstate__(self):
         return {'params': self._params, 'server': self._server}
 
+    @property
+    def _memo_namespace(self):
+        return (self.server, self.db)
+
+    def _memo_store(self):
+        return request_memo.store(self._memo_namespace)
+
+    def _forget(self, *keys):
+        """
+        Drops the given keys from the request memo and the negative cache
+        after a write.
+        """
+        store = self._memo_store()
+        if store:
+            for key in keys:
+                store.pop(key, None)
+        if self.negative_cache is not None:
+            self.negative_cache.discard(keys)
+
+    def _forget_all(self):
+        store = self._memo_store()
+        if store:
+            store.clear()
+        if self.negative_cache is not None:
+            self.negative_cache.clear()
+
+    def _known_missing(self, keys):
+        """
+        Returns the set of keys the negative cache knows to be missing.
+        """
+        if self.negative_cache is None or not keys:
+            return set()
+        return self.negative_cache.missing(keys)
+
+    def _record_missing(self, keys, values):
+        if self.negative_cache is not None:
+            self.negative_cache.add([key for key, value in zip(keys, values) if value is None])
+
+    @property
+    def _bloom_filter(self):
+        if self.negative_cache is None:
+            return None
+        return self.negative_cache.bloom_filter
+
+    def _mark_written(self, client, keys):
+        """
+        Adds the keys of a write to the Bloom filter, through ``client``,
+        which may be a pipeline. Returns whether a command was sent.
+        """
+        if self._bloom_filter is None or not keys:
+            return False
+        with internal_commands(client):
+            self._bloom_filter.add(client, keys)
+        return True
+
     def __setstate__(self, state):
         self._init(**state)
 
+    def _write_pending(self, pipeline, key, operation):
+        """
+        Queues a write taken from the write-behind buffer on a pipeline.
+        """
+        if operation[0] == 'delete':
+            pipeline.delete(key, *self._chunk_keys([key]))
+        else:
+            self._store(key, operation[1], operation[2], pipeline)
+
+    def _write_counter(self, pipeline, key, operation):
+        """
+        Queues the pending increment of a counter on a pipeline.
+        """
+        (key, field), (delta, timeout) = key, operation
+        self._mark_written(pipeline, [key])
+        if field is None:
+            pipeline.incr(key, delta)
+        else:
+            pipeline.hincrby(key, field, delta)
+        if timeout is not None:
+            pipeline.expire(key, timeout)
+
+    def _counters_written(self, keys):
+        # Forgets the counters once their increments are stored
+        self._forget(*set(key for key, field in keys))
+
+    def _pending_write(self, key):
+        if self.write_behind is None:
+            return None
+        return self.write_behind.get(key)
+
+    def _pending_writes(self, keys):
+        pending = {}
+        if self.write_behind is not None:
+            for key in keys:
+                operation = self.write_behind.get(key)
+                if operation is not None:
+                    pending[key] = operation
+        return pending
+
+    def _flush_pending(self, *keys):
+        """
+        Sends the buffered writes if one of the keys has a pending write, before
+        running a command that depends on its value server side.
+        """
+        if self.write_behind is not None and any(key in self.write_behind for key in keys):
+            self.write_behind.flush()
+
     def make_key(self, key, version=None):
         """
         Returns the utf-8 encoded bytestring of the given key as a CacheKey
@@ -185,7 +753,13 @@ class CacheClass(BaseCache):
 
     def has_key(self, key, version=None):
         key = self.make_key(key, version=version)
-        return self._client.exists(key)
+        operation = self._pending_write(key)
+        if operation is not None:
+            return operation[1] is not None
+        try:
+            return self._read_client.exists(key)
+        except CircuitOpenError:
+            return False
 
     def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
         """
@@ -193,7 +767,8 @@ class CacheClass(BaseCache):
 
         Returns ``True`` if the object was added, ``False`` if not.
         """
-        return self.set(key, value, timeout, _add_only=True)
+        self._flush_pending(self.make_key(key, version=version))
+        return self.set(key, value, timeout, version=version, _add_only=True)
 
     def get(self, key, default=None, version=None):
         """
@@ -202,15 +777,176 @@ class CacheClass(BaseCache):
         Returns unpickled value if key is found, the default if not.
         """
         key = self.make_key(key, version=version)
-        value = self._client.get(key)
+        operation = self._pending_write(key)
+        store = self._memo_store()
+        if operation is not None:
+            # A buffered delete is pending when the value is None
+            value = operation[1]
+        elif store is not None and key in store:
+            value = store[key]
+        elif key in self._known_missing([key]):
+            return default
+        else:
+            try:
+                value = self._read_client.get(key)
+            except CircuitOpenError:
+                return default
+            if store is not None:
+                store[key] = value
+            self._record_missing([key], [value])
+        value = self._join_chunked([key], [value])[0]
         if value is None:
             return default
-        try:
-            result = int(value)
-        except (ValueError, TypeError):
-            result = self.unpickle(value)
+        return self.decode(value)
+
+    def _store(self, key, value, timeout, client, _add_only=False):
+        """
+        Writes an encoded value, applying the ``MAX_VALUE_SIZE`` policy, and
+        adds its key to the Bloom filter in the same transaction.
+
+        A chunked ``add`` needs the reply of its manifest SETNX before writing
+        the chunks, so its key is added to the Bloom filter afterwards.
+        """
+        if (self._bloom_filter is None or isinstance(client, BasePipeline) or
+                (_add_only and self._value_size_policy(value) == 'chunk')):
+            result = self._store_value(key, value, timeout, client, _add_only)
+            self._mark_written(client, [key])
+            return result
+        pipeline = client.pipeline()
+        self._mark_written(pipeline, [key])
+        result = self._store_value(key, value, timeout, pipeline, _add_only)
+        internal = pop_internal_commands(pipeline)
+        replies = [reply for index, reply in enumerate(pipeline.execute()) if index not in internal]
+        if result is not pipeline:
+            return result
+        return bool(replies[-1])
+
+    def _value_size_policy(self, value):
+        """
+        Returns the ``MAX_VALUE_SIZE`` policy applying to an encoded value, or
+        ``None`` if it is small enough.
+        """
+        limits = self.value_size_limits
+        if limits is None or isinstance(value, int) or len(value) <= limits['size']:
+            return None
+        return limits['policy']
+
+    def _warn_value_size(self, key, value):
+        logger.warning("Value of %s bytes for cache key '%s' exceeds MAX_VALUE_SIZE (%s bytes)",
+                       len(value), key, self.value_size_limits['size'])
+
+    def _store_value(self, key, value, timeout, client, _add_only=False):
+        policy = self._value_size_policy(value)
+        if policy is None:
+            return self._set_unchunked(key, value, timeout, client, _add_only)
+        if policy == 'chunk':
+            return self._set_chunked(key, value, timeout, client, _add_only)
+        self._warn_value_size(key, value)
+        if policy == 'warn':
+            return self._set(key, value, timeout, client, _add_only)
+        if not _add_only:
+            # Keep serving the previous value would be serving a stale one,
+            # and it may have been chunked by a backend with other options
+            client.delete(key, chunk_key(key))
+        return False
+
+    @property
+    def _chunking(self):
+        return self.value_size_limits is not None and self.value_size_limits['policy'] == 'chunk'
+
+    def _set_unchunked(self, key, value, timeout, client, _add_only=False):
+        """
+        Writes a small value, deleting the chunks of the large value it may
+        replace.
+        """
+        if _add_only or timeout < 0 or not self._chunking:
+            return self._set(key, value, timeout, client, _add_only)
+        pipeline = client if isinstance(client, BasePipeline) else client.pipeline()
+        result = self._set(key, value, timeout, pipeline)
+        with internal_commands(pipeline):
+            pipeline.delete(chunk_key(key))
+        if pipeline is client:
+            return result
+        return pipeline.execute()[0]
+
+    def _set_chunked(self, key, value, timeout, client, _add_only=False):
+        """
+        Writes the chunks of a large value and its manifest in one transaction.
+
+        ``add`` sets the manifest first, and only writes the chunks if it was
+        added: an existing value, its chunks and expiry are left untouched. In
+        a pipeline, where the reply is only known later, a Lua script does
+        both at once.
+        """
+        if timeout < 0:
+            return False
+        limits = self.value_size_limits
+        manifest, chunks = split_value(value, limits['chunk_bytes'], limits['compress'])
+        if _add_only:
+            if isinstance(client, BasePipeline):
+                return client.eval(ADD_CHUNKED_SCRIPT, 2, key, chunk_key(key), manifest, timeout, *chunks)
+            if not client.set(key, manifest, ex=timeout or None, nx=True):
+                return False
+            pipeline = client.pipeline()
+        else:
+            pipeline = client if isinstance(client, BasePipeline) else client.pipeline()
+        with internal_commands(pipeline):
+            pipeline.delete(chunk_key(key))
+            pipeline.hmset(chunk_key(key), dict(enumerate(chunks)))
+            if timeout > 0:
+                pipeline.expire(chunk_key(key), timeout)
+        if _add_only:
+            pipeline.execute()
+            return True
+        result = self._set(key, manifest, timeout, pipeline)
+        if pipeline is client:
+            return result
+        return pipeline.execute()[-1]
+
+    def _chunk_keys(self, keys):
+        """
+        Returns the keys of the chunks of the values stored at ``keys``, to
+        delete or expire them along with their manifests.
+        """
+        if not self._chunking:
+            return []
+        return [chunk_key(key) for key in keys]
+
+    def _expire(self, client, key, timeout):
+        """
+        Queues an EXPIRE of ``key`` and of its chunks. Returns the reply for
+        ``key``.
+        """
+        result = client.expire(key, timeout)
+        with internal_commands(client):
+            for name in self._chunk_keys([key]):
+                client.expire(name, timeout)
         return result
 
+    def _join_chunked(self, keys, values):
+        """
+        Replaces the manifests of chunked values by the values, reading the
+        chunks of all of them in one pipeline. Values with a missing or
+        corrupted chunk become ``None``.
+        """
+        manifests = [(index, read_manifest(value)) for index, value in enumerate(values) if is_manifest(value)]
+        if not manifests:
+            return values
+        values = list(values)
+        try:
+            pipeline = self._read_client.pipeline(transaction=False)
+            for index, (count, join) in manifests:
+                pipeline.hmget(chunk_key(keys[index]), list(range(count)))
+            replies = pipeline.execute(raise_on_error=False)
+        except CircuitOpenError:
+            replies = [[None] * count for index, (count, join) in manifests]
+        for (index, (count, join)), chunks in zip(manifests, replies):
+            if isinstance(chunks, redis.ResponseError):
+                # Not a hash (WRONGTYPE): the chunks are lost
+                chunks = [None] * count
+            values[index] = join(chunks)
+        return values
+
     def _set(self, key, value, timeout, client, _add_only=False):
         if timeout == 0:
             if _add_only:
@@ -218,10 +954,10 @@ class CacheClass(BaseCache):
             return client.set(key, value)
         elif timeout > 0:
             if _add_only:
-                added = client.setnx(key, value)
-                if added:
-                    client.expire(key, timeout)
-                return added
+                # One command: in a pipeline the reply is only known later,
+                # and a failed add must not reset the expiry of the key
+                added = client.set(key, value, ex=timeout, nx=True)
+                return added if isinstance(client, BasePipeline) else bool(added)
             return client.setex(key, value, timeout)
         else:
             return False
@@ -229,18 +965,33 @@ class CacheClass(BaseCache):
     def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, client=None, _add_only=False):
         """
         Persist a value to the cache, and set an optional expiration time.
+
+        In write-behind mode the value is buffered and ``True`` is returned
+        unless the buffer dropped it or the value is rejected for its size.
         """
-        if not client:
+        buffered = client is None and not _add_only and self.write_behind is not None
+        if client is None:
             client = self._client
         key = self.make_key(key, version=version)
         if timeout is DEFAULT_TIMEOUT:
             timeout = self.default_timeout
 
-        # If ``value`` is not an int, then pickle it
-        if not isinstance(value, int) or isinstance(value, bool):
-            result = self._set(key, pickle.dumps(value), int(timeout), client, _add_only)
-        else:
-            result = self._set(key, value, int(timeout), client, _add_only)
+        self._forget(key)
+        if buffered:
+            if int(timeout) < 0:
+                return False
+            value = self.encode(value)
+            if self._value_size_policy(value) == 'reject':
+                self._warn_value_size(key, value)
+                # The previous value is stale: delete it as a direct write would
+                self.write_behind.put(key, ('delete', None, None))
+                return False
+            return self.write_behind.put(key, ('set', value, int(timeout)))
+        try:
+            result = self._store(key, self.encode(value), int(timeout), client, _add_only)
+        except CircuitOpenError:
+            # The write is dropped while Redis is unreachable
+            return False
         # result is a boolean
         return result
 
@@ -248,21 +999,40 @@ class CacheClass(BaseCache):
         """
         Remove a key from the cache.
         """
-        self._client.delete(self.make_key(key, version=version))
+        key = self.make_key(key, version=version)
+        self._forget(key)
+        if self.write_behind is not None:
+            self.write_behind.put(key, ('delete', None, None))
+            return
+        try:
+            self._client.delete(key, *self._chunk_keys([key]))
+        except CircuitOpenError:
+            pass
 
     def delete_many(self, keys, version=None):
         """
         Remove multiple keys at once.
         """
         if keys:
-            keys = map(lambda key: self.make_key(key, version=version), keys)
-            self._client.delete(*keys)
+            keys = list(map(lambda key: self.make_key(key, version=version), keys))
+            self._forget(*keys)
+            if self.write_behind is not None:
+                for key in keys:
+                    self.write_behind.put(key, ('delete', None, None))
+                return
+            try:
+                self._client.delete(*(keys + self._chunk_keys(keys)))
+            except CircuitOpenError:
+                pass
 
     def clear(self):
         """
         Flush all cache keys.
         """
         # TODO : potential data loss here, should we only delete keys based on the correct version ?
+        if self.write_behind is not None:
+            self.write_behind.flush()
+        self._forget_all()
         self._client.flushdb()
 
     def unpickle(self, value):
@@ -272,26 +1042,97 @@ class CacheClass(BaseCache):
         value = smart_bytes(value)
         return pickle.loads(value)
 
+    def encode(self, value):
+        """
+        Prepares a value to be sent to Redis: integers are stored as is so
+        they can be incremented server side, everything else is pickled.
+        """
+        if not isinstance(value, int) or isinstance(value, bool):
+            return pickle.dumps(value)
+        return value
+
+    def decode(self, value):
+        """
+        Reverses ``encode`` on a value read from Redis.
+        """
+        try:
+            return int(value)
+        except (ValueError, TypeError):
+            return self.unpickle(value)
+
+    def _decode_items(self, items, withscores=False):
+        if withscores:
+            return [(self.decode(item), score) for item, score in items]
+        return [self.decode(item) for item in items]
+
+    def _chunks(self, items):
+        items = list(items)
+        for i in range(0, len(items), self.chunk_size):
+            yield items[i:i + self.chunk_size]
+
+    def _execute_chunked(self, command, key, chunks, client=None):
+        """
+        Runs ``command`` once per chunk of arguments. When there is more than
+        one chunk, the commands are sent in a single non transactional
+        pipeline and the integer replies are added up.
+        """
+        if not client:
+            client = self._client
+        chunks = list(chunks)
+        if isinstance(client, BasePipeline):
+            for chunk in chunks:
+                getattr(client, command)(key, *chunk)
+            return client
+        if not chunks:
+            return 0
+        if len(chunks) == 1:
+            return getattr(client, command)(key, *chunks[0])
+        pipeline = client.pipeline(transaction=False)
+        for chunk in chunks:
+            getattr(pipeline, command)(key, *chunk)
+        return sum(pipeline.execute())
+
     def get_many(self, keys, version=None):
         """
         Retrieve many keys.
         """
         if not keys:
             return {}
-        recovered_data = SortedDict()
+        keys = list(keys)
         new_keys = list(map(lambda key: self.make_key(key, version=version), keys))
-        map_keys = dict(zip(new_keys, keys))
-        results = self._client.mget(new_keys)
-        for key, value in zip(new_keys, results):
+        pending = self._pending_writes(new_keys)
+        known_missing = self._known_missing([key for key in new_keys if key not in pending])
+        fetch_keys = [key for key in new_keys if key not in pending and key not in known_missing]
+        store = self._memo_store()
+        try:
+            if not fetch_keys:
+                results = []
+            elif store is None:
+                results = self._read_client.mget(fetch_keys)
+                self._record_missing(fetch_keys, results)
+            else:
+                missing = [key for key in fetch_keys if key not in store]
+                if missing:
+                    values = self._read_client.mget(missing)
+                    store.update(zip(missing, values))
+                    self._record_missing(missing, values)
+                results = [store[key] for key in fetch_keys]
+        except CircuitOpenError:
+            results = [None] * len(fetch_keys)
+        if pending or known_missing:
+            fetched = dict(zip(fetch_keys, results))
+            results = [pending[key][1] if key in pending else fetched.get(key) for key in new_keys]
+        return self._decode_many(keys, self._join_chunked(new_keys, results))
+
+    def _decode_many(self, keys, values):
+        recovered_data = SortedDict()
+        for key, value in zip(keys, values):
             if value is None:
                 continue
-            try:
-                value = int(value)
-            except (ValueError, TypeError):
-                value = self.unpickle(value)
+            value = self.decode(value)
             if isinstance(value, bytes_type):
                 value = smart_text(value)
-            recovered_data[map_keys[key]] = value
+            recovered_data[key] = value
         return recovered_data
 
     def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
@@ -302,10 +1143,17 @@ class CacheClass(BaseCache):
         If timeout is given, that timeout will be used for the key; otherwise
         the default cache timeout will be used.
         """
+        if self.write_behind is not None:
+            for key, value in data.items():
+                self.set(key, value, timeout, version=version)
+            return
         pipeline = self._client.pipeline()
         for key, value in data.items():
             self.set(key, value, timeout, version=version, client=pipeline)
-        pipeline.execute()
+        try:
+            pipeline.execute()
+        except CircuitOpenError:
+            pass
 
     def incr(self, key, delta=1, version=None):
         """
@@ -313,98 +1161,434 @@ class CacheClass(BaseCache):
         ValueError exception.
         """
         key = self.make_key(key, version=version)
+        self._flush_pending(key)
         exists = self._client.exists(key)
         if not exists:
             raise ValueError("Key '%s' not found" % key)
+        self._forget(key)
         try:
             value = self._client.incr(key, delta)
         except redis.ResponseError:
-            value = self.get(key) + delta
-            self.set(key, value)
+            # The stored value is pickled: rewrite it as an integer, keeping
+            # its expiration time.
+            pipeline = self._client.pipeline(transaction=False)
+            pipeline.get(key)
+            pipeline.ttl(key)
+            value, ttl = pipeline.execute()
+            value = self.decode(value) + delta
+            self.set(key, value, timeout=self._ttl_to_timeout(ttl))
         return value
 
-    def add_to_sorted_set(self, key, value, score, version=None, client=None):
+    def _ttl_to_timeout(self, ttl):
+        # TTL replies ``None`` (or -1 on newer redis-py) for keys without expiry
+        if ttl is None or ttl < 0:
+            return 0
+        return ttl
+
+    def _pipeline_keys(self, keys, queue):
+        """
+        Calls ``queue(pipeline, key)`` for every key, sending ``CHUNK_SIZE``
+        keys per non transactional pipeline. Returns the replies in order.
+        """
+        results = []
+        for chunk in self._chunks(keys):
+            pipeline = self._client.pipeline(transaction=False)
+            for key in chunk:
+                queue(pipeline, key)
+            results.extend(pipeline.execute())
+        return results
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        Update the expiration time of a key without rewriting its value. A
+        timeout of 0 makes the key persistent.
+
+        Returns ``True`` if the key exists, ``False`` if not.
+        """
+        return bool(self.touch_many([key], timeout, version=version))
+
+    def touch_many(self, keys, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        Update the expiration time of many keys at once. Returns the list of
+        keys that existed and were touched.
+        """
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        timeout = int(timeout)
+        if timeout < 0 or not keys:
+            return []
+        keys = list(keys)
+        new_keys = [self.make_key(key, version=version) for key in keys]
+        self._flush_pending(*new_keys)
+        if timeout == 0:
+            # PERSIST replies False for existing keys without expiry as well
+            def queue(pipeline, key):
+                pipeline.exists(key)
+                for name in [key] + self._chunk_keys([key]):
+                    pipeline.persist(name)
+        else:
+            queue = lambda pipeline, key: self._expire(pipeline, key, timeout)
+        # Only keep the reply of EXISTS or EXPIRE for each key
+        step = (2 if timeout == 0 else 1) + (1 if self._chunking else 0)
+        results = self._pipeline_keys(new_keys, queue)[::step]
+        return [key for key, touched in zip(keys, results) if touched]
+
+    def ttl(self, key, version=None):
+        """
+        Returns the remaining time to live of a key, as replied by TTL.
+        """
+        key = self.make_key(key, version=version)
+        self._flush_pending(key)
+        return self._client.ttl(key)
+
+    def ttl_many(self, keys, version=None):
+        """
+        Returns a dict with the remaining time to live of many keys, fetched
+        with pipelined TTL commands.
+        """
+        keys = list(keys)
+        new_keys = [self.make_key(key, version=version) for key in keys]
+        self._flush_pending(*new_keys)
+        return dict(zip(keys, self._pipeline_keys(new_keys, lambda pipeline, key: pipeline.ttl(key))))
+
+    def persist(self, key, version=None):
+        """
+        Remove the expiration time of a key. Returns ``True`` if the key had
+        one.
+        """
+        key = self.make_key(key, version=version)
+        self._flush_pending(key)
+        if not self._chunking:
+            return self._client.persist(key)
+        pipeline = self._client.pipeline()
+        for name in [key] + self._chunk_keys([key]):
+            pipeline.persist(name)
+        return pipeline.execute()[0]
+
+    def _write_expiring(self, key, command, args, timeout, client=None):
+        """
+        Sends a write command and resets the expiration time of ``key`` in
+        the same transaction. ``command`` is the name of a client method, or
+        an upper case Redis command sent as is.
+        """
         if not client:
             client = self._client
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        timeout = int(timeout)
+        if timeout < 0:
+            return False
+
+        def write(client):
+            if command.isupper():
+                return client.execute_command(command, key, *args)
+            return getattr(client, command)(key, *args)
+        if isinstance(client, BasePipeline):
+            self._mark_written(client, [key])
+            if timeout == 0:
+                return write(client)
+            write(client)
+            return self._expire(client, key, timeout)
+        if timeout == 0 and self._bloom_filter is None:
+            return write(client)
+        pipeline = client.pipeline()
+        index = 1 if self._mark_written(pipeline, [key]) else 0
+        write(pipeline)
+        if timeout:
+            self._expire(pipeline, key, timeout)
+        return pipeline.execute()[index]
+
+    def hset(self, key, field, value, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        """
+        Set a single field of a hash, and reset the expiration time of the
+        whole hash in the same transaction.
+        """
         key = self.make_key(key, version=version)
-        if not isinstance(value, int) or isinstance(value, bool):
-            value = pickle.dumps(value)
-        return client.zadd(key, value, score)
+        return self._write_expiring(key, 'hset', (field, self.encode(value)), timeout, client)
 
-    def rem_from_sorted_set(self, key, value, version=None, client=None):
+    def hset_many(self, key, mapping, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        """
+        Set several fields of a hash at once from a dict of field/value pairs.
+        Each value is encoded on its own, so fields can be read back one by one.
+        """
+        if not mapping:
+            return False
+        key = self.make_key(key, version=version)
+        mapping = dict((field, self.encode(value)) for field, value in mapping.items())
+        return self._write_expiring(key, 'hmset', (mapping,), timeout, client)
+
+    def hget(self, key, field, default=None, version=None):
+        key = self.make_key(key, version=version)
+        value = self._read_client.hget(key, field)
+        if value is None:
+            return default
+        return self.decode(value)
+
+    def hget_fields(self, key, fields, version=None):
+        """
+        Retrieve only the given fields of a hash with one HMGET. Returns a
+        dict with the fields that were found.
+        """
+        fields = list(fields)
+        if not fields:
+            return {}
+        key = self.make_key(key, version=version)
+        values = self._read_client.hmget(key, fields)
+        return dict((field, self.decode(value)) for field, value in zip(fields, values) if value is not None)
+
+    def hget_all(self, key, version=None):
+        key = self.make_key(key, version=version)
+        return dict((smart_text(field), self.decode(value))
+                    for field, value in self._read_client.hgetall(key).items())
+
+    def hdel_fields(self, key, fields, version=None, client=None):
         if not client:
             client = self._client
+        fields = list(fields)
+        if not fields:
+            return 0
         key = self.make_key(key, version=version)
-        if not isinstance(value, int) or isinstance(value, bool):
-            value = pickle.dumps(value)
-        return client.zrem(key, value)
+        return client.hdel(key, *fields)
 
-    def sorted_set_range(self, key, start, end, version=None, client=None):
+    def hincr(self, key, field, delta=1, version=None, client=None):
+        """
+        Add delta to an integer field of a hash, creating it if needed.
+        """
         if not client:
             client = self._client
         key = self.make_key(key, version=version)
-        items = client.zrange(key, start, end)
-        result = []
-        for item in items:
-            try:
-                item = int(item)
-            except (ValueError, TypeError):
-                item = self.unpickle(item)
-            result.append(item)
-        return result
+        return client.hincrby(key, field, delta)
+
+    def pfadd(self, key, values, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        """
+        Adds values to the HyperLogLog at ``key``, which counts the distinct
+        values added to it with a standard error of 0.81% in at most 12KB.
+        Returns ``True`` if the count changed.
+        """
+        values = [self.encode(value) for value in values]
+        if not values:
+            return False
+        key = self.make_key(key, version=version)
+        return self._write_expiring(key, 'pfadd', values, timeout, client)
+
+    def _make_keys(self, keys, version=None):
+        if isinstance(keys, (list, tuple, set)):
+            return [self.make_key(key, version=version) for key in keys]
+        return [self.make_key(keys, version=version)]
 
-    def sorted_set_rev_range(self, key, start, num, version=None, client=None):
+    def pfcount(self, keys, version=None, client=None):
+        """
+        Returns the approximate number of distinct values added to the
+        HyperLogLog at ``keys``, or to any of them if ``keys`` is a list.
+        """
         if not client:
-            client = self._client
+            client = self._read_client
+        keys = self._make_keys(keys, version=version)
+        return client.pfcount(*keys)
+
+    def pfmerge(self, destination, keys, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        """
+        Stores at ``destination`` the union of the HyperLogLogs at ``keys``.
+        """
+        destination = self.make_key(destination, version=version)
+        keys = self._make_keys(keys, version=version)
+        return self._write_expiring(destination, 'pfmerge', keys, timeout, client)
+
+    def setbit_many(self, key, offsets, value=1, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        """
+        Sets the bits at ``offsets`` of the bitmap at ``key`` to ``value``
+        with one BITFIELD command. Returns their previous values.
+        """
+        args = []
+        for offset in offsets:
+            args.extend(('SET', 'u1', int(offset), 1 if value else 0))
+        if not args:
+            return []
         key = self.make_key(key, version=version)
-        items = client.zrevrange(key, start, num)
-        result = []
-        for item in items:
+        return self._write_expiring(key, 'BITFIELD', args, timeout, client)
+
+    def getbit_many(self, key, offsets, version=None, client=None):
+        """
+        Returns the bits at ``offsets`` of the bitmap at ``key``, read with
+        one BITFIELD command.
+
+        BITFIELD is a write command that replicas refuse, so reads from them
+        use BITFIELD_RO, or one GETBIT per offset before Redis 6.2.
+        """
+        offsets = [int(offset) for offset in offsets]
+        if not offsets:
+            return []
+        args = []
+        for offset in offsets:
+            args.extend(('GET', 'u1', offset))
+        key = self.make_key(key, version=version)
+        if client or self._read_client is self._client:
+            return (client or self._client).execute_command('BITFIELD', key, *args)
+        if self._bitfield_ro:
             try:
-                item = int(item)
-            except (ValueError, TypeError):
-                item = self.unpickle(item)
-            result.append(item)
-        return result
+                return self._read_client.execute_command('BITFIELD_RO', key, *args)
+            except redis.ResponseError as e:
+                if 'unknown command' not in smart_text(e).lower():
+                    raise
+                self._bitfield_ro = False
+        pipeline = self._read_client.pipeline(transaction=False)
+        for offset in offsets:
+            pipeline.getbit(key, offset)
+        return pipeline.execute()
 
-    def sorted_set_range_by_score(self, key, min, max, start=None, num=None, version=None, client=None):
+    def bitcount(self, key, start=None, end=None, version=None, client=None):
+        """
+        Returns the number of bits set in the bitmap at ``key``, or in its
+        bytes from ``start`` to ``end``.
+        """
+        if not client:
+            client = self._read_client
+        key = self.make_key(key, version=version)
+        return client.bitcount(key, start, end)
+
+    def counter(self, key, field=None, timeout=None, version=None):
+        """
+        Returns a ``Counter`` of the integer at ``key``, or in ``field`` of the
+        hash at ``key``. Its increments are summed in process and sent every
+        few seconds in one pipeline with the other counters, and at exit.
+        With a ``timeout``, the counter expires ``timeout`` seconds after the
+        last flush of its increments.
+        """
+        return Counter(self._counter_buffer(), self.make_key(key, version=version), field, timeout)
+
+    def add_to_sorted_set(self, key, value, score, version=None, client=None):
         if not client:
             client = self._client
         key = self.make_key(key, version=version)
-        items = client.zrangebyscore(key, min, max, start, num)
-        result = []
-        for item in items:
-            try:
-                item = int(item)
-            except (ValueError, TypeError):
-                item = self.unpickle(item)
-            result.append(item)
-        return result
+        return client.zadd(key, self.encode(value), score)
+
+    def add_many_to_sorted_set(self, key, mapping, version=None, client=None):
+        """
+        Add many members to a sorted set from a dict of member/score pairs.
 
-    def sorted_set_rev_range_by_score(self, key, min, max, start=None, num=None, version=None, client=None):
+        Big mappings are split in ``CHUNK_SIZE`` members per ZADD, and all
+        the ZADDs are sent in one pipeline. Returns the number of new members.
+        """
+        key = self.make_key(key, version=version)
+        chunks = []
+        for chunk in self._chunks(mapping.items()):
+            args = []
+            for value, score in chunk:
+                args.extend((self.encode(value), score))
+            chunks.append(args)
+        return self._execute_chunked('zadd', key, chunks, client)
+
+    def rem_from_sorted_set(self, key, value, version=None, client=None):
         if not client:
             client = self._client
         key = self.make_key(key, version=version)
-        items = client.zrevrangebyscore(key, min, max, start, num)
-        result = []
-        for item in items:
-            try:
-                item = int(item)
-            except (ValueError, TypeError):
-                item = self.unpickle(item)
-            result.append(item)
-        return result
+        return client.zrem(key, self.encode(value))
+
+    def rem_many_from_sorted_set(self, key, values, version=None, client=None):
+        """
+        Remove many members from a sorted set, ``CHUNK_SIZE`` members per
+        ZREM. Returns the number of members removed.
+        """
+        key = self.make_key(key, version=version)
+        chunks = [[self.encode(value) for value in chunk] for chunk in self._chunks(values)]
+        return self._execute_chunked('zrem', key, chunks, client)
+
+    def sorted_set_range(self, key, start, end, version=None, client=None, withscores=False):
+        if not client:
+            client = self._read_client
+        key = self.make_key(key, version=version)
+        items = client.zrange(key, start, end, withscores=withscores)
+        return self._decode_items(items, withscores)
+
+    def sorted_set_rev_range(self, key, start, num, version=None, client=None, withscores=False):
+        if not client:
+            client = self._read_client
+        key = self.make_key(key, version=version)
+        items = client.zrevrange(key, start, num, withscores=withscores)
+        return self._decode_items(items, withscores)
+
+    def sorted_set_range_by_score(self, key, min, max, start=None, num=None, version=None, client=None,
+                                  withscores=False):
+        if not client:
+            client = self._read_client
+        key = self.make_key(key, version=version)
+        items = client.zrangebyscore(key, min, max, start, num, withscores=withscores)
+        return self._decode_items(items, withscores)
+
+    def sorted_set_rev_range_by_score(self, key, min, max, start=None, num=None, version=None, client=None,
+                                      withscores=False):
+        if not client:
+            client = self._read_client
+        key = self.make_key(key, version=version)
+        items = client.zrevrangebyscore(key, min, max, start, num, withscores=withscores)
+        return self._decode_items(items, withscores)
+
+    def iter_sorted_set(self, key, by='rank', batch=None, reverse=False, min='-inf', max='+inf',
+                        withscores=False, version=None):
+        """
+        Lazily iterate over a sorted set, fetching ``batch`` members per round
+        trip (``CHUNK_SIZE`` by default) instead of the whole set at once.
+
+        ``by='rank'`` pages with ZRANGE/ZREVRANGE. ``by='score'`` only yields
+        members whose score is within ``min`` and ``max`` and pages with
+        ZRANGEBYSCORE/ZREVRANGEBYSCORE, resuming from the last score seen so
+        each page costs the same no matter how deep the iteration goes.
+        """
+        if by not in ('rank', 'score'):
+            raise ValueError("'by' must be either 'rank' or 'score'")
+        batch = batch or self.chunk_size
+        key = self.make_key(key, version=version)
+        if by == 'rank':
+            pages = self._iter_sorted_set_by_rank(key, batch, reverse)
+        else:
+            pages = self._iter_sorted_set_by_score(key, batch, reverse, min, max)
+        for items in pages:
+            for item, score in items:
+                if withscores:
+                    yield self.decode(item), score
+                else:
+                    yield self.decode(item)
+
+    def _iter_sorted_set_by_rank(self, key, batch, reverse):
+        command = reverse and self._read_client.zrevrange or self._read_client.zrange
+        start = 0
+        while True:
+            items = command(key, start, start + batch - 1, withscores=True)
+            if items:
+                yield items
+            if len(items) < batch:
+                return
+            start += batch
+
+    def _iter_sorted_set_by_score(self, key, batch, reverse, min, max):
+        # ``skip`` counts the members already yielded that share the last
+        # score, so ties spanning several pages are neither lost nor repeated.
+        skip = 0
+        while True:
+            if reverse:
+                items = self._read_client.zrevrangebyscore(key, max, min, skip, batch, withscores=True)
+            else:
+                items = self._read_client.zrangebyscore(key, min, max, skip, batch, withscores=True)
+            if items:
+                yield items
+            if len(items) < batch:
+                return
+            last_score = items[-1][1]
+            ties = len([1 for item, score in items if score == last_score])
+            if reverse:
+                skip = skip + ties if max == last_score else ties
+                max = last_score
+            else:
+                skip = skip + ties if min == last_score else ties
+                min = last_score
 
     def sorted_set_count(self, key, version=None, client=None):
         if not client:
-            client = self._client
+            client = self._read_client
         key = self.make_key(key, version=version)
         return client.zcard(key)
 
-    def sorted_set_intercept(self, destination, keys, aggregate=None, version=None, client=None):
-        if not client:
-            client = self._client
-        destination = self.make_key(destination, version=version)
+    def _make_sorted_set_keys(self, keys, version=None):
         if isinstance(keys, dict):
             new_keys = dict()
             for key, weight in keys.items():
@@ -413,12 +1597,138 @@ class CacheClass(BaseCache):
             new_keys = list()
             for key in keys:
                 new_keys.append(self.make_key(key, version=version))
-        keys = new_keys
+        return new_keys
+
+    def sorted_set_intercept(self, destination, keys, aggregate=None, version=None, client=None):
+        if not client:
+            client = self._client
+        destination = self.make_key(destination, version=version)
+        keys = self._make_sorted_set_keys(keys, version=version)
         return client.zinterstore(destination, keys, aggregate)
 
+    def sorted_set_union(self, destination, keys, aggregate=None, version=None, client=None):
+        if not client:
+            client = self._client
+        destination = self.make_key(destination, version=version)
+        keys = self._make_sorted_set_keys(keys, version=version)
+        return client.zunionstore(destination, keys, aggregate)
+
+    def _sorted_set_query_key(self, digest, keys, version=None):
+        return self.make_key('sorted_set_query:%s' % digest, version=version)
+
+    def sorted_set_query(self, keys, operation='intersection', aggregate=None, timeout=60, version=None):
+        """
+        Computes the intersection or union of the given sorted sets into a
+        temporary key that expires after ``timeout`` seconds, and returns that
+        key so it can be read with the ``sorted_set_*range*`` helpers.
+
+        The temporary key is named after a hash of the operation, keys,
+        weights and aggregate function, so repeating the same query within
+        ``timeout`` reuses the stored result instead of aggregating again.
+        Empty results are not stored by Redis and are recomputed every time.
+        """
+        keys, destination = self._sorted_set_query_keys(keys, operation, aggregate, version)
+        if self._client.exists(destination):
+            return destination
+        pipeline = self._client.pipeline()
+        self._store_sorted_set_query(pipeline, destination, keys, operation, aggregate, timeout)
+        pipeline.execute()
+        return destination
+
+    def _sorted_set_query_keys(self, keys, operation, aggregate, version):
+        if operation not in ('intersection', 'union'):
+            raise ValueError("'operation' must be either 'intersection' or 'union'")
+        keys = self._make_sorted_set_keys(keys, version=version)
+        if isinstance(keys, dict):
+            signature = sorted((smart_text(key), repr(weight)) for key, weight in keys.items())
+        else:
+            signature = sorted(smart_text(key) for key in keys)
+        signature = repr((operation, signature, aggregate))
+        destination = self._sorted_set_query_key(sha1(smart_bytes(signature)).hexdigest(), keys, version=version)
+        return keys, destination
+
+    def _store_sorted_set_query(self, client, destination, keys, operation, aggregate, timeout):
+        if operation == 'intersection':
+            client.zinterstore(destination, keys, aggregate)
+        else:
+            client.zunionstore(destination, keys, aggregate)
+        client.expire(destination, int(timeout))
+
+    @property
+    def scripts(self):
+        return pool.get_script_registry(self.server, self.db)
+
+    def register_script(self, name, source, encode_args=True, decode_result=True):
+        """
+        Registers a Lua script under ``name`` for ``call_script``, e.g.::
+
+            cache.register_script('getset', "return redis.call('GETSET', KEYS[1], ARGV[1])")
+            old_value = cache.call_script('getset', keys=['key'], args=[new_value])
+        """
+        return self.scripts.register(name, source, encode_args, decode_result)
+
+    def load_scripts(self):
+        """
+        Preloads every registered script with SCRIPT LOAD. Scripts missing on
+        the server, e.g. after a restart, are also loaded on their next call.
+        """
+        self.scripts.load(self._client)
+
+    def _encode_script_args(self, script, args):
+        if script.encode_args:
+            return [self.encode(arg) for arg in args]
+        return list(args)
+
+    def _decode_script_result(self, script, result):
+        if not script.decode_result:
+            return result
+        if isinstance(result, list):
+            return [self._decode_script_result(script, item) for item in result]
+        if isinstance(result, bytes_type):
+            return self.decode(result)
+        return result
+
+    def call_script(self, name, keys=(), args=(), version=None, client=None):
+        """
+        Runs a registered script with EVALSHA, loading it first if the
+        server does not know it.
+        """
+        script = self.scripts[name]
+        if client is None:
+            client = self._client
+        keys = [self.make_key(key, version=version) for key in keys]
+        self._forget(*keys)
+        keys_and_args = keys + self._encode_script_args(script, args)
+        if isinstance(client, BasePipeline):
+            # Queued after the script, whose reply is decoded by its index
+            client.evalsha(script.sha, len(keys), *keys_and_args)
+            self._mark_written(client, keys)
+            return client
+        self._mark_written(client, keys)
+        try:
+            result = client.evalsha(script.sha, len(keys), *keys_and_args)
+        except redis.ResponseError as e:
+            if not is_noscript_error(e):
+                raise
+            client.script_load(script.source)
+            result = client.evalsha(script.sha, len(keys), *keys_and_args)
+        return self._decode_script_result(script, result)
+
     def pipeline(self, transaction=True, shard_hint=None):
         return RedisPipeline(self._server, self._params, transaction, shard_hint)
 
+    def batch(self):
+        """
+        Returns a ``CacheBatch`` that sends the reads and writes issued on it
+        in one round trip, e.g.::
+
+            with cache.batch() as batch:
+                user = batch.get('user')
+                batch.set('last_seen', now)
+            user.value
+        """
+        return CacheBatch(self)
+
 
 class RedisCache(CacheClass):
     """
@@ -426,9 +1736,35 @@ class RedisCache(CacheClass):
     """
 
     def make_key(self, key, version=None):
-        if not isinstance(key, CacheKey):
-            key = CacheKey(super(CacheClass, self).make_key(key, version))
-        return key
+        if isinstance(key, CacheKey):
+            return key
+        if version is None:
+            version = self.version
+        if self.key_func is default_key_func:
+            # Same keys as default_key_func, without formatting the prefix
+            # and version again for every key
+            prefix = self._key_prefixes.get(version)
+            if prefix is None:
+                prefix = self._key_prefixes[version] = intern('%s:%s:' % (self.key_prefix, version))
+            new_key = '%s%s' % (prefix, key)
+        else:
+            new_key = self.key_func(key, self.key_prefix, version)
+        if self._max_key_length is not None and len(new_key) > self._max_key_length:
+            new_key = self._hash_key(new_key, version)
+        return CacheKey(new_key)
+
+    def _hash_key(self, key, version):
+        """
+        Replaces a long key by the digest of its value, keeping the prefix,
+        the version and the hash tag, if any, so the key stays on the same
+        cluster node.
+        """
+        from .cluster import hash_tag
+        digest = '#' + sha1(smart_bytes(key)).hexdigest()
+        tag = hash_tag(key)
+        if tag != smart_text(key):
+            digest = '{%s}%s' % (tag, digest)
+        return self.key_func(digest, self.key_prefix, version)
 
     def incr_version(self, key, delta=1, version=None):
         """
@@ -441,22 +1777,73 @@ class RedisCache(CacheClass):
         if version is None:
             version = self.version
         old_key = self.make_key(key, version)
-        value = self.get(old_key, version=version)
-        ttl = self._client.ttl(old_key)
+        self._flush_pending(old_key, self.make_key(key, version=version + delta))
+        pipeline = self._client.pipeline(transaction=False)
+        pipeline.get(old_key)
+        pipeline.ttl(old_key)
+        value, ttl = pipeline.execute()
+        old_keys = [old_key] + self._chunk_keys([old_key])
+        value = self._join_chunked([old_key], [value])[0]
         if value is None:
             raise ValueError("Key '%s' not found" % key)
         new_key = self.make_key(key, version=version + delta)
         # TODO: See if we can check the version of Redis, since 2.2 will be able
         # to rename volitile keys.
-        self.set(new_key, value, timeout=ttl)
-        self.delete(old_key)
+        pipeline = self._client.pipeline()
+        self.set(new_key, self.decode(value), timeout=self._ttl_to_timeout(ttl), client=pipeline)
+        pipeline.delete(*old_keys)
+        pipeline.execute()
+        self._forget(old_key, new_key)
         return version + delta
 
 
 class RedisPipeline(RedisCache):
     def __init__(self, server, params, transaction=True, shard_hint=None):
         super(RedisPipeline, self).__init__(server, params)
-        self._client = self._client.pipeline(transaction, shard_hint)
+        self._script_client = self._client
+        self._client = self._read_client = self._client.pipeline(transaction, shard_hint)
+        # Writes are queued on the pipeline, never buffered
+        self.write_behind = None
+        self._script_replies = []
+
+    def _memo_store(self):
+        # Replies are only known once the pipeline is executed
+        return None
+
+    def _known_missing(self, keys):
+        # Every read must be queued to keep the replies in order
+        return set()
+
+    def _record_missing(self, keys, values):
+        pass
+
+    def sorted_set_query(self, keys, operation='intersection', aggregate=None, timeout=60, version=None):
+        """
+        Queues the aggregation and the expiry of the temporary key, whose
+        name is returned at once: whether a stored result can be reused is
+        only known once the pipeline is executed.
+        """
+        keys, destination = self._sorted_set_query_keys(keys, operation, aggregate, version)
+        self._store_sorted_set_query(self._client, destination, keys, operation, aggregate, timeout)
+        return destination
+
+    def call_script(self, name, keys=(), args=(), version=None, client=None):
+        if client is None:
+            self._script_replies.append((len(self._client.command_stack), self.scripts[name]))
+        return super(RedisPipeline, self).call_script(name, keys, args, version, client)
 
     def execute(self):
-        return self._client.execute()
\ No newline at end of file
+        script_replies, self._script_replies = self._script_replies, []
+        if script_replies:
+            # A NOSCRIPT error would abort the pipeline: load the scripts first
+            self.scripts.load(self._script_client, set(script for index, script in script_replies))
+        internal = pop_internal_commands(self._client)
+        results = self._client.execute()
+        for index, script in script_replies:
+            results[index] = self._decode_script_result(script, results[index])
+        if internal:
+            results = [result for index, result in enumerate(results) if index not in internal]
+        store = request_memo.store(self._memo_namespace)
+        if store:
+            store.clear()
+        return results
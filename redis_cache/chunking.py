@@ -0,0 +1,110 @@
+"""
+Splitting of large encoded values over several keys.
+
+A chunked value is stored as a manifest at its own key, and its chunks as
+the fields ``0`` to ``n - 1`` of a hash at the key prefixed by
+``CHUNKS_PREFIX`` and the hash tag of the key, which no key made by a
+backend starts with. Knowing the
+name of that hash, deleting or expiring a value never has to read its
+manifest first. Each chunk is compressed on its own and the manifest keeps
+the CRC32 checksum of every stored chunk, so a value whose chunks were
+partly overwritten or evicted is detected and read as a miss.
+"""
+import zlib
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from .compat import bytes_type, smart_bytes
+
+
+POLICIES = ('reject', 'warn', 'chunk')
+
+# No pickle starts with a NUL byte, so manifests can't be taken for values
+MANIFEST_PREFIX = b'\x00redis_cache:chunked\x00'
+
+
+# Keys made by the backends start with their KEY_PREFIX and version, never
+# with a NUL byte
+CHUNKS_PREFIX = '\x00redis_cache:chunks\x00'
+
+
+# Writes a chunked value only if its key does not exist, for add() in a
+# pipeline: KEYS are the key and its chunks, ARGV the manifest, the timeout
+# (0 for none) and the chunks
+ADD_CHUNKED_SCRIPT = """
+local added
+if ARGV[2] == '0' then
+    added = redis.call('SET', KEYS[1], ARGV[1], 'NX')
+else
+    added = redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2])
+end
+if not added then
+    return 0
+end
+redis.call('DEL', KEYS[2])
+for i = 3, #ARGV do
+    redis.call('HSET', KEYS[2], i - 3, ARGV[i])
+end
+if ARGV[2] ~= '0' then
+    redis.call('EXPIRE', KEYS[2], ARGV[2])
+end
+return 1
+"""
+
+
+def chunk_key(key):
+    """
+    Returns the key of the chunks of the value at ``key``, with the hash tag
+    of ``key`` so that both live on the same cluster node.
+    """
+    from .cluster import hash_tag
+    tag = hash_tag(key)
+    if '{' in tag or '}' in tag:
+        # Not usable as a hash tag
+        return '%s%s' % (CHUNKS_PREFIX, key)
+    return '%s{%s}%s' % (CHUNKS_PREFIX, tag, key)
+
+
+def _checksum(data):
+    return zlib.crc32(data) & 0xffffffff
+
+
+def split_value(value, chunk_size, compress=True):
+    """
+    Splits an encoded value into chunks of ``chunk_size`` bytes. Returns the
+    manifest to store at the value's key and the list of chunks.
+    """
+    value = smart_bytes(value)
+    chunks = [value[i:i + chunk_size] for i in range(0, len(value), chunk_size)]
+    if compress:
+        chunks = [zlib.compress(chunk) for chunk in chunks]
+    manifest = (len(value), compress, [_checksum(chunk) for chunk in chunks])
+    return MANIFEST_PREFIX + pickle.dumps(manifest, pickle.HIGHEST_PROTOCOL), chunks
+
+
+def is_manifest(value):
+    return isinstance(value, bytes_type) and value.startswith(MANIFEST_PREFIX)
+
+
+def read_manifest(value):
+    """
+    Returns the number of chunks of a manifest and a function joining the
+    chunks back into the encoded value, or returning ``None`` if one of them
+    is missing or corrupted.
+    """
+    size, compressed, checksums = pickle.loads(value[len(MANIFEST_PREFIX):])
+
+    def join(chunks):
+        if len(chunks) != len(checksums):
+            return None
+        for chunk, checksum in zip(chunks, checksums):
+            if chunk is None or _checksum(chunk) != checksum:
+                return None
+        if compressed:
+            chunks = [zlib.decompress(chunk) for chunk in chunks]
+        value = b''.join(chunks)
+        return value if len(value) == size else None
+    return len(checksums), join
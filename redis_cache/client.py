@@ -0,0 +1,80 @@
+import functools
+from contextlib import contextmanager
+
+import redis
+from redis.client import BasePipeline, Pipeline
+
+
+def guarded_call(client, commands, func, *args, **kwargs):
+    """
+    Calls ``func`` through the client's circuit breaker, retrying it with the
+    client's retry policy when every command sent is idempotent.
+    """
+    if client.circuit_breaker is not None:
+        func = functools.partial(client.circuit_breaker.call, func)
+    if client.retry_policy is not None and client.retry_policy.is_idempotent(commands):
+        return client.retry_policy.call(func, *args, **kwargs)
+    return func(*args, **kwargs)
+
+
+@contextmanager
+def internal_commands(client):
+    """
+    Marks the commands queued on ``client`` within the block, when it is a
+    pipeline, as internal to the backend (Bloom filter bits, chunks of large
+    values): ``RedisPipeline`` and ``CacheBatch`` leave their replies out.
+    """
+    if not isinstance(client, BasePipeline):
+        yield
+        return
+    start = len(client.command_stack)
+    yield
+    if not hasattr(client, 'internal_commands'):
+        client.internal_commands = set()
+    client.internal_commands.update(range(start, len(client.command_stack)))
+
+
+def pop_internal_commands(client):
+    """
+    Returns the indexes of the internal commands queued on a pipeline, and
+    forgets them before it is reused.
+    """
+    return client.__dict__.pop('internal_commands', set())
+
+
+class GuardedRedis(redis.Redis):
+    """
+    A Redis client whose commands and pipelines go through a circuit breaker
+    and a retry policy, when they are set.
+    """
+    circuit_breaker = None
+    retry_policy = None
+
+    def execute_command(self, *args, **options):
+        return guarded_call(self, [args], super(GuardedRedis, self).execute_command, *args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipeline = GuardedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+        pipeline.circuit_breaker = self.circuit_breaker
+        pipeline.retry_policy = self.retry_policy
+        return pipeline
+
+
+class GuardedPipeline(Pipeline):
+    circuit_breaker = None
+    retry_policy = None
+
+    def execute(self, raise_on_error=True):
+        if not self.command_stack:
+            return []
+        commands = [args for args, options in self.command_stack]
+        execute = super(GuardedPipeline, self).execute
+        if self.retry_policy is not None and self.retry_policy.is_idempotent(commands):
+            # A failed execute() resets the pipeline, so each attempt
+            # queues the commands again
+            command_stack = list(self.command_stack)
+
+            def execute(raise_on_error):
+                self.command_stack = list(command_stack)
+                return super(GuardedPipeline, self).execute(raise_on_error)
+        return guarded_call(self, commands, execute, raise_on_error)
@@ -0,0 +1,389 @@
+import threading
+
+import redis
+from redis.client import Pipeline
+from django.core.exceptions import ImproperlyConfigured
+
+from .breaker import CONNECTION_ERRORS
+from .cache import CacheKey, RedisCache, RedisPipeline
+from .compat import smart_bytes, smart_text
+
+
+CLUSTER_SLOTS = 16384
+
+
+def _crc16_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = (crc << 1) ^ 0x1021
+            else:
+                crc <<= 1
+        table.append(crc & 0xffff)
+    return table
+CRC16_TABLE = _crc16_table()
+
+
+def crc16(data):
+    """
+    CRC16-CCITT (XMODEM), the checksum Redis Cluster uses to map keys to slots.
+    """
+    crc = 0
+    for byte in bytearray(data):
+        crc = ((crc << 8) & 0xffff) ^ CRC16_TABLE[((crc >> 8) ^ byte) & 0xff]
+    return crc
+
+
+def key_slot(key):
+    """
+    Returns the hash slot of a key. When the key contains a non empty hash
+    tag, e.g. ``{user:1}:followers``, only the tag is hashed, so keys sharing
+    a tag are stored on the same node.
+    """
+    key = key.encoded if isinstance(key, CacheKey) else smart_bytes(smart_text(key))
+    start = key.find(b'{')
+    if start > -1:
+        end = key.find(b'}', start + 1)
+        if end > start + 1:
+            key = key[start + 1:end]
+    return crc16(key) % CLUSTER_SLOTS
+
+
+def hash_tag(key):
+    """
+    Returns the hash tag of a key, or the whole key if it has none.
+    """
+    key = smart_text(key)
+    start = key.find('{')
+    if start > -1:
+        end = key.find('}', start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+class ClusterError(redis.RedisError):
+    pass
+
+
+class ClusterCrossSlotError(ClusterError):
+    """
+    Raised for commands whose keys map to different slots. Use hash tags to
+    store such keys in the same slot.
+    """
+    pass
+
+
+def command_keys(args):
+    """
+    Returns the keys of a command, given the arguments sent to Redis.
+    """
+    command = smart_text(args[0]).upper()
+    if command in ('ZINTERSTORE', 'ZUNIONSTORE'):
+        return [args[1]] + list(args[3:3 + int(args[2])])
+    if command in ('EVAL', 'EVALSHA'):
+        return list(args[3:3 + int(args[2])])
+    if command in ('MGET', 'DEL', 'EXISTS', 'PFCOUNT', 'PFMERGE'):
+        return list(args[1:])
+    if command == 'MSET':
+        return list(args[1::2])
+    return list(args[1:2])
+
+
+def parse_redirection(error):
+    """
+    Returns ``('MOVED' or 'ASK', slot, (host, port))`` for redirection errors,
+    ``None`` for any other error.
+    """
+    if not isinstance(error, redis.ResponseError):
+        return None
+    parts = smart_text(error.args and error.args[0] or '').split()
+    if len(parts) != 3 or parts[0] not in ('MOVED', 'ASK'):
+        return None
+    host, port = parts[2].rsplit(':', 1)
+    return parts[0], int(parts[1]), (host, int(port))
+
+
+def _merge_script_replies(replies):
+    # SCRIPT EXISTS: a script exists only if every master has it
+    if isinstance(replies[0], list):
+        return [all(exists) for exists in zip(*replies)]
+    return replies[0]
+
+
+class RedisClusterClient(redis.Redis):
+    """
+    A client that sends each command to the cluster node serving the slot of
+    its keys, following MOVED and ASK redirections.
+
+    MGET and DEL with keys in several slots are split in one command per slot,
+    sent in one pipeline per node. Other multi-key commands must have all
+    their keys in the same slot.
+    """
+    # Commands without keys sent to every master, and how to merge replies
+    BROADCAST_COMMANDS = {
+        'FLUSHDB': all,
+        'FLUSHALL': all,
+        'DBSIZE': sum,
+        'SCRIPT': lambda replies: _merge_script_replies(replies),
+    }
+
+    def __init__(self, startup_nodes, node_client_factory, max_redirections=5):
+        super(RedisClusterClient, self).__init__()
+        self.startup_nodes = list(startup_nodes)
+        self.node_client_factory = node_client_factory
+        self.max_redirections = max_redirections
+        self.slots = None
+        self._node_clients = {}
+        self._lock = threading.Lock()
+
+    def get_node_client(self, node):
+        if node not in self._node_clients:
+            with self._lock:
+                if node not in self._node_clients:
+                    self._node_clients[node] = self.node_client_factory(*node)
+        return self._node_clients[node]
+
+    def refresh_slots(self):
+        """
+        Loads the slot map with CLUSTER SLOTS from the first node that answers.
+        """
+        nodes = list(set(self.slots or [])) + self.startup_nodes
+        for node in nodes:
+            try:
+                reply = self.get_node_client(node).execute_command('CLUSTER', 'SLOTS')
+            except CONNECTION_ERRORS:
+                continue
+            slots = [None] * CLUSTER_SLOTS
+            for slot_range in reply:
+                start, end, master = slot_range[:3]
+                master = (smart_text(master[0]) or node[0], int(master[1]))
+                for slot in range(int(start), int(end) + 1):
+                    slots[slot] = master
+            self.slots = slots
+            return
+        raise redis.ConnectionError("Could not reach any of the cluster nodes %s" % (self.startup_nodes,))
+
+    def node_for_slot(self, slot):
+        if self.slots is None:
+            self.refresh_slots()
+        node = self.slots[slot]
+        if node is None:
+            raise ClusterError("Slot %s is not served by any node" % slot)
+        return node
+
+    def master_nodes(self):
+        if self.slots is None:
+            self.refresh_slots()
+        return sorted(set(node for node in self.slots if node is not None))
+
+    def slot_for_command(self, args):
+        slots = set(key_slot(key) for key in command_keys(args))
+        if len(slots) > 1:
+            raise ClusterCrossSlotError(
+                "Keys of %s map to different slots, use hash tags to keep them together" % smart_text(args[0])
+            )
+        return slots and slots.pop() or 0
+
+    def execute_on_slot(self, slot, args, options):
+        node = self.node_for_slot(slot)
+        asking = False
+        for attempt in range(self.max_redirections):
+            client = self.get_node_client(node)
+            try:
+                if asking:
+                    # ASKING only applies to the next command on the same connection
+                    pipeline = client.pipeline(transaction=False)
+                    pipeline.execute_command('ASKING')
+                    pipeline.execute_command(*args, **options)
+                    return pipeline.execute()[1]
+                return client.execute_command(*args, **options)
+            except redis.ResponseError as e:
+                redirection = parse_redirection(e)
+                if redirection is None:
+                    raise
+                kind, slot, node = redirection
+                asking = kind == 'ASK'
+                if kind == 'MOVED':
+                    self.slots[slot] = node
+            except CONNECTION_ERRORS:
+                # The node may have been replaced after a failover
+                if attempt == self.max_redirections - 1:
+                    raise
+                self.refresh_slots()
+                node = self.node_for_slot(slot)
+                asking = False
+        raise ClusterError("Too many redirections for %s" % smart_text(args[0]))
+
+    def execute_command(self, *args, **options):
+        # redis-py sends subcommands such as 'SCRIPT LOAD' as a single argument
+        command = smart_text(args[0]).upper().split(' ')[0]
+        if command in self.BROADCAST_COMMANDS:
+            replies = [self.get_node_client(node).execute_command(*args, **options)
+                       for node in self.master_nodes()]
+            return self.BROADCAST_COMMANDS[command](replies)
+        return self.execute_on_slot(self.slot_for_command(args), args, options)
+
+    def mget(self, keys, *args):
+        pipeline = self.pipeline()
+        pipeline.mget(keys, *args)
+        return pipeline.execute()[0]
+
+    def delete(self, *names):
+        pipeline = self.pipeline()
+        pipeline.delete(*names)
+        return pipeline.execute()[0]
+
+    def pipeline(self, transaction=None, shard_hint=None):
+        """
+        Returns a pipeline sending its commands to each node in one round trip.
+        Commands of a cluster pipeline are never run as a transaction, asking
+        for one raises ``ClusterError``.
+        """
+        if transaction:
+            raise ClusterError("Transactions are not supported by cluster pipelines")
+        return RedisClusterPipelineClient(self)
+
+
+class RedisClusterPipelineClient(Pipeline):
+    def __init__(self, cluster):
+        super(RedisClusterPipelineClient, self).__init__(
+            cluster.connection_pool, cluster.response_callbacks, False, None
+        )
+        self.cluster = cluster
+
+    def _split(self, args):
+        """
+        Returns the ``(slot, args)`` sub-commands of a queued command, and a
+        function merging their replies.
+        """
+        command = smart_text(args[0]).upper()
+        if command in ('MGET', 'DEL', 'EXISTS') and len(args) > 2:
+            by_slot = {}
+            order = []
+            for key in args[1:]:
+                slot = key_slot(key)
+                if slot not in by_slot:
+                    by_slot[slot] = []
+                    order.append(slot)
+                by_slot[slot].append(key)
+            sub_commands = [(slot, (args[0],) + tuple(by_slot[slot])) for slot in order]
+            if command != 'MGET':
+                return sub_commands, sum
+
+            def merge(replies):
+                values = dict(zip(order, [list(reply) for reply in replies]))
+                return [values[key_slot(key)].pop(0) for key in args[1:]]
+            return sub_commands, merge
+        return [(self.cluster.slot_for_command(args), args)], lambda replies: replies[0]
+
+    def execute(self, raise_on_error=True):
+        stack = self.command_stack
+        if not stack:
+            return []
+        try:
+            entries = []
+            by_node = {}
+            for args, options in stack:
+                try:
+                    sub_commands, merge = self._split(args)
+                except ClusterCrossSlotError as e:
+                    entries.append(([], e))
+                    continue
+                replies = []
+                for slot, sub_args in sub_commands:
+                    reply = [slot, sub_args, options, None]
+                    by_node.setdefault(self.cluster.node_for_slot(slot), []).append(reply)
+                    replies.append(reply)
+                entries.append((replies, merge))
+            for node, replies in by_node.items():
+                pipeline = self.cluster.get_node_client(node).pipeline(transaction=False)
+                for slot, sub_args, options, _ in replies:
+                    pipeline.execute_command(*sub_args, **options)
+                try:
+                    results = pipeline.execute(raise_on_error=False)
+                except CONNECTION_ERRORS as e:
+                    results = [e] * len(replies)
+                for reply, result in zip(replies, results):
+                    if isinstance(result, CONNECTION_ERRORS) or parse_redirection(result):
+                        # Resend on its own, following redirections
+                        try:
+                            result = self.cluster.execute_on_slot(reply[0], reply[1], reply[2])
+                        except redis.RedisError as e:
+                            result = e
+                    reply[3] = result
+            response = []
+            for replies, merge in entries:
+                if isinstance(merge, Exception):
+                    response.append(merge)
+                    continue
+                results = [reply[3] for reply in replies]
+                errors = [result for result in results if isinstance(result, Exception)]
+                response.append(errors and errors[0] or merge(results))
+            if raise_on_error:
+                for result in response:
+                    if isinstance(result, Exception):
+                        raise result
+            return response
+        finally:
+            self.reset()
+
+
+class RedisClusterCache(RedisCache):
+    """
+    A cache backend for Redis Cluster. ``LOCATION`` lists some of the nodes,
+    as a list or a comma separated string of ``host:port``; the others are
+    discovered from them.
+
+    Keys sharing a hash tag, e.g. ``{user:1}:feed`` and ``{user:1}:likes``,
+    are stored on the same node. The keys of ``sorted_set_intercept``,
+    ``sorted_set_union``, ``pfmerge`` and of ``pfcount`` given several keys
+    must share one.
+    """
+    def _init_clients(self):
+        self._client = self._read_client = RedisClusterClient(self.startup_nodes, self._create_node_client)
+
+    @property
+    def startup_nodes(self):
+        location = self._server or "127.0.0.1:7000"
+        if not isinstance(location, (list, tuple)):
+            location = location.replace(';', ',').split(',')
+        nodes = []
+        for node in location:
+            node = node.strip()
+            if not node:
+                continue
+            try:
+                host, port = node.rsplit(':', 1)
+                nodes.append((host, int(port)))
+            except (ValueError, TypeError):
+                raise ImproperlyConfigured("cluster nodes must be given as host:port")
+        if not nodes:
+            raise ImproperlyConfigured("at least one cluster node is required")
+        return nodes
+
+    @property
+    def server(self):
+        return ','.join('%s:%s' % node for node in self.startup_nodes)
+
+    @property
+    def db(self):
+        # Redis Cluster only has database 0
+        return 0
+
+    def _create_node_client(self, host, port):
+        return self._create_client(host, port, None, 0)
+
+    def _sorted_set_query_key(self, digest, keys, version=None):
+        # Store the result next to the queried sets
+        tag = keys and hash_tag(list(keys)[0]) or ''
+        return self.make_key('sorted_set_query:{%s}:%s' % (tag, digest), version=version)
+
+    def pipeline(self, transaction=None, shard_hint=None):
+        return RedisClusterPipeline(self._server, self._params, transaction, shard_hint)
+
+
+class RedisClusterPipeline(RedisPipeline, RedisClusterCache):
+    pass
@@ -15,8 +15,14 @@ except ImportError:
 
 if PY3:
     bytes_type = bytes
+    from sys import intern
 else:
     bytes_type = str
+    _intern = intern
+
+    def intern(value):
+        # Only byte strings can be interned on Python 2
+        return _intern(value) if isinstance(value, str) else value
 
 if django.VERSION[:2] >= (1, 6):
     from django.core.cache.backends.base import DEFAULT_TIMEOUT as DJANGO_DEFAULT_TIMEOUT
@@ -0,0 +1,126 @@
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python 2.6
+    from django.utils.datastructures import SortedDict as OrderedDict
+
+from .writebehind import WriteBehindBuffer
+
+
+class CounterBuffer(WriteBehindBuffer):
+    """
+    A write-behind buffer of counter increments. The deltas added to the same
+    counter are summed, and a background thread sends them every
+    ``flush_interval`` seconds or ``flush_size`` counters as one pipeline of
+    INCRBY and HINCRBY commands. Increments are never dropped: when
+    ``max_size`` counters are pending, the buffer is flushed in the adding
+    thread, and increments that could not be sent are added back to the
+    pending ones.
+
+    The pending operations are ``(delta, timeout)`` pairs, keyed by
+    ``(key, field)`` with a ``None`` field for plain counters.
+    """
+    def __init__(self, client, write, max_size=10000, flush_size=1000, flush_interval=1, written=None):
+        super(CounterBuffer, self).__init__(client, write, max_size, flush_size, flush_interval, 'flush', written)
+
+    def put(self, key, operation):
+        delta, timeout = operation
+        with self._condition:
+            pending = self._pending.pop(key, None)
+            if pending is not None:
+                delta += pending[0]
+                self.stats['coalesced'] += 1
+            self._pending[key] = (delta, timeout)
+            must_flush = len(self._pending) >= self.max_size
+            if len(self._pending) == 1 or len(self._pending) >= self.flush_size:
+                self._condition.notify()
+            self._start()
+        if must_flush:
+            self.flush()
+        return True
+
+    def _requeue(self, items):
+        with self._condition:
+            pending = OrderedDict(items)
+            for key, (delta, timeout) in self._pending.items():
+                if key in pending:
+                    delta += pending[key][0]
+                pending[key] = (delta, timeout)
+            self._pending = pending
+
+    def pending(self, key):
+        """
+        Returns the sum of the deltas of ``key`` not yet stored in Redis.
+        """
+        with self._condition:
+            return sum(operation[0] for operation in (self._pending.get(key), self._in_flight.get(key))
+                       if operation is not None)
+
+    def read(self, key, read):
+        """
+        Returns ``read(key)`` plus the pending delta of ``key``, without
+        counting twice the deltas sent while reading.
+        """
+        while True:
+            with self._condition:
+                flushing = key in self._in_flight
+                pending = self._pending.get(key)
+                flushes = self.stats['flushes']
+            if flushing:
+                # The delta may or may not be stored yet: wait for the flush
+                with self._flush_lock:
+                    continue
+            stored = read(key)
+            with self._condition:
+                if self.stats['flushes'] == flushes:
+                    return stored + (pending[0] if pending is not None else 0)
+
+
+class Counter(object):
+    """
+    A counter stored in Redis, either at ``key`` or in the ``field`` of the
+    hash at ``key``, whose increments are buffered in process.
+
+        views = cache.counter('views:%s' % page.pk)
+        views.add()
+        views.value()
+    """
+    def __init__(self, buffer, key, field=None, timeout=None):
+        self.buffer = buffer
+        self.key = key
+        self.field = field
+        self.timeout = timeout
+
+    def __repr__(self):
+        if self.field is None:
+            return '<Counter: %s>' % self.key
+        return '<Counter: %s %s>' % (self.key, self.field)
+
+    def add(self, delta=1):
+        """
+        Adds ``delta`` to the counter. It is sent to Redis with the next flush
+        of the buffer, and the counter then expires after ``timeout`` seconds
+        if it is set.
+        """
+        if delta:
+            self.buffer.put((self.key, self.field), (int(delta), self.timeout))
+
+    def _read(self, key):
+        key, field = key
+        if field is None:
+            value = self.buffer.client.get(key)
+        else:
+            value = self.buffer.client.hget(key, field)
+        return int(value) if value is not None else 0
+
+    def value(self):
+        """
+        Returns the value stored in Redis plus the pending increments.
+        """
+        return self.buffer.read((self.key, self.field), self._read)
+
+    def pending(self):
+        return self.buffer.pending((self.key, self.field))
+
+    def flush(self):
+        self.buffer.flush()
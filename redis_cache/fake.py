@@ -0,0 +1,1195 @@
+"""
+An in-memory, thread-safe emulation of a Redis server, for tests and
+benchmarks that should not depend on a running redis-server::
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'redis_cache.RedisCache',
+            'LOCATION': '127.0.0.1:6379',
+            'OPTIONS': {
+                'CONNECTION_POOL_CLASS': 'redis_cache.fake.FakeConnectionPool',
+                'CONNECTION_POOL_CLASS_KWARGS': {'latency': 0.0005},
+            },
+        },
+    }
+
+Backends with the same ``LOCATION`` share one emulated server per process.
+Commands are parsed from what redis-py sends and executed under a lock, so
+pipelines, MULTI/EXEC transactions, expiry and the replies behave as with a
+real server for the commands used by the backends: strings, bitmaps, hashes,
+sorted sets, HyperLogLogs (counted exactly), SCAN, DUMP/RESTORE (in a format
+of their own), MEMORY USAGE and OBJECT ENCODING (estimated) and scripts. Lua
+scripts need the ``lupa`` package. ``latency`` seconds are waited for every
+round trip.
+"""
+import math
+import re
+import threading
+import time
+from collections import deque
+from hashlib import sha1
+from itertools import islice
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import redis
+from redis.connection import BaseParser, Connection
+
+from .compat import smart_bytes, smart_text
+
+try:
+    import lupa
+except ImportError:
+    lupa = None
+
+
+class _Status(bytes):
+    """
+    A status reply, e.g. ``OK``, as opposed to a bulk string reply.
+    """
+
+OK = _Status(b'OK')
+QUEUED = _Status(b'QUEUED')
+
+WRONGTYPE = 'WRONGTYPE Operation against a key holding the wrong kind of value'
+NOT_INTEGER = 'ERR value is not an integer or out of range'
+NOT_FLOAT = 'ERR value is not a valid float'
+SYNTAX_ERROR = 'ERR syntax error'
+
+HLL_MAGIC = b'HYLL'
+DUMP_MAGIC = b'\x00redis_cache.fake\x00'
+
+_parser = BaseParser()
+
+
+def error(message):
+    """
+    Returns the exception redis-py raises for the given error reply.
+    """
+    return _parser.parse_error(message)
+
+
+class CommandError(Exception):
+    def __init__(self, message):
+        super(CommandError, self).__init__(message)
+        self.reply = error(message)
+
+
+def _int(value, message=NOT_INTEGER):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise CommandError(message)
+
+
+def _float(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise CommandError(NOT_FLOAT)
+    if math.isnan(value):
+        raise CommandError(NOT_FLOAT)
+    return value
+
+
+def _score(score):
+    return smart_bytes('%.17g' % score)
+
+
+def _score_bound(value):
+    """
+    Parses a ZRANGEBYSCORE bound, returning ``(score, exclusive)``.
+    """
+    value = smart_bytes(value)
+    if value.startswith(b'('):
+        return _float(value[1:]), True
+    return _float(value), False
+
+
+def _above(score, bound):
+    return score > bound[0] or (score == bound[0] and not bound[1])
+
+
+def _below(score, bound):
+    return score < bound[0] or (score == bound[0] and not bound[1])
+
+
+def _slice(length, start, end):
+    # Inclusive, possibly negative, indexes as in ZRANGE and GETRANGE
+    if start < 0:
+        start = max(length + start, 0)
+    if end < 0:
+        end = length + end
+    end = min(end, length - 1)
+    return start, end + 1
+
+
+def _glob_regex(pattern):
+    """
+    Translates a Redis glob pattern, where a backslash escapes the next
+    character, to a regular expression.
+    """
+    pattern = bytearray(smart_bytes(pattern))
+    regex, i = [], 0
+    while i < len(pattern):
+        char = pattern[i:i + 1]
+        if char == b'\\' and i + 1 < len(pattern):
+            i += 1
+            regex.append(re.escape(bytes(pattern[i:i + 1])))
+        elif char == b'*':
+            regex.append(b'.*')
+        elif char == b'?':
+            regex.append(b'.')
+        elif char == b'[':
+            i += 1
+            negate = pattern[i:i + 1] == b'^'
+            if negate:
+                i += 1
+            members = []
+            while i < len(pattern) and pattern[i:i + 1] != b']':
+                if pattern[i:i + 1] == b'\\' and i + 1 < len(pattern):
+                    i += 1
+                member = re.escape(bytes(pattern[i:i + 1]))
+                if pattern[i + 1:i + 2] == b'-' and i + 2 < len(pattern) and pattern[i + 2:i + 3] != b']':
+                    member += b'-' + re.escape(bytes(pattern[i + 2:i + 3]))
+                    i += 2
+                members.append(member)
+                i += 1
+            if not members:
+                # An empty class matches nothing
+                regex.append(b'(?!)')
+            else:
+                regex.append(b'[' + (b'^' if negate else b'') + b''.join(members) + b']')
+        else:
+            regex.append(re.escape(bytes(char)))
+        i += 1
+    return re.compile(b''.join(regex) + b'\\Z', re.DOTALL)
+
+
+def _glob_match(key, pattern, _cache={}):
+    regex = _cache.get(pattern)
+    if regex is None:
+        if len(_cache) > 100:
+            _cache.clear()
+        regex = _cache[pattern] = _glob_regex(pattern)
+    return regex.match(key) is not None
+
+
+class SortedSet(dict):
+    """
+    The members of a sorted set, mapped to their scores.
+    """
+    def ordered(self):
+        return sorted(self.items(), key=lambda item: (item[1], item[0]))
+
+
+def _get_bits(data, offset, width):
+    value = 0
+    for position in range(offset, offset + width):
+        byte = position >> 3
+        bit = (data[byte] >> (7 - (position & 7))) & 1 if byte < len(data) else 0
+        value = (value << 1) | bit
+    return value
+
+
+def _set_bits(data, offset, width, value):
+    last = (offset + width - 1) >> 3
+    if last >= len(data):
+        data.extend(bytearray(last + 1 - len(data)))
+    for i in range(width):
+        position = offset + i
+        mask = 0x80 >> (position & 7)
+        if (value >> (width - 1 - i)) & 1:
+            data[position >> 3] |= mask
+        else:
+            data[position >> 3] &= ~mask & 0xff
+
+
+def _bitfield_type(value):
+    value = smart_text(value).lower()
+    signed = value[:1] == 'i'
+    if value[:1] not in ('i', 'u'):
+        raise CommandError('ERR Invalid bitfield type. Use something like i16 u8. '
+                           'Note that u64 is not supported but i64 is.')
+    width = _int(value[1:])
+    if not 0 < width <= (64 if signed else 63):
+        raise CommandError('ERR Invalid bitfield type. Use something like i16 u8. '
+                           'Note that u64 is not supported but i64 is.')
+    return signed, width
+
+
+def _hll_members(value):
+    if not value.startswith(HLL_MAGIC):
+        raise CommandError('WRONGTYPE Key is not a valid HyperLogLog string value.')
+    return set(value[i:i + 8] for i in range(len(HLL_MAGIC), len(value), 8))
+
+
+def _hll_value(members):
+    return HLL_MAGIC + b''.join(sorted(members))
+
+
+class FakeServer(object):
+    """
+    The databases of an emulated Redis server. ``execute(db, args)`` runs one
+    command and returns its reply, or the exception for an error reply.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.RLock()
+        self.databases = {}
+        self.scripts = {}
+        self._lua = None
+        self._lua_functions = {}
+        self._script_db = None
+        self._script_error = None
+        self._commands = 0
+
+    def __repr__(self):
+        return '<FakeServer: %s>' % self.name
+
+    def _data(self, db):
+        if db not in self.databases:
+            self.databases[db] = ({}, {})
+        return self.databases[db]
+
+    def execute(self, db, args):
+        name = smart_text(args[0]).lower()
+        method = getattr(self, 'command_' + name, None)
+        if method is None:
+            return error("ERR unknown command '%s'" % smart_text(args[0]))
+        with self.lock:
+            self._commands += 1
+            if self._commands % 100 == 0:
+                self._expire_some(db)
+            try:
+                return method(db, *args[1:])
+            except CommandError as e:
+                return e.reply
+            except TypeError:
+                return error("ERR wrong number of arguments for '%s' command" % name)
+
+    def flushall(self):
+        with self.lock:
+            self.databases.clear()
+            self.scripts.clear()
+            self._lua_functions.clear()
+
+    # Keys and expiry
+
+    def _expired(self, db, key):
+        data, expires = self._data(db)
+        expires_at = expires.get(key)
+        if expires_at is not None and expires_at <= time.time() * 1000:
+            del expires[key]
+            data.pop(key, None)
+            return True
+        return False
+
+    def _expire_some(self, db):
+        data, expires = self._data(db)
+        now = time.time() * 1000
+        for key in [key for key, expires_at in islice(expires.items(), 20) if expires_at <= now]:
+            del expires[key]
+            data.pop(key, None)
+
+    def _expire_all(self, db):
+        data, expires = self._data(db)
+        now = time.time() * 1000
+        for key in [key for key, expires_at in expires.items() if expires_at <= now]:
+            del expires[key]
+            data.pop(key, None)
+
+    def _get(self, db, key, kind=None):
+        if self._expired(db, key):
+            return None
+        value = self._data(db)[0].get(key)
+        if value is not None and kind is not None and not isinstance(value, kind):
+            raise CommandError(WRONGTYPE)
+        return value
+
+    def _set(self, db, key, value, keep_ttl=False):
+        data, expires = self._data(db)
+        data[key] = value
+        if not keep_ttl:
+            expires.pop(key, None)
+
+    def _delete(self, db, key):
+        data, expires = self._data(db)
+        expires.pop(key, None)
+        return data.pop(key, None) is not None
+
+    def _keys(self, db, pattern=None):
+        self._expire_all(db)
+        keys = sorted(self._data(db)[0])
+        if pattern is not None and pattern != b'*':
+            keys = [key for key in keys if _glob_match(key, pattern)]
+        return keys
+
+    def _type(self, value):
+        if isinstance(value, bytes):
+            return 'string'
+        if isinstance(value, SortedSet):
+            return 'zset'
+        return 'hash'
+
+    def command_ping(self, db, message=None):
+        return _Status(b'PONG') if message is None else message
+
+    def command_echo(self, db, message):
+        return message
+
+    def command_del(self, db, *keys):
+        if not keys:
+            raise TypeError
+        return len([key for key in keys if not self._expired(db, key) and self._delete(db, key)])
+
+    command_unlink = command_del
+
+    def command_exists(self, db, *keys):
+        if not keys:
+            raise TypeError
+        return len([key for key in keys if self._get(db, key) is not None])
+
+    def command_type(self, db, key):
+        value = self._get(db, key)
+        return _Status(b'none' if value is None else smart_bytes(self._type(value)))
+
+    def command_keys(self, db, pattern):
+        return self._keys(db, pattern)
+
+    def command_dbsize(self, db):
+        self._expire_all(db)
+        return len(self._data(db)[0])
+
+    def command_scan(self, db, cursor, *args):
+        cursor = _int(cursor, 'ERR invalid cursor')
+        pattern, count, kind = None, 10, None
+        args = list(args)
+        while args:
+            option = smart_text(args.pop(0)).upper()
+            if not args:
+                raise CommandError(SYNTAX_ERROR)
+            if option == 'MATCH':
+                pattern = args.pop(0)
+            elif option == 'COUNT':
+                count = _int(args.pop(0))
+            elif option == 'TYPE':
+                kind = smart_text(args.pop(0)).lower()
+            else:
+                raise CommandError(SYNTAX_ERROR)
+        # The cursor is an index in the sorted keys: keys added or removed
+        # meanwhile may be missed, as a real SCAN may do
+        keys = self._keys(db)
+        page = keys[cursor:cursor + max(count, 1)]
+        cursor = cursor + len(page)
+        if cursor >= len(keys):
+            cursor = 0
+        if pattern is not None:
+            page = [key for key in page if _glob_match(key, pattern)]
+        if kind is not None:
+            data = self._data(db)[0]
+            page = [key for key in page if self._type(data[key]) == kind]
+        return [smart_bytes(cursor), page]
+
+    def command_flushdb(self, db, *args):
+        self.databases.pop(db, None)
+        return OK
+
+    def command_flushall(self, db, *args):
+        self.databases.clear()
+        return OK
+
+    def _expire_at(self, db, key, milliseconds):
+        if self._get(db, key) is None:
+            return 0
+        if milliseconds <= time.time() * 1000:
+            self._delete(db, key)
+        else:
+            self._data(db)[1][key] = milliseconds
+        return 1
+
+    def command_expire(self, db, key, seconds):
+        return self._expire_at(db, key, time.time() * 1000 + _int(seconds) * 1000)
+
+    def command_pexpire(self, db, key, milliseconds):
+        return self._expire_at(db, key, time.time() * 1000 + _int(milliseconds))
+
+    def command_expireat(self, db, key, timestamp):
+        return self._expire_at(db, key, _int(timestamp) * 1000)
+
+    def command_pexpireat(self, db, key, timestamp):
+        return self._expire_at(db, key, _int(timestamp))
+
+    def command_pttl(self, db, key):
+        if self._get(db, key) is None:
+            return -2
+        expires_at = self._data(db)[1].get(key)
+        if expires_at is None:
+            return -1
+        return max(int(round(expires_at - time.time() * 1000)), 0)
+
+    def command_ttl(self, db, key):
+        ttl = self.command_pttl(db, key)
+        return ttl if ttl < 0 else int((ttl + 500) / 1000)
+
+    def command_persist(self, db, key):
+        if self._get(db, key) is None:
+            return 0
+        return 1 if self._data(db)[1].pop(key, None) is not None else 0
+
+    def command_dump(self, db, key):
+        value = self._get(db, key)
+        if value is None:
+            return None
+        if isinstance(value, dict):
+            value = (self._type(value), dict(value))
+        return DUMP_MAGIC + pickle.dumps(value, 2)
+
+    def command_restore(self, db, key, ttl, payload, *args):
+        ttl = _int(ttl)
+        replace = [smart_text(arg).upper() for arg in args] == ['REPLACE']
+        if args and not replace:
+            raise CommandError(SYNTAX_ERROR)
+        if not replace and self._get(db, key) is not None:
+            raise CommandError('BUSYKEY Target key name already exists.')
+        if not payload.startswith(DUMP_MAGIC):
+            raise CommandError('ERR DUMP payload version or checksum are wrong')
+        value = pickle.loads(payload[len(DUMP_MAGIC):])
+        if isinstance(value, tuple):
+            kind, items = value
+            value = SortedSet(items) if kind == 'zset' else dict(items)
+        self._set(db, key, value)
+        if ttl > 0:
+            self._data(db)[1][key] = time.time() * 1000 + ttl
+        return OK
+
+    def _memory_usage(self, key, value):
+        # A rough estimate of the memory used by the key
+        if isinstance(value, bytes):
+            size = len(value)
+        else:
+            size = sum(len(field) + (len(item) if isinstance(item, bytes) else 8) + 16
+                       for field, item in value.items())
+        return len(key) + size + 56
+
+    def command_memory(self, db, subcommand, *args):
+        subcommand = smart_text(subcommand).upper()
+        if subcommand != 'USAGE':
+            raise CommandError("ERR unknown subcommand '%s'" % subcommand)
+        value = self._get(db, args[0])
+        return None if value is None else self._memory_usage(args[0], value)
+
+    def command_object(self, db, subcommand, key):
+        if smart_text(subcommand).upper() != 'ENCODING':
+            raise CommandError("ERR unknown subcommand '%s'" % smart_text(subcommand))
+        value = self._get(db, key)
+        if value is None:
+            return None
+        if isinstance(value, bytes):
+            try:
+                if len(value) <= 20 and smart_bytes(int(value)) == value:
+                    return b'int'
+            except ValueError:
+                pass
+            return b'embstr' if len(value) <= 44 else b'raw'
+        if isinstance(value, SortedSet):
+            small = len(value) <= 128 and all(len(member) <= 64 for member in value)
+            return b'ziplist' if small else b'skiplist'
+        small = len(value) <= 512 and all(len(field) <= 64 and len(item) <= 64 for field, item in value.items())
+        return b'ziplist' if small else b'hashtable'
+
+    # Strings
+
+    def command_get(self, db, key):
+        return self._get(db, key, bytes)
+
+    def command_mget(self, db, *keys):
+        if not keys:
+            raise TypeError
+        values = []
+        for key in keys:
+            value = self._get(db, key)
+            values.append(value if isinstance(value, bytes) else None)
+        return values
+
+    def command_set(self, db, key, value, *args):
+        args = list(args)
+        expires_at = None
+        nx = xx = False
+        while args:
+            option = smart_text(args.pop(0)).upper()
+            if option in ('EX', 'PX') and args:
+                ttl = _int(args.pop(0))
+                if ttl <= 0:
+                    raise CommandError('ERR invalid expire time in set')
+                expires_at = time.time() * 1000 + (ttl * 1000 if option == 'EX' else ttl)
+            elif option == 'NX':
+                nx = True
+            elif option == 'XX':
+                xx = True
+            else:
+                raise CommandError(SYNTAX_ERROR)
+        exists = self._get(db, key) is not None
+        if (nx and exists) or (xx and not exists):
+            return None
+        self._set(db, key, value)
+        if expires_at is not None:
+            self._data(db)[1][key] = expires_at
+        return OK
+
+    def command_setnx(self, db, key, value):
+        return 1 if self.command_set(db, key, value, b'NX') is not None else 0
+
+    def command_setex(self, db, key, seconds, value):
+        if _int(seconds) <= 0:
+            raise CommandError('ERR invalid expire time in setex')
+        return self.command_set(db, key, value, b'EX', seconds)
+
+    def command_psetex(self, db, key, milliseconds, value):
+        if _int(milliseconds) <= 0:
+            raise CommandError('ERR invalid expire time in psetex')
+        return self.command_set(db, key, value, b'PX', milliseconds)
+
+    def command_getset(self, db, key, value):
+        old = self._get(db, key, bytes)
+        self._set(db, key, value)
+        return old
+
+    def command_mset(self, db, *args):
+        if not args or len(args) % 2:
+            raise TypeError
+        for key, value in zip(args[::2], args[1::2]):
+            self._set(db, key, value)
+        return OK
+
+    def command_strlen(self, db, key):
+        return len(self._get(db, key, bytes) or b'')
+
+    def command_append(self, db, key, value):
+        value = (self._get(db, key, bytes) or b'') + value
+        self._set(db, key, value, keep_ttl=True)
+        return len(value)
+
+    def command_getrange(self, db, key, start, end):
+        value = self._get(db, key, bytes) or b''
+        start, end = _slice(len(value), _int(start), _int(end))
+        return value[start:end]
+
+    def command_incrby(self, db, key, increment):
+        value = self._get(db, key, bytes)
+        value = _int(value if value is not None else 0) + _int(increment)
+        if not -2 ** 63 <= value < 2 ** 63:
+            raise CommandError('ERR increment or decrement would overflow')
+        self._set(db, key, smart_bytes(value), keep_ttl=True)
+        return value
+
+    def command_incr(self, db, key):
+        return self.command_incrby(db, key, 1)
+
+    def command_decrby(self, db, key, decrement):
+        return self.command_incrby(db, key, -_int(decrement))
+
+    def command_decr(self, db, key):
+        return self.command_incrby(db, key, -1)
+
+    # Bitmaps
+
+    def _bitmap(self, db, key):
+        return bytearray(self._get(db, key, bytes) or b'')
+
+    def command_setbit(self, db, key, offset, value):
+        offset = _int(offset, 'ERR bit offset is not an integer or out of range')
+        if offset < 0:
+            raise CommandError('ERR bit offset is not an integer or out of range')
+        if value not in (b'0', b'1'):
+            raise CommandError('ERR bit is not an integer or out of range')
+        data = self._bitmap(db, key)
+        old = _get_bits(data, offset, 1)
+        _set_bits(data, offset, 1, int(value))
+        self._set(db, key, bytes(data), keep_ttl=True)
+        return old
+
+    def command_getbit(self, db, key, offset):
+        offset = _int(offset, 'ERR bit offset is not an integer or out of range')
+        return _get_bits(self._bitmap(db, key), offset, 1)
+
+    def command_bitcount(self, db, key, *args):
+        data = self._bitmap(db, key)
+        if args:
+            if len(args) != 2:
+                raise CommandError(SYNTAX_ERROR)
+            start, end = _slice(len(data), _int(args[0]), _int(args[1]))
+            data = data[start:end]
+        return sum(bin(byte).count('1') for byte in data)
+
+    def command_bitfield(self, db, key, *args):
+        data = self._bitmap(db, key)
+        original = bytes(data)
+        replies = []
+        args = list(args)
+        while args:
+            operation = smart_text(args.pop(0)).upper()
+            if operation == 'OVERFLOW':
+                if not args or smart_text(args.pop(0)).upper() != 'WRAP':
+                    raise CommandError('ERR Only the WRAP overflow behavior is supported')
+                continue
+            if operation not in ('GET', 'SET', 'INCRBY') or len(args) < (2 if operation == 'GET' else 3):
+                raise CommandError(SYNTAX_ERROR)
+            signed, width = _bitfield_type(args.pop(0))
+            offset = smart_text(args.pop(0))
+            if offset.startswith('#'):
+                offset = _int(offset[1:], 'ERR bit offset is not an integer or out of range') * width
+            else:
+                offset = _int(offset, 'ERR bit offset is not an integer or out of range')
+            if offset < 0:
+                raise CommandError('ERR bit offset is not an integer or out of range')
+            old = _get_bits(data, offset, width)
+            if signed and old >> (width - 1):
+                old -= 1 << width
+            if operation == 'GET':
+                replies.append(old)
+                continue
+            argument = _int(args.pop(0))
+            value = argument if operation == 'SET' else old + argument
+            value &= (1 << width) - 1
+            _set_bits(data, offset, width, value)
+            if operation == 'SET':
+                replies.append(old)
+            else:
+                if signed and value >> (width - 1):
+                    value -= 1 << width
+                replies.append(value)
+        if bytes(data) != original:
+            self._set(db, key, bytes(data), keep_ttl=True)
+        return replies
+
+    def command_bitfield_ro(self, db, key, *args):
+        if len(args) % 3 or any(smart_text(operation).upper() != 'GET' for operation in args[::3]):
+            raise CommandError('ERR BITFIELD_RO only supports the GET subcommand')
+        return self.command_bitfield(db, key, *args)
+
+    # Hashes
+
+    def _hash(self, db, key, create=False):
+        value = self._get(db, key, dict)
+        if isinstance(value, SortedSet):
+            raise CommandError(WRONGTYPE)
+        if value is None and create:
+            value = {}
+            self._set(db, key, value)
+        return value
+
+    def _drop_if_empty(self, db, key, value):
+        if not value:
+            self._delete(db, key)
+
+    def command_hset(self, db, key, *args):
+        if not args or len(args) % 2:
+            raise TypeError
+        value = self._hash(db, key, create=True)
+        created = 0
+        for field, item in zip(args[::2], args[1::2]):
+            created += field not in value
+            value[field] = item
+        return created
+
+    def command_hmset(self, db, key, *args):
+        self.command_hset(db, key, *args)
+        return OK
+
+    def command_hsetnx(self, db, key, field, item):
+        value = self._hash(db, key, create=True)
+        if field in value:
+            return 0
+        value[field] = item
+        return 1
+
+    def command_hget(self, db, key, field):
+        return (self._hash(db, key) or {}).get(field)
+
+    def command_hmget(self, db, key, *fields):
+        if not fields:
+            raise TypeError
+        value = self._hash(db, key) or {}
+        return [value.get(field) for field in fields]
+
+    def command_hgetall(self, db, key):
+        reply = []
+        for field, item in (self._hash(db, key) or {}).items():
+            reply.extend((field, item))
+        return reply
+
+    def command_hkeys(self, db, key):
+        return list((self._hash(db, key) or {}).keys())
+
+    def command_hvals(self, db, key):
+        return list((self._hash(db, key) or {}).values())
+
+    def command_hlen(self, db, key):
+        return len(self._hash(db, key) or {})
+
+    def command_hexists(self, db, key, field):
+        return 1 if field in (self._hash(db, key) or {}) else 0
+
+    def command_hdel(self, db, key, *fields):
+        if not fields:
+            raise TypeError
+        value = self._hash(db, key)
+        if value is None:
+            return 0
+        deleted = len([field for field in fields if value.pop(field, None) is not None])
+        self._drop_if_empty(db, key, value)
+        return deleted
+
+    def command_hincrby(self, db, key, field, increment):
+        value = self._hash(db, key, create=True)
+        item = _int(value.get(field, 0), 'ERR hash value is not an integer') + _int(increment)
+        value[field] = smart_bytes(item)
+        return item
+
+    # Sorted sets
+
+    def _sorted_set(self, db, key, create=False):
+        value = self._get(db, key, SortedSet)
+        if value is None and create:
+            value = SortedSet()
+            self._set(db, key, value)
+        return value
+
+    def command_zadd(self, db, key, *args):
+        args = list(args)
+        nx = xx = ch = incr = False
+        while args and smart_text(args[0]).upper() in ('NX', 'XX', 'CH', 'INCR'):
+            option = smart_text(args.pop(0)).upper()
+            nx, xx = nx or option == 'NX', xx or option == 'XX'
+            ch, incr = ch or option == 'CH', incr or option == 'INCR'
+        if not args or len(args) % 2 or (nx and xx) or (incr and len(args) != 2):
+            raise CommandError(SYNTAX_ERROR)
+        pairs = [(_float(score), member) for score, member in zip(args[::2], args[1::2])]
+        value = self._sorted_set(db, key, create=not xx)
+        if value is None:
+            return None if incr else 0
+        added = changed = 0
+        for score, member in pairs:
+            if member in value:
+                if nx:
+                    continue
+                if incr:
+                    score += value[member]
+                if value[member] != score:
+                    changed += 1
+            else:
+                if xx:
+                    continue
+                added += 1
+            value[member] = score
+        self._drop_if_empty(db, key, value)
+        if incr:
+            return _score(value[pairs[0][1]]) if pairs[0][1] in value else None
+        return added + changed if ch else added
+
+    def command_zincrby(self, db, key, increment, member):
+        return self.command_zadd(db, key, b'INCR', increment, member)
+
+    def command_zrem(self, db, key, *members):
+        if not members:
+            raise TypeError
+        value = self._sorted_set(db, key)
+        if value is None:
+            return 0
+        removed = len([member for member in members if value.pop(member, None) is not None])
+        self._drop_if_empty(db, key, value)
+        return removed
+
+    def command_zcard(self, db, key):
+        return len(self._sorted_set(db, key) or ())
+
+    def command_zscore(self, db, key, member):
+        score = (self._sorted_set(db, key) or {}).get(member)
+        return None if score is None else _score(score)
+
+    def command_zrank(self, db, key, member, reverse=False):
+        items = (self._sorted_set(db, key) or SortedSet()).ordered()
+        if reverse:
+            items.reverse()
+        for rank, (item, score) in enumerate(items):
+            if item == member:
+                return rank
+        return None
+
+    def command_zrevrank(self, db, key, member):
+        return self.command_zrank(db, key, member, reverse=True)
+
+    def _range_reply(self, items, withscores):
+        reply = []
+        for member, score in items:
+            reply.append(member)
+            if withscores:
+                reply.append(_score(score))
+        return reply
+
+    def _zrange(self, db, key, start, end, args, reverse):
+        withscores = [smart_text(arg).upper() for arg in args] == ['WITHSCORES']
+        if args and not withscores:
+            raise CommandError(SYNTAX_ERROR)
+        items = (self._sorted_set(db, key) or SortedSet()).ordered()
+        if reverse:
+            items.reverse()
+        start, end = _slice(len(items), _int(start), _int(end))
+        return self._range_reply(items[start:end], withscores)
+
+    def command_zrange(self, db, key, start, end, *args):
+        return self._zrange(db, key, start, end, args, reverse=False)
+
+    def command_zrevrange(self, db, key, start, end, *args):
+        return self._zrange(db, key, start, end, args, reverse=True)
+
+    def _zrangebyscore(self, db, key, low, high, args, reverse):
+        low, high = _score_bound(low), _score_bound(high)
+        withscores = False
+        offset, count = 0, -1
+        args = list(args)
+        while args:
+            option = smart_text(args.pop(0)).upper()
+            if option == 'WITHSCORES':
+                withscores = True
+            elif option == 'LIMIT' and len(args) >= 2:
+                offset, count = _int(args.pop(0)), _int(args.pop(0))
+            else:
+                raise CommandError(SYNTAX_ERROR)
+        items = [(member, score) for member, score in (self._sorted_set(db, key) or SortedSet()).ordered()
+                 if _above(score, low) and _below(score, high)]
+        if reverse:
+            items.reverse()
+        if offset < 0:
+            return []
+        items = items[offset:] if count < 0 else items[offset:offset + count]
+        return self._range_reply(items, withscores)
+
+    def command_zrangebyscore(self, db, key, low, high, *args):
+        return self._zrangebyscore(db, key, low, high, args, reverse=False)
+
+    def command_zrevrangebyscore(self, db, key, high, low, *args):
+        return self._zrangebyscore(db, key, low, high, args, reverse=True)
+
+    def command_zcount(self, db, key, low, high):
+        low, high = _score_bound(low), _score_bound(high)
+        return len([score for score in (self._sorted_set(db, key) or {}).values()
+                    if _above(score, low) and _below(score, high)])
+
+    def _zstore(self, db, destination, numkeys, args, intersect):
+        numkeys = _int(numkeys)
+        args = list(args)
+        if numkeys < 1 or len(args) < numkeys:
+            raise CommandError('ERR at least 1 input key is needed for ZUNIONSTORE/ZINTERSTORE')
+        keys, args = args[:numkeys], args[numkeys:]
+        weights = [1.0] * numkeys
+        aggregate = 'SUM'
+        while args:
+            option = smart_text(args.pop(0)).upper()
+            if option == 'WEIGHTS' and len(args) >= numkeys:
+                weights = [_float(weight) for weight in args[:numkeys]]
+                args = args[numkeys:]
+            elif option == 'AGGREGATE' and args:
+                aggregate = smart_text(args.pop(0)).upper()
+                if aggregate not in ('SUM', 'MIN', 'MAX'):
+                    raise CommandError(SYNTAX_ERROR)
+            else:
+                raise CommandError(SYNTAX_ERROR)
+        sets = [self._sorted_set(db, key) or SortedSet() for key in keys]
+        members = set(sets[0]) if intersect else set()
+        for value in sets:
+            members = members & set(value) if intersect else members | set(value)
+        combine = {'SUM': lambda a, b: a + b, 'MIN': min, 'MAX': max}[aggregate]
+        result = SortedSet()
+        for member in members:
+            scores = [value[member] * weight for value, weight in zip(sets, weights) if member in value]
+            score = scores[0]
+            for other in scores[1:]:
+                score = combine(score, other)
+            result[member] = score
+        self._delete(db, destination)
+        if result:
+            self._set(db, destination, result)
+        return len(result)
+
+    def command_zinterstore(self, db, destination, numkeys, *args):
+        return self._zstore(db, destination, numkeys, args, intersect=True)
+
+    def command_zunionstore(self, db, destination, numkeys, *args):
+        return self._zstore(db, destination, numkeys, args, intersect=False)
+
+    # HyperLogLogs, counted exactly from 64 bit digests of their members
+
+    def _hll(self, db, key):
+        value = self._get(db, key, bytes)
+        return None if value is None else _hll_members(value)
+
+    def command_pfadd(self, db, key, *elements):
+        members = self._hll(db, key)
+        created = members is None
+        members = members or set()
+        size = len(members)
+        members.update(sha1(element).digest()[:8] for element in elements)
+        if created or len(members) != size:
+            self._set(db, key, _hll_value(members), keep_ttl=True)
+            return 1
+        return 0
+
+    def command_pfcount(self, db, *keys):
+        if not keys:
+            raise TypeError
+        members = set()
+        for key in keys:
+            members.update(self._hll(db, key) or ())
+        return len(members)
+
+    def command_pfmerge(self, db, destination, *keys):
+        members = self._hll(db, destination) or set()
+        for key in keys:
+            members.update(self._hll(db, key) or ())
+        self._set(db, destination, _hll_value(members), keep_ttl=True)
+        return OK
+
+    # Scripts
+
+    def command_script(self, db, subcommand, *args):
+        subcommand = smart_text(subcommand).upper()
+        if subcommand == 'LOAD' and len(args) == 1:
+            sha = smart_bytes(sha1(args[0]).hexdigest())
+            self.scripts[sha] = args[0]
+            return sha
+        if subcommand == 'EXISTS':
+            return [1 if smart_bytes(sha).lower() in self.scripts else 0 for sha in args]
+        if subcommand == 'FLUSH':
+            self.scripts.clear()
+            self._lua_functions.clear()
+            return OK
+        raise CommandError("ERR Unknown SCRIPT subcommand or wrong number of arguments for '%s'" % subcommand)
+
+    def command_eval(self, db, source, numkeys, *args):
+        sha = smart_bytes(sha1(source).hexdigest())
+        self.scripts[sha] = source
+        return self.command_evalsha(db, sha, numkeys, *args)
+
+    def command_evalsha(self, db, sha, numkeys, *args):
+        source = self.scripts.get(smart_bytes(sha).lower())
+        if source is None:
+            raise CommandError('NOSCRIPT No matching script. Please use EVAL.')
+        numkeys = _int(numkeys)
+        if not 0 <= numkeys <= len(args):
+            raise CommandError("ERR Number of keys can't be greater than number of args")
+        if lupa is None:
+            raise CommandError('ERR Lua scripts need the lupa package with the in-memory Redis server')
+        lua = self._lua_runtime()
+        function = self._lua_functions.get(source)
+        if function is None:
+            try:
+                function = lua.eval('function(KEYS, ARGV) %s\nend' % smart_text(source))
+            except lupa.LuaError as e:
+                raise CommandError('ERR Error compiling script: %s' % e)
+            self._lua_functions[source] = function
+        keys, argv = args[:numkeys], args[numkeys:]
+        self._script_db, self._script_error = db, None
+        try:
+            result = function(lua.table(*keys), lua.table(*argv))
+        except lupa.LuaError as e:
+            if self._script_error is not None:
+                raise CommandError(str(self._script_error))
+            raise CommandError('ERR Error running script: %s' % e)
+        finally:
+            self._script_db = None
+        return self._from_lua(result)
+
+    def _lua_runtime(self):
+        if self._lua is None:
+            lua = lupa.LuaRuntime(encoding=None, unpack_returned_tuples=True)
+            lua.globals().redis = lua.table_from({
+                b'call': lambda *args: self._lua_call(args, protected=False),
+                b'pcall': lambda *args: self._lua_call(args, protected=True),
+                b'status_reply': lambda status: lua.table_from({b'ok': status}),
+                b'error_reply': lambda message: lua.table_from({b'err': message}),
+            })
+            self._lua = lua
+        return self._lua
+
+    def _lua_call(self, args, protected):
+        args = [smart_bytes(int(arg) if isinstance(arg, float) and arg.is_integer() else arg) for arg in args]
+        reply = self.execute(self._script_db, args)
+        if isinstance(reply, redis.RedisError):
+            if protected:
+                return self._lua.table_from({b'err': smart_bytes(str(reply))})
+            self._script_error = reply
+            raise reply
+        return self._to_lua(reply)
+
+    def _to_lua(self, reply):
+        if isinstance(reply, _Status):
+            return self._lua.table_from({b'ok': bytes(reply)})
+        if reply is None:
+            return False
+        if isinstance(reply, list):
+            return self._lua.table(*[self._to_lua(item) for item in reply])
+        return reply
+
+    def _from_lua(self, result):
+        if result is None or result is False:
+            return None
+        if result is True:
+            return 1
+        if isinstance(result, (int, float)) and not isinstance(result, bool):
+            return int(result)
+        if isinstance(result, bytes):
+            return result
+        if lupa.lua_type(result) == 'table':
+            if result[b'err'] is not None:
+                raise CommandError(smart_text(result[b'err']))
+            if result[b'ok'] is not None:
+                return _Status(result[b'ok'])
+            items = []
+            index = 1
+            while result[index] is not None:
+                items.append(self._from_lua(result[index]))
+                index += 1
+            return items
+        return None
+
+
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def get_server(name):
+    """
+    Returns the emulated server of the given address, created on first use.
+    """
+    with _servers_lock:
+        if name not in _servers:
+            _servers[name] = FakeServer(name)
+        return _servers[name]
+
+
+class FakeConnection(Connection):
+    """
+    A connection to the emulated server of its address. Commands are run
+    when they are sent; their replies are read back as from a socket.
+    """
+    description_format = "FakeConnection<server=%(server)s,db=%(db)s>"
+
+    def __init__(self, path=None, latency=0, **kwargs):
+        super(FakeConnection, self).__init__(**kwargs)
+        self.path = path
+        self.latency = latency
+        self.server = get_server(path or '%s:%s' % (self.host, self.port))
+        self._description_args['server'] = self.server.name
+        self._replies = deque()
+        self._selected_db = None
+        # The commands queued after MULTI, and whether one was refused
+        self._queued = None
+        self._aborted = False
+
+    def connect(self):
+        if self._selected_db is None:
+            self._selected_db = int(self.db or 0)
+
+    def disconnect(self):
+        self._selected_db = None
+        self._queued = None
+        self._replies.clear()
+
+    def send_packed_command(self, command):
+        self.connect()
+        if not isinstance(command, bytes):
+            command = b''.join(chunk.tobytes() if isinstance(chunk, memoryview) else chunk for chunk in command)
+        if self.latency:
+            time.sleep(self.latency)
+        for args in self._parse_commands(command):
+            self._replies.append(self._execute(args))
+
+    def _parse_commands(self, data):
+        position = 0
+        while position < len(data):
+            end = data.index(b'\r\n', position)
+            count = int(data[position + 1:end])
+            position = end + 2
+            args = []
+            for i in range(count):
+                end = data.index(b'\r\n', position)
+                length = int(data[position + 1:end])
+                position = end + 2
+                args.append(data[position:position + length])
+                position += length + 2
+            yield args
+
+    def _execute(self, args):
+        name = smart_text(args[0]).upper()
+        if name == 'MULTI':
+            if self._queued is not None:
+                return error('ERR MULTI calls can not be nested')
+            self._queued, self._aborted = [], False
+            return OK
+        if name == 'EXEC':
+            queued, self._queued = self._queued, None
+            if queued is None:
+                return error('ERR EXEC without MULTI')
+            if self._aborted:
+                return error('EXECABORT Transaction discarded because of previous errors.')
+            with self.server.lock:
+                return [self._execute_selected(args) for args in queued]
+        if name == 'DISCARD':
+            if self._queued is None:
+                return error('ERR DISCARD without MULTI')
+            self._queued = None
+            return OK
+        if self._queued is not None:
+            if not hasattr(self.server, 'command_' + name.lower()) and name not in ('SELECT', 'AUTH'):
+                self._aborted = True
+                return error("ERR unknown command '%s'" % smart_text(args[0]))
+            self._queued.append(args)
+            return QUEUED
+        return self._execute_selected(args)
+
+    def _execute_selected(self, args):
+        name = smart_text(args[0]).upper()
+        if name == 'SELECT':
+            self._selected_db = _int(args[1]) if len(args) == 2 else self._selected_db
+            return OK
+        if name == 'AUTH':
+            return OK
+        reply = self.server.execute(self._selected_db, args)
+        if self.encoder.decode_responses:
+            reply = self._decode(reply)
+        return reply
+
+    def _decode(self, reply):
+        if isinstance(reply, bytes):
+            return self.encoder.decode(reply)
+        if isinstance(reply, list):
+            return [self._decode(item) for item in reply]
+        return reply
+
+    def can_read(self, timeout=0):
+        return bool(self._replies)
+
+    def read_response(self):
+        try:
+            response = self._replies.popleft()
+        except IndexError:
+            raise redis.ConnectionError("No reply is pending on %r" % self)
+        if isinstance(response, redis.ResponseError):
+            raise response
+        return response
+
+
+class FakeConnectionPool(redis.ConnectionPool):
+    """
+    A connection pool whose connections talk to an in-memory server, shared
+    by the pools of the same address. ``latency`` seconds are waited for
+    every round trip, to simulate the network.
+    """
+    def __init__(self, connection_class=None, latency=0, **connection_kwargs):
+        connection_kwargs['latency'] = latency
+        super(FakeConnectionPool, self).__init__(connection_class=FakeConnection, **connection_kwargs)
@@ -0,0 +1,70 @@
+from optparse import make_option
+
+from django.core.cache import get_cache
+from django.core.management.base import BaseCommand, CommandError
+
+from redis_cache.analysis import TTL_BUCKETS, NO_TTL, analyze_keys
+from redis_cache.warmup import key_pattern
+
+
+def _size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            break
+        size /= 1024.0
+    return ('%d%s' if unit == 'B' else '%.1f%s') % (size, unit)
+
+
+class Command(BaseCommand):
+    help = ("Reports the memory used by the keys of a Redis cache, grouped by key "
+            "pattern. Keys are inspected in small throttled batches.")
+    option_list = BaseCommand.option_list + (
+        make_option('--cache', default='default',
+                    help='The cache alias to analyze. Defaults to "default".'),
+        make_option('--pattern', default=None,
+                    help='SCAN pattern of the keys to analyze. Defaults to the keys of the '
+                         'cache prefix and version.'),
+        make_option('--all-versions', action='store_true', default=False,
+                    help='Analyze the keys of every version of the cache prefix.'),
+        make_option('--depth', type='int', default=2,
+                    help='Number of key segments of the patterns. Defaults to 2.'),
+        make_option('--separator', default=':',
+                    help='Separator of the key segments. Defaults to ":".'),
+        make_option('--sample', type='float', default=1.0,
+                    help='Fraction of the keys to inspect, e.g. 0.1. Defaults to 1.'),
+        make_option('--top', type='int', default=10,
+                    help='Number of largest keys to list. Defaults to 10.'),
+        make_option('--limit', type='int', default=50,
+                    help='Number of patterns to list. Defaults to 50.'),
+        make_option('--chunk-size', type='int', default=100,
+                    help='Keys per SCAN and pipeline. Defaults to 100.'),
+        make_option('--rate', type='float', default=1000,
+                    help='Maximum number of keys inspected per second, 0 for no limit. '
+                         'Defaults to 1000.'),
+    )
+
+    def handle(self, *args, **options):
+        cache = get_cache(options['cache'])
+        if not hasattr(cache, '_client'):
+            raise CommandError("Cache '%s' is not a Redis cache" % options['cache'])
+        if not 0 < options['sample'] <= 1:
+            raise CommandError("--sample must be between 0 and 1")
+        pattern = options['pattern'] or key_pattern(cache, options['all_versions'])
+        report = analyze_keys(cache, pattern, options['depth'], options['separator'], options['sample'],
+                              options['top'], options['chunk_size'], options['rate'])
+        self.stdout.write("Analyzed %s of %s keys matching %s: %s" % (
+            report['analyzed'], report['scanned'], pattern, _size(report['bytes'])))
+        ttl_names = [NO_TTL] + [name for name, bound in TTL_BUCKETS]
+        self.stdout.write("\n%10s %10s %6s %8s %8s %8s %8s  %s  %s  %s" % (
+            'keys', 'total', '%', 'p50', 'p90', 'p99', 'max', 'pattern', 'ttl (%s)' % ' / '.join(ttl_names),
+            'encodings'))
+        for group in report['groups'][:options['limit']]:
+            self.stdout.write("%10s %10s %6.1f %8s %8s %8s %8s  %s  %s  %s" % (
+                group['count'], _size(group['bytes']), 100.0 * group['bytes'] / (report['bytes'] or 1),
+                _size(group['p50']), _size(group['p90']), _size(group['p99']), _size(group['max']),
+                group['pattern'], ' / '.join(str(group['ttls'][name]) for name in ttl_names),
+                ' '.join('%s:%s' % item for item in sorted(group['encodings'].items()))))
+        if report['largest']:
+            self.stdout.write("\nLargest keys:")
+            for key, size in report['largest']:
+                self.stdout.write("%10s  %s" % (_size(size), key))
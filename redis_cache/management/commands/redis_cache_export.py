@@ -0,0 +1,52 @@
+import gzip
+import sys
+from optparse import make_option
+
+from django.core.cache import get_cache
+from django.core.management.base import BaseCommand, CommandError
+
+from redis_cache.warmup import FORMATS, export_keys, key_pattern
+
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = ("Exports the keys of a Redis cache to a file (use - for stdout, a .gz "
+            "name to compress it), to be loaded back with redis_cache_import.")
+    option_list = BaseCommand.option_list + (
+        make_option('--cache', default='default',
+                    help='The cache alias to export. Defaults to "default".'),
+        make_option('--pattern', default=None,
+                    help='SCAN pattern of the keys to export. Defaults to the keys of the '
+                         'cache prefix and version.'),
+        make_option('--all-versions', action='store_true', default=False,
+                    help='Export the keys of every version of the cache prefix.'),
+        make_option('--format', default='dump', choices=FORMATS,
+                    help='"dump" (DUMP/RESTORE, any data type, same Redis version) or '
+                         '"raw" (GET/SET, string values only). Defaults to "dump".'),
+        make_option('--chunk-size', type='int', default=1000,
+                    help='Keys per SCAN and pipeline. Defaults to 1000.'),
+        make_option('--rate', type='float', default=None,
+                    help='Maximum number of keys exported per second.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage: redis_cache_export %s" % self.args)
+        cache = get_cache(options['cache'])
+        if not hasattr(cache, '_client'):
+            raise CommandError("Cache '%s' is not a Redis cache" % options['cache'])
+        pattern = options['pattern'] or key_pattern(cache, options['all_versions'])
+        path = args[0]
+        if path == '-':
+            stream = getattr(sys.stdout, 'buffer', sys.stdout)
+        elif path.endswith('.gz'):
+            stream = gzip.open(path, 'wb')
+        else:
+            stream = open(path, 'wb')
+        try:
+            count = export_keys(cache, stream, pattern, options['format'], options['chunk_size'], options['rate'])
+        finally:
+            if path != '-':
+                stream.close()
+        if path != '-':
+            self.stdout.write("Exported %s keys matching %s" % (count, pattern))
@@ -0,0 +1,48 @@
+import gzip
+import sys
+from optparse import make_option
+
+from django.core.cache import get_cache
+from django.core.management.base import BaseCommand, CommandError
+
+from redis_cache.warmup import import_keys
+
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = "Loads a file written by redis_cache_export (use - for stdin) into a Redis cache."
+    option_list = BaseCommand.option_list + (
+        make_option('--cache', default='default',
+                    help='The cache alias to load the keys into. Defaults to "default".'),
+        make_option('--chunk-size', type='int', default=1000,
+                    help='Keys per pipeline. Defaults to 1000.'),
+        make_option('--workers', type='int', default=4,
+                    help='Number of threads sending pipelines in parallel. Defaults to 4.'),
+        make_option('--rate', type='float', default=None,
+                    help='Maximum number of keys loaded per second.'),
+        make_option('--no-replace', action='store_false', dest='replace', default=True,
+                    help='Keep the keys that already exist instead of overwriting them.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage: redis_cache_import %s" % self.args)
+        cache = get_cache(options['cache'])
+        if not hasattr(cache, '_client'):
+            raise CommandError("Cache '%s' is not a Redis cache" % options['cache'])
+        path = args[0]
+        if path == '-':
+            stream = getattr(sys.stdin, 'buffer', sys.stdin)
+        elif path.endswith('.gz'):
+            stream = gzip.open(path, 'rb')
+        else:
+            stream = open(path, 'rb')
+        try:
+            count = import_keys(cache, stream, options['chunk_size'], options['workers'],
+                                options['rate'], options['replace'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            if path != '-':
+                stream.close()
+        self.stdout.write("Imported %s keys" % count)
@@ -0,0 +1,17 @@
+from .cache import request_memo
+
+
+class RequestMemoMiddleware(object):
+    """
+    Memoizes the values read through the Redis cache backends for the
+    duration of each request. See ``redis_cache.cache.RequestMemo``.
+    """
+    def process_request(self, request):
+        request_memo.start()
+
+    def process_response(self, request, response):
+        request_memo.stop()
+        return response
+
+    def process_exception(self, request, exception):
+        request_memo.stop()
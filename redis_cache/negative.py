@@ -0,0 +1,228 @@
+import logging
+import struct
+import threading
+import time
+from hashlib import md5
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python 2.6
+    from django.utils.datastructures import SortedDict as OrderedDict
+
+import redis
+
+from .compat import smart_bytes
+from .warmup import _chunks, _scan
+
+
+logger = logging.getLogger(__name__)
+
+# The first bit of the bitmap is set once every existing key was added to it;
+# the bits of the keys start at the second byte
+SEEDED_OFFSET = 0
+FIRST_KEY_OFFSET = 8
+# Seconds a process seeding the bitmap holds the lock, renewed at each chunk
+SEED_LOCK_TIMEOUT = 60
+
+
+class BloomFilter(object):
+    """
+    A Bloom filter of the keys written through the cache backends, stored as
+    a bitmap at ``key`` in Redis so that every process shares it.
+
+    The first process finding no bitmap, e.g. after a FLUSHDB or an eviction,
+    adds every key of the database to it from a background thread, then
+    flags it as seeded. Until then every key is reported as possibly present.
+
+    Each process keeps a copy of the bitmap, downloaded again every
+    ``refresh_interval`` seconds; while it is being downloaded, every key is
+    reported as possibly present. A key missing from the copy was not written
+    before the last refresh, nor since by this process: keys written by other
+    processes are seen after ``refresh_interval`` seconds at most.
+    """
+    def __init__(self, client, key='redis_cache:bloom', bits=2 ** 23, hashes=5, refresh_interval=30,
+                 seed_chunk_size=1000):
+        self.client = client
+        self.key = key
+        self.bits = bits
+        self.hashes = hashes
+        self.refresh_interval = refresh_interval
+        self.seed_chunk_size = seed_chunk_size
+        self._bitmap = None
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+        self._seeder = None
+        self._added_while_refreshing = None
+
+    @property
+    def seed_lock_key(self):
+        return '%s:seeding' % self.key
+
+    def positions(self, key):
+        digest = md5(key.encoded if hasattr(key, 'encoded') else smart_bytes(key)).digest()
+        first, second = struct.unpack('>QQ', digest)
+        return [FIRST_KEY_OFFSET + (first + i * second) % self.bits for i in range(self.hashes)]
+
+    def add(self, client, keys):
+        """
+        Sets the bits of ``keys``, with one BITFIELD command sent through
+        ``client``, which may be a pipeline.
+        """
+        args = []
+        positions = []
+        for key in keys:
+            positions.extend(self.positions(key))
+        for position in positions:
+            args.extend(('SET', 'u1', position, 1))
+        self._set_bits(self._bitmap, positions)
+        added = self._added_while_refreshing
+        if added is not None:
+            added.extend(positions)
+        if args:
+            client.execute_command('BITFIELD', self.key, *args)
+
+    def _set_bits(self, bitmap, positions):
+        if bitmap is None:
+            return
+        for position in positions:
+            if position >> 3 >= len(bitmap):
+                bitmap.extend(bytearray((position >> 3) + 1 - len(bitmap)))
+            bitmap[position >> 3] |= 0x80 >> (position & 7)
+
+    def seed(self):
+        """
+        Adds every key of the database to the bitmap, ``seed_chunk_size`` keys
+        per pipeline, then flags it as seeded. Keys written meanwhile through
+        the backends set their bits themselves.
+        """
+        for keys in _chunks(_scan(self.client, None, self.seed_chunk_size), self.seed_chunk_size):
+            pipeline = self.client.pipeline(transaction=False)
+            self.add(pipeline, keys)
+            pipeline.expire(self.seed_lock_key, SEED_LOCK_TIMEOUT)
+            pipeline.execute()
+        self.client.execute_command('BITFIELD', self.key, 'SET', 'u1', SEEDED_OFFSET, 1)
+
+    def _seed_locked(self):
+        try:
+            self.seed()
+        except redis.RedisError:
+            logger.warning("Could not seed the Bloom filter at '%s'", self.key, exc_info=True)
+        finally:
+            try:
+                self.client.delete(self.seed_lock_key)
+            except redis.RedisError:
+                pass
+
+    def _start_seeding(self):
+        # A single process seeds the bitmap, from a background thread
+        if self._seeder is not None and self._seeder.is_alive():
+            return
+        if not self.client.set(self.seed_lock_key, 1, ex=SEED_LOCK_TIMEOUT, nx=True):
+            return
+        self._seeder = threading.Thread(target=self._seed_locked, name='redis_cache bloom filter seeding')
+        self._seeder.daemon = True
+        self._seeder.start()
+
+    def refresh(self):
+        # Keys added while the bitmap is downloaded may be missing from it
+        self._added_while_refreshing = added = []
+        try:
+            bitmap = self.client.get(self.key)
+        finally:
+            self._added_while_refreshing = None
+        bitmap = bytearray(bitmap) if bitmap is not None else bytearray()
+        if bitmap and bitmap[0] & (0x80 >> SEEDED_OFFSET):
+            self._set_bits(bitmap, added)
+            self._bitmap = bitmap
+        else:
+            self._bitmap = None
+            self._start_seeding()
+        self._refreshed_at = time.time()
+
+    def _current_bitmap(self):
+        """
+        Returns the copy of the bitmap, or ``None`` if it is not seeded or is
+        being downloaded again.
+        """
+        if self._refreshed_at is not None and time.time() - self._refreshed_at < self.refresh_interval:
+            return self._bitmap
+        # A single thread downloads the bitmap, the others read from Redis
+        if not self._lock.acquire(False):
+            return None
+        try:
+            self.refresh()
+        except redis.ConnectionError:
+            self._bitmap = None
+            self._refreshed_at = time.time()
+        finally:
+            self._lock.release()
+        return self._bitmap
+
+    def might_contain(self, key):
+        bitmap = self._current_bitmap()
+        if bitmap is None:
+            return True
+        for position in self.positions(key):
+            byte = position >> 3
+            if byte >= len(bitmap) or not bitmap[byte] & (0x80 >> (position & 7)):
+                return False
+        return True
+
+
+class NegativeCache(object):
+    """
+    Remembers for ``timeout`` seconds the keys that were missing from Redis,
+    at most ``max_size`` of them, so reading them again does not need a round
+    trip. Writes made through the backends forget them at once; writes made
+    by other processes are seen after ``timeout`` seconds at most.
+
+    With a ``bloom_filter``, keys absent from its last copy are also known to
+    be missing.
+    """
+    def __init__(self, timeout=1, max_size=10000, bloom_filter=None):
+        self.timeout = timeout
+        self.max_size = max_size
+        self.bloom_filter = bloom_filter
+        self.stats = {'hits': 0}
+        self._missing = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, keys):
+        expires = time.time() + self.timeout
+        with self._lock:
+            for key in keys:
+                self._missing.pop(key, None)
+                self._missing[key] = expires
+            while len(self._missing) > self.max_size:
+                self._missing.pop(next(iter(self._missing)))
+
+    def discard(self, keys):
+        with self._lock:
+            for key in keys:
+                self._missing.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._missing.clear()
+
+    def _is_missing(self, key, now):
+        expires = self._missing.get(key)
+        if expires is not None:
+            if expires > now:
+                return True
+            with self._lock:
+                if self._missing.get(key) == expires:
+                    del self._missing[key]
+        if self.bloom_filter is not None:
+            return not self.bloom_filter.might_contain(key)
+        return False
+
+    def missing(self, keys):
+        """
+        Returns the set of ``keys`` known to be missing.
+        """
+        now = time.time()
+        missing = set(key for key in keys if self._is_missing(key, now))
+        self.stats['hits'] += len(missing)
+        return missing
@@ -0,0 +1,254 @@
+"""
+Caching of queryset results, invalidated per table.
+
+Each table has a generation number stored in the cache. Cached results are
+keyed by the SQL of the query, its parameters and the generations of every
+table it reads, so bumping the generation of a table on ``post_save``,
+``post_delete`` and ``m2m_changed`` makes all the results reading it
+unreachable at once, without looking for their keys. They expire with their
+timeout.
+
+Only the models with a ``CachingManager`` bump their generation on
+``post_save`` and ``post_delete``. Inside a transaction, the generation is
+bumped again once it is committed, so results read meanwhile by other
+connections are not kept.
+
+    class Poll(models.Model):
+        objects = models.Manager()
+        cached = CachingManager(timeout=60)
+
+    Poll.cached.filter(question__startswith='What')
+"""
+import threading
+import time
+from hashlib import sha1
+
+from django.core.cache import get_cache
+from django.core.signals import request_finished
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.db.models.sql.datastructures import EmptyResultSet
+
+from .compat import DEFAULT_TIMEOUT, smart_bytes
+
+
+# Aliases of the caches holding queryset results, whose generations are
+# bumped when a table changes
+_cache_aliases = set()
+# Models with a CachingManager
+_caching_models = set()
+# get_cache builds a new backend on every call: keep one per alias
+_caches = {}
+# Invalidations to run again once the transactions of this thread commit
+_local = threading.local()
+
+
+def generation_key(table):
+    return 'orm:generation:%s' % table
+
+
+def _new_generation():
+    # Generations restart from the clock if evicted, so a table never gets
+    # an older generation back
+    return int(time.time() * 1000)
+
+
+def _get_cache(alias):
+    cache = _caches.get(alias)
+    if cache is None:
+        cache = _caches[alias] = get_cache(alias)
+    return cache
+
+
+def get_generations(cache, tables):
+    """
+    Returns the current generation of each table.
+    """
+    keys = [generation_key(table) for table in tables]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, _new_generation(), timeout=0)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+def _bump_generations(tables, aliases):
+    for alias in aliases:
+        cache = _get_cache(alias)
+        client = cache._client.pipeline(transaction=False)
+        keys = [cache.make_key(generation_key(table)) for table in tables]
+        cache._mark_written(client, keys)
+        for key in keys:
+            client.setnx(key, _new_generation())
+            client.incr(key)
+        cache._forget(*keys)
+        client.execute()
+
+
+def _run_committed():
+    """
+    Runs the invalidations of the transactions committed since.
+    """
+    pending = getattr(_local, 'pending', None)
+    if not pending:
+        return
+    _local.pending = []
+    for connection, tables, aliases in pending:
+        if getattr(connection, 'in_atomic_block', False):
+            _local.pending.append((connection, tables, aliases))
+        else:
+            _bump_generations(tables, aliases)
+
+
+def invalidate_tables(*tables, **kwargs):
+    """
+    Makes every cached result reading one of the tables unreachable. Inside
+    a transaction of the ``using`` database, this is done again once it is
+    committed (or rolled back).
+    """
+    aliases = [kwargs['cache_alias']] if kwargs.get('cache_alias') else list(_cache_aliases)
+    _run_committed()
+    _bump_generations(tables, aliases)
+    using = kwargs.get('using') or DEFAULT_DB_ALIAS
+    if hasattr(transaction, 'on_commit'):
+        # Django >= 1.9
+        transaction.on_commit(lambda: _bump_generations(tables, aliases), using=using)
+        return
+    connection = connections[using]
+    if getattr(connection, 'in_atomic_block', False):
+        # Django < 1.9 has no commit hooks: the invalidation runs again at the
+        # next cached query or invalidation of this thread, or at the end of
+        # the request, once the connection is out of the transaction
+        if not hasattr(_local, 'pending'):
+            _local.pending = []
+        _local.pending.append((connection, tables, aliases))
+
+
+def _invalidate_sender(sender, **kwargs):
+    # m2m_changed is also sent before the change, with a pre_* action
+    if _cache_aliases and not kwargs.get('action', 'post_').startswith('pre_'):
+        invalidate_tables(sender._meta.db_table, using=kwargs.get('using'))
+
+
+def _invalidate_m2m(sender, instance, model, **kwargs):
+    # The sender is the intermediate model: only its changes linking a model
+    # with a CachingManager are invalidated
+    if type(instance) in _caching_models or model in _caching_models:
+        _invalidate_sender(sender, **kwargs)
+
+
+def _request_finished(sender, **kwargs):
+    _run_committed()
+
+m2m_changed.connect(_invalidate_m2m, dispatch_uid='redis_cache.orm.m2m_changed')
+request_finished.connect(_request_finished, dispatch_uid='redis_cache.orm.request_finished')
+
+
+class CachingQuerySetMixin(object):
+    """
+    Caches the model instances returned by a queryset. Counts, aggregates,
+    ``values()`` and ``select_for_update()`` querysets are not cached;
+    ``nocache()`` turns caching off and ``cache(timeout)`` changes the
+    timeout.
+
+    Tables only read by subqueries are not tracked: their changes do not
+    invalidate the results. Neither do the changes of the models without a
+    ``CachingManager`` whose tables are joined; call ``invalidate_tables``
+    for them.
+    """
+    cache_alias = 'default'
+    cache_timeout = DEFAULT_TIMEOUT
+    cache_enabled = True
+
+    def _clone(self, klass=None, setup=False, **kwargs):
+        kwargs.setdefault('cache_alias', self.cache_alias)
+        kwargs.setdefault('cache_timeout', self.cache_timeout)
+        kwargs.setdefault('cache_enabled', self.cache_enabled)
+        return super(CachingQuerySetMixin, self)._clone(klass, setup, **kwargs)
+
+    def cache(self, timeout=DEFAULT_TIMEOUT, cache_alias=None):
+        return self._clone(cache_enabled=True, cache_timeout=timeout,
+                           cache_alias=cache_alias or self.cache_alias)
+
+    def nocache(self):
+        return self._clone(cache_enabled=False)
+
+    def _cache_key(self, cache):
+        """
+        Returns the key of the results of this queryset, built from its SQL,
+        its parameters and the generations of the tables it reads.
+        """
+        compiler = self.query.get_compiler(using=self.db)
+        sql, params = compiler.as_sql()
+        query = compiler.query
+        tables = sorted(set(query.alias_map[alias].table_name for alias in query.tables
+                            if query.alias_refcount.get(alias)) | set([self.model._meta.db_table]))
+        generations = get_generations(cache, tables)
+        digest = sha1(smart_bytes('%s|%s|%r|%r' % (self.db, sql, params, generations))).hexdigest()
+        return 'orm:%s:%s' % (self.model._meta.db_table, digest)
+
+    def iterator(self):
+        if not self.cache_enabled or self.query.select_for_update:
+            # Rows locked for update must be read from the database
+            return super(CachingQuerySetMixin, self).iterator()
+        _run_committed()
+        cache = _get_cache(self.cache_alias)
+        _cache_aliases.add(self.cache_alias)
+        try:
+            key = self._cache_key(cache)
+        except EmptyResultSet:
+            return iter([])
+        results = cache.get(key)
+        if results is None:
+            results = list(super(CachingQuerySetMixin, self).iterator())
+            cache.set(key, results, self.cache_timeout)
+        return iter(results)
+
+    def update(self, **kwargs):
+        rows = super(CachingQuerySetMixin, self).update(**kwargs)
+        invalidate_tables(self.model._meta.db_table, using=self.db)
+        return rows
+    update.alters_data = True
+
+    def bulk_create(self, objs, batch_size=None):
+        objs = super(CachingQuerySetMixin, self).bulk_create(objs, batch_size)
+        invalidate_tables(self.model._meta.db_table, using=self.db)
+        return objs
+
+
+class CachingQuerySet(CachingQuerySetMixin, models.query.QuerySet):
+    pass
+
+
+class CachingManager(models.Manager):
+    """
+    A manager whose querysets cache their results in the ``cache_alias``
+    cache for ``timeout`` seconds.
+    """
+    def __init__(self, timeout=DEFAULT_TIMEOUT, cache_alias='default'):
+        super(CachingManager, self).__init__()
+        self.timeout = timeout
+        self.cache_alias = cache_alias
+        _cache_aliases.add(cache_alias)
+
+    def contribute_to_class(self, model, name):
+        super(CachingManager, self).contribute_to_class(model, name)
+        if model._meta.abstract or model in _caching_models:
+            return
+        _caching_models.add(model)
+        post_save.connect(_invalidate_sender, sender=model, dispatch_uid='redis_cache.orm.post_save')
+        post_delete.connect(_invalidate_sender, sender=model, dispatch_uid='redis_cache.orm.post_delete')
+
+    def get_queryset(self):
+        return CachingQuerySet(self.model, using=self._db)._clone(
+            cache_alias=self.cache_alias, cache_timeout=self.timeout
+        )
+    # Django < 1.6
+    get_query_set = get_queryset
+
+    def cache(self, *args, **kwargs):
+        return self.get_queryset().cache(*args, **kwargs)
+
+    def nocache(self):
+        return self.get_queryset().nocache()
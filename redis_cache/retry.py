@@ -0,0 +1,74 @@
+import random
+import threading
+import time
+
+from .breaker import CONNECTION_ERRORS, CircuitOpenError
+from .compat import smart_text
+
+
+# Commands that leave Redis in the same state whether they run once or
+# several times, so they can be sent again when the reply is lost.
+IDEMPOTENT_COMMANDS = frozenset([
+    'GET', 'MGET', 'SET', 'SETEX', 'PSETEX', 'DEL', 'EXPIRE', 'PEXPIRE', 'PERSIST',
+    'EXISTS', 'TTL', 'PTTL', 'HGET', 'HMGET', 'HGETALL', 'ZCARD', 'ZRANGE', 'ZREVRANGE',
+    'ZRANGEBYSCORE', 'ZREVRANGEBYSCORE', 'GETBIT', 'BITFIELD_RO',
+])
+
+# Options making a SET depend on whether the key exists: sent again after
+# the first attempt stored the value, such a write may fail or overwrite a
+# value set meanwhile.
+CONDITIONAL_OPTIONS = frozenset(['NX', 'XX'])
+
+
+class RetryPolicy(object):
+    """
+    Sends idempotent commands again after a connection error, up to
+    ``max_attempts`` times in total, sleeping a random time between 0 and
+    ``backoff * 2 ** retry`` seconds (capped at ``max_backoff``) in between.
+    No retry is made once ``deadline`` seconds have passed since the first
+    attempt, nor while the circuit breaker is open.
+
+    ``stats`` counts the retries made and the calls that gave up.
+    """
+    def __init__(self, max_attempts=3, backoff=0.05, max_backoff=1, deadline=2):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.stats = {'retries': 0, 'gave_up': 0}
+        self._lock = threading.Lock()
+
+    def is_idempotent(self, commands):
+        """
+        Returns whether every command, given as its name and arguments, can
+        be sent again.
+        """
+        for args in commands:
+            name = smart_text(args[0]).upper()
+            if name not in IDEMPOTENT_COMMANDS:
+                return False
+            if name == 'SET' and any(smart_text(option).upper() in CONDITIONAL_OPTIONS for option in args[3:]):
+                return False
+        return True
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def call(self, func, *args, **kwargs):
+        started = time.time()
+        attempt = 1
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except CircuitOpenError:
+                raise
+            except CONNECTION_ERRORS:
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+                if attempt >= self.max_attempts or time.time() - started + delay > self.deadline:
+                    self._count('gave_up')
+                    raise
+            self._count('retries')
+            time.sleep(delay)
+            attempt += 1
+
@@ -0,0 +1,68 @@
+from hashlib import sha1
+
+import redis
+
+from .compat import smart_bytes
+
+
+class Script(object):
+    """
+    A Lua script registered on the cache backends. Its keys are made with the
+    backend's ``make_key``; its other arguments are encoded like cached values
+    unless ``encode_args`` is ``False``, and its result is decoded like a
+    cached value unless ``decode_result`` is ``False``.
+    """
+    def __init__(self, name, source, encode_args=True, decode_result=True):
+        self.name = name
+        self.source = source
+        self.sha = sha1(smart_bytes(source)).hexdigest()
+        self.encode_args = encode_args
+        self.decode_result = decode_result
+
+    def __repr__(self):
+        return '<Script: %s>' % self.name
+
+
+class ScriptRegistry(object):
+    """
+    The scripts registered by name on the backends of a Redis server.
+    """
+    def __init__(self):
+        self._scripts = {}
+
+    def register(self, name, source, encode_args=True, decode_result=True):
+        script = Script(name, source, encode_args, decode_result)
+        self._scripts[name] = script
+        return script
+
+    def __getitem__(self, name):
+        try:
+            return self._scripts[name]
+        except KeyError:
+            raise ValueError("Script '%s' is not registered" % name)
+
+    def __iter__(self):
+        return iter(list(self._scripts.values()))
+
+    def load(self, client, scripts=None):
+        """
+        Sends SCRIPT LOAD for the given scripts (by default, every registered
+        one) that the server does not know yet.
+        """
+        scripts = list(self if scripts is None else scripts)
+        if not scripts:
+            return
+        known = client.script_exists(*[script.sha for script in scripts])
+        for script, exists in zip(scripts, known):
+            if not exists:
+                client.script_load(script.source)
+
+
+# redis-py >= 2.7 raises NoScriptError, older versions a plain ResponseError
+NoScriptError = getattr(redis.exceptions, 'NoScriptError', None)
+
+
+def is_noscript_error(error):
+    if NoScriptError is not None and isinstance(error, NoScriptError):
+        return True
+    return isinstance(error, redis.ResponseError) and str(error).startswith('NOSCRIPT')
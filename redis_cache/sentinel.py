@@ -0,0 +1,28 @@
+from redis.sentinel import Sentinel, SentinelConnectionPool
+
+
+class CacheSentinelConnectionPool(SentinelConnectionPool):
+    """
+    A pool of connections to the master, or replicas, that Sentinel reports
+    for a service.
+
+    When Sentinel reports a new master, the parent class closes every
+    connection of the pool at once, breaking the commands other threads have
+    in flight. This pool instead closes the connections to the previous
+    master as they are taken from the pool, so they reconnect to the new one.
+    """
+    def get_master_address(self):
+        master_address = self.sentinel_manager.discover_master(self.service_name)
+        if self.is_master:
+            self.master_address = master_address
+        return master_address
+
+    def get_connection(self, command_name, *keys, **options):
+        connection = super(CacheSentinelConnectionPool, self).get_connection(command_name, *keys, **options)
+        if (self.is_master and self.master_address is not None and connection._sock is not None and
+                (connection.host, connection.port) != tuple(self.master_address)):
+            connection.disconnect()
+        return connection
+
+
+__all__ = ['Sentinel', 'CacheSentinelConnectionPool']
@@ -0,0 +1,150 @@
+"""
+A session engine storing each session as a Redis hash with one field per
+session key, set ``SESSION_ENGINE = 'redis_cache.session'``.
+
+Saving a session only writes the fields whose value changed, deletes the
+removed ones and refreshes the expiry, in one pipeline; the whole session
+is written again if the hash expired or was deleted since. Loading it is a
+single HGETALL. Values are serialized one by one with
+``SESSION_REDIS_SERIALIZER``, which defaults to ``SESSION_SERIALIZER``.
+"""
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from django.conf import settings
+from django.contrib.sessions.backends.base import SessionBase, CreateError
+from django.core.cache import get_cache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import importlib
+
+from .compat import smart_text
+
+
+KEY_PREFIX = 'redis_cache.session:'
+
+# Keeps empty sessions in existence: Redis deletes hashes without fields
+CREATED_FIELD = '\x00created'
+
+
+class PickleSerializer(object):
+    """
+    The default serializer on Django < 1.6, which has no session serializers.
+    """
+    def dumps(self, obj):
+        return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+def get_serializer():
+    path = getattr(settings, 'SESSION_REDIS_SERIALIZER', None) or getattr(settings, 'SESSION_SERIALIZER', None)
+    if path is None:
+        return PickleSerializer()
+    mod_path, cls_name = path.rsplit('.', 1)
+    try:
+        return getattr(importlib.import_module(mod_path), cls_name)()
+    except (AttributeError, ImportError):
+        raise ImproperlyConfigured("Could not find session serializer '%s'" % path)
+
+
+class SessionStore(SessionBase):
+    """
+    A Redis hash based session store.
+    """
+    def __init__(self, session_key=None):
+        self._cache = get_cache(getattr(settings, 'SESSION_CACHE_ALIAS', 'default'))
+        self._field_serializer = get_serializer()
+        # Serialized values of the fields as stored in Redis
+        self._stored = {}
+        super(SessionStore, self).__init__(session_key)
+
+    def _hash_key(self, session_key=None):
+        return self._cache.make_key(KEY_PREFIX + (session_key or self._get_or_create_session_key()))
+
+    def load(self):
+        try:
+            fields = self._cache._client.hgetall(self._hash_key())
+        except Exception:
+            # Reset the session rather than fail the request, as the cache
+            # session engine does
+            fields = {}
+        session = {}
+        self._stored = {}
+        for field, value in fields.items():
+            field = smart_text(field)
+            if field == CREATED_FIELD:
+                continue
+            try:
+                session[field] = self._field_serializer.loads(value)
+            except Exception:
+                continue
+            self._stored[field] = value
+        if not fields:
+            self.create()
+        return session
+
+    def create(self):
+        for i in range(10000):
+            self._session_key = self._get_new_session_key()
+            try:
+                self.save(must_create=True)
+            except CreateError:
+                continue
+            self.modified = True
+            return
+        raise RuntimeError(
+            "Unable to create a new session key. "
+            "It is likely that the cache is unavailable.")
+
+    def save(self, must_create=False):
+        client = self._cache._client
+        key = self._hash_key()
+        session = self._get_session(no_load=must_create)
+        expiry = max(self.get_expiry_age(), 1)
+        if must_create:
+            self._stored = {}
+            pipeline = client.pipeline()
+            pipeline.hsetnx(key, CREATED_FIELD, 1)
+            pipeline.expire(key, expiry)
+            if not pipeline.execute()[0]:
+                raise CreateError
+        values = dict((field, self._field_serializer.dumps(value)) for field, value in session.items())
+        changed = dict((field, value) for field, value in values.items() if self._stored.get(field) != value)
+        deleted = [field for field in self._stored if field not in session]
+        pipeline = client.pipeline()
+        pipeline.exists(key)
+        if deleted:
+            pipeline.hdel(key, *deleted)
+        changed[CREATED_FIELD] = 1
+        pipeline.hmset(key, changed)
+        pipeline.expire(key, expiry)
+        if not pipeline.execute()[0]:
+            # The hash expired or was deleted since it was loaded: only
+            # writing the changed fields would bring back part of it
+            values[CREATED_FIELD] = 1
+            pipeline = client.pipeline()
+            pipeline.delete(key)
+            pipeline.hmset(key, values)
+            pipeline.expire(key, expiry)
+            pipeline.execute()
+            del values[CREATED_FIELD]
+        self._stored = values
+
+    def exists(self, session_key):
+        return bool(self._cache._client.exists(self._hash_key(session_key)))
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        self._cache._client.delete(self._hash_key(session_key))
+        if session_key == self.session_key:
+            self._stored = {}
+
+    @classmethod
+    def clear_expired(cls):
+        pass
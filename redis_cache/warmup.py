@@ -0,0 +1,264 @@
+"""
+Bulk export, import and warmup of cache keys.
+
+Exported files are a header line followed by one record per key: a
+``struct`` packed key length, value length and time to live in milliseconds
+(0 without expiry), then the key and the value. In ``dump`` files values are
+DUMP payloads, restored with RESTORE; in ``raw`` files they are string values,
+restored with SET and PEXPIRE, which also works across Redis versions whose
+DUMP formats are incompatible.
+"""
+import struct
+import threading
+import time
+
+from .chunking import CHUNKS_PREFIX
+from .compat import DEFAULT_TIMEOUT, smart_bytes, smart_text
+
+
+HEADER = b'redis_cache export 1 '
+FORMATS = ('dump', 'raw')
+RECORD = struct.Struct('>IIQ')
+
+
+class Throttle(object):
+    """
+    Limits the throughput of one or more threads to ``rate`` keys per second.
+    A ``rate`` of ``None`` or 0 means no limit.
+    """
+    def __init__(self, rate=None):
+        self.rate = rate
+        self._next = time.time()
+        self._lock = threading.Lock()
+
+    def wait(self, count):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.time()
+            start = max(self._next, now)
+            self._next = start + count / float(self.rate)
+        if start > now:
+            time.sleep(start - now)
+
+
+# Stand for the parts of a made key replaced by wildcards in key_pattern
+KEY_MARKER = '\x00key\x00'
+VERSION_MARKER = '\x00version\x00'
+
+
+def escape_pattern(text):
+    """
+    Escapes the glob characters of ``text`` for SCAN MATCH.
+    """
+    for char in '\\*?[]':
+        text = text.replace(char, '\\' + char)
+    return text
+
+
+def key_pattern(cache, all_versions=False):
+    """
+    Returns the SCAN pattern matching the keys of the given backend, for its
+    prefix and version (or every version).
+    """
+    key = smart_text(cache.make_key(KEY_MARKER, version=VERSION_MARKER if all_versions else None))
+    return escape_pattern(key).replace(KEY_MARKER, '*').replace(VERSION_MARKER, '*')
+
+
+def _scan_clients(client):
+    # Cluster keys are spread over the master nodes, each scanned in turn
+    if hasattr(client, 'master_nodes'):
+        return [client.get_node_client(node) for node in client.master_nodes()]
+    return [client]
+
+
+def _scan(client, pattern, count):
+    for node_client in _scan_clients(client):
+        for key in node_client.scan_iter(match=pattern, count=count):
+            yield key
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def export_keys(cache, stream, pattern=None, format='dump', chunk_size=1000, rate=None):
+    """
+    Writes the keys matching ``pattern`` (by default, every key of the
+    backend's prefix and version) to the binary ``stream``. Keys are found with
+    SCAN and read ``chunk_size`` at a time with pipelined PTTL and DUMP (or
+    GET) commands, at most ``rate`` keys per second.
+
+    In ``dump`` format, the chunks of the values split by the ``chunk``
+    ``MAX_VALUE_SIZE`` policy are exported too.
+
+    Returns the number of exported keys.
+    """
+    if format not in FORMATS:
+        raise ValueError("format must be one of %s" % ', '.join(FORMATS))
+    if pattern is None:
+        pattern = key_pattern(cache)
+    patterns = [pattern]
+    if format == 'dump' and cache._chunking:
+        patterns.append(escape_pattern(CHUNKS_PREFIX) + '*' + pattern)
+    client = cache._client
+    throttle = Throttle(rate)
+    stream.write(HEADER + smart_bytes(format) + b'\n')
+    exported = 0
+    scanned = (key for pattern in patterns for key in _scan(client, pattern, chunk_size))
+    for keys in _chunks(scanned, chunk_size):
+        throttle.wait(len(keys))
+        pipeline = client.pipeline(transaction=False)
+        for key in keys:
+            # PTTL first: a key expiring in between is then not read at all,
+            # rather than exported without its expiry
+            pipeline.pttl(key)
+            if format == 'dump':
+                pipeline.dump(key)
+            else:
+                pipeline.get(key)
+        replies = pipeline.execute(raise_on_error=False)
+        for key, pttl, value in zip(keys, replies[::2], replies[1::2]):
+            if value is None or isinstance(value, Exception) or pttl == -2:
+                # Expired meanwhile, or not a string value in raw format
+                continue
+            key = smart_bytes(key)
+            if not pttl or pttl < 0:
+                pttl = 0
+            stream.write(RECORD.pack(len(key), len(value), pttl))
+            stream.write(key)
+            stream.write(value)
+            exported += 1
+    return exported
+
+
+def _read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError("Truncated export file")
+    return data
+
+
+def read_records(stream):
+    """
+    Returns the format of an exported file and a generator of its
+    ``(key, value, pttl)`` records.
+    """
+    header = stream.readline()
+    if not header.startswith(HEADER) or smart_text(header[len(HEADER):].strip()) not in FORMATS:
+        raise ValueError("Not a redis_cache export file")
+
+    def records():
+        while True:
+            head = stream.read(RECORD.size)
+            if not head:
+                return
+            if len(head) != RECORD.size:
+                raise ValueError("Truncated export file")
+            key_length, value_length, pttl = RECORD.unpack(head)
+            yield _read_exactly(stream, key_length), _read_exactly(stream, value_length), pttl
+    return smart_text(header[len(HEADER):].strip()), records()
+
+
+def import_keys(cache, stream, chunk_size=1000, workers=1, rate=None, replace=True):
+    """
+    Restores the keys of an exported file, sending ``chunk_size`` keys per
+    pipeline from ``workers`` threads, at most ``rate`` keys per second.
+    Existing keys are overwritten unless ``replace`` is ``False``, in which
+    case they keep their value and expiry.
+
+    Returns the number of restored keys, not counting the existing keys
+    kept.
+    """
+    format, records = read_records(stream)
+    client = cache._client
+    throttle = Throttle(rate)
+    lock = threading.Lock()
+    state = {'restored': 0, 'error': None}
+
+    def restore(chunk):
+        throttle.wait(len(chunk))
+        pipeline = client.pipeline(transaction=False)
+        marked = cache._mark_written(pipeline, [key for key, value, pttl in chunk])
+        for key, value, pttl in chunk:
+            if format == 'dump':
+                args = ['RESTORE', key, pttl, value]
+                if replace:
+                    args.append('REPLACE')
+                pipeline.execute_command(*args)
+            else:
+                # SET ... NX only sets the expiry of the keys it writes
+                pipeline.set(key, value, px=pttl or None, nx=not replace)
+        replies = pipeline.execute(raise_on_error=False)
+        if marked:
+            replies = replies[1:]
+        restored = 0
+        for reply in replies:
+            if isinstance(reply, Exception):
+                # RESTORE without REPLACE refuses existing keys: they are kept
+                if 'BUSYKEY' not in str(reply):
+                    raise reply
+            elif reply:
+                restored += 1
+        with lock:
+            state['restored'] += restored
+
+    chunks = _chunks(records, chunk_size)
+    if workers <= 1:
+        for chunk in chunks:
+            restore(chunk)
+        return state['restored']
+
+    def work():
+        while state['error'] is None:
+            with lock:
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+                except Exception as e:
+                    state['error'] = e
+                    return
+            try:
+                restore(chunk)
+            except Exception as e:
+                state['error'] = e
+    threads = [threading.Thread(target=work) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if state['error'] is not None:
+        raise state['error']
+    return state['restored']
+
+
+def warmup(cache, items, chunk_size=1000, version=None, rate=None):
+    """
+    Fills the cache from an iterable of ``(key, value, timeout)`` triples,
+    e.g. a generator reading the source of truth. Each chunk of ``chunk_size``
+    items is written with ``set_many``, once per distinct timeout; a timeout
+    of ``None`` means the backend's default timeout.
+
+    Returns the number of written keys.
+    """
+    throttle = Throttle(rate)
+    written = 0
+    for chunk in _chunks(items, chunk_size):
+        throttle.wait(len(chunk))
+        by_timeout = {}
+        for key, value, timeout in chunk:
+            if timeout is None:
+                timeout = DEFAULT_TIMEOUT
+            by_timeout.setdefault(timeout, {})[key] = value
+        for timeout, data in by_timeout.items():
+            cache.set_many(data, timeout, version=version)
+        written += len(chunk)
+    return written
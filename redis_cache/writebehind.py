@@ -0,0 +1,219 @@
+import atexit
+import logging
+import os
+import threading
+import weakref
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python 2.6
+    from django.utils.datastructures import SortedDict as OrderedDict
+
+import redis
+
+from .breaker import CONNECTION_ERRORS
+
+logger = logging.getLogger('redis_cache')
+
+OVERFLOW_POLICIES = ('flush', 'drop_oldest', 'drop_newest')
+
+
+class WriteBehindBuffer(object):
+    """
+    A bounded, in-process buffer of pending cache writes that a background
+    thread sends to Redis in pipelines, every ``flush_interval`` seconds or as
+    soon as ``flush_size`` writes are pending.
+
+    Writes to the same key are coalesced: only the last one is sent. When
+    ``max_size`` keys are pending, the ``overflow`` policy applies: ``flush``
+    sends the buffer in the writing thread, ``drop_oldest`` discards the
+    oldest pending write and ``drop_newest`` discards the new one. Writes that
+    could not be sent because Redis was unreachable are kept for the next
+    flush, as long as fewer than ``max_size`` keys are pending.
+
+    ``write(pipeline, key, operation)`` queues one pending write on a pipeline
+    and ``client`` is used to create the pipelines. ``written(keys)``, if
+    given, is called with the keys of each pipeline once it is sent.
+    """
+    def __init__(self, client, write, max_size=10000, flush_size=1000, flush_interval=0.1, overflow='flush',
+                 written=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("overflow must be one of %s" % ', '.join(OVERFLOW_POLICIES))
+        self.client = client
+        self.write = write
+        self.written = written
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.stats = {'written': 0, 'coalesced': 0, 'dropped': 0, 'errors': 0, 'flushes': 0}
+        self._pending = OrderedDict()
+        self._in_flight = {}
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        _buffers.add(self)
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._closed = False
+            self._thread = threading.Thread(target=self._run, name='redis_cache write-behind')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                # Sleep until a write is buffered, then give the following
+                # ones flush_interval seconds to join it
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                if len(self._pending) < self.flush_size:
+                    self._condition.wait(self.flush_interval)
+            self.flush()
+
+    def close(self):
+        """
+        Stops the flushing thread and sends the pending writes. The thread
+        starts again on the next write.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def put(self, key, operation):
+        """
+        Adds a pending write for ``key``. Returns ``False`` if the write was
+        dropped because the buffer was full.
+        """
+        must_flush = False
+        with self._condition:
+            if key in self._pending:
+                del self._pending[key]
+                self.stats['coalesced'] += 1
+            elif len(self._pending) >= self.max_size:
+                if self.overflow == 'drop_newest':
+                    self.stats['dropped'] += 1
+                    return False
+                if self.overflow == 'drop_oldest':
+                    self._pending.pop(next(iter(self._pending)))
+                    self.stats['dropped'] += 1
+                else:
+                    must_flush = True
+            self._pending[key] = operation
+            if len(self._pending) == 1 or len(self._pending) >= self.flush_size:
+                self._condition.notify()
+            self._start()
+        if must_flush:
+            self.flush()
+        return True
+
+    def get(self, key):
+        """
+        Returns the pending write for ``key``, or ``None``.
+        """
+        with self._condition:
+            operation = self._pending.get(key)
+            if operation is None:
+                operation = self._in_flight.get(key)
+            return operation
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def flush(self):
+        """
+        Sends every pending write to Redis, ``flush_size`` writes per pipeline.
+        Pending writes stay visible to ``get`` until they are sent.
+        """
+        with self._flush_lock:
+            with self._condition:
+                self._in_flight, self._pending = self._pending, OrderedDict()
+                self.stats['flushes'] += 1
+            items = list(self._in_flight.items())
+            try:
+                for i in range(0, len(items), self.flush_size):
+                    chunk = items[i:i + self.flush_size]
+                    try:
+                        pipeline = self.client.pipeline(transaction=False)
+                        for key, operation in chunk:
+                            self.write(pipeline, key, operation)
+                        pipeline.execute()
+                        self.stats['written'] += len(chunk)
+                        if self.written is not None:
+                            self.written([key for key, operation in chunk])
+                    except CONNECTION_ERRORS:
+                        # Keep the writes not sent yet for the next flush
+                        self.stats['errors'] += 1
+                        logger.warning("Could not flush %s buffered cache writes, Redis is unreachable",
+                                       len(items) - i, exc_info=True)
+                        self._requeue(items[i:])
+                        break
+                    except redis.RedisError:
+                        # Cache writes are best effort: log them and go on
+                        self.stats['errors'] += 1
+                        logger.exception("Could not flush %s buffered cache writes", len(chunk))
+            finally:
+                with self._condition:
+                    self._in_flight = {}
+
+    def _requeue(self, items):
+        """
+        Puts back writes that could not be sent before the pending ones,
+        unless the key was written again meanwhile, dropping the oldest of
+        them beyond ``max_size`` pending keys.
+        """
+        with self._condition:
+            failed = [(key, operation) for key, operation in items if key not in self._pending]
+            overflow = len(failed) + len(self._pending) - self.max_size
+            if overflow > 0:
+                self.stats['dropped'] += overflow
+                failed = failed[overflow:]
+            pending = OrderedDict(failed)
+            for key, operation in self._pending.items():
+                pending[key] = operation
+            self._pending = pending
+
+
+_buffers = weakref.WeakSet()
+
+
+def flush_all():
+    """
+    Flushes every write-behind buffer. Called at exit and before forking.
+    """
+    for buffer in list(_buffers):
+        buffer.flush()
+
+
+def close_all():
+    """
+    Closes every write-behind buffer, e.g. between tests.
+    """
+    for buffer in list(_buffers):
+        buffer.close()
+
+
+def _after_fork_in_child():
+    # Threads do not survive a fork: the flushing thread restarts on the
+    # next write
+    for buffer in list(_buffers):
+        buffer._thread = None
+        buffer._condition = threading.Condition()
+        buffer._flush_lock = threading.Lock()
+
+
+atexit.register(flush_all)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=flush_all, after_in_child=_after_fork_in_child)
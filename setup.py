@@ -6,7 +6,7 @@ setup(
     author = "Susel Ruiz Duran",
     author_email = "suselrd@gmail.com",
     version = "0.11.2",  # This is a fork of the 0.11.1 version of the django-redis-cache project
-    packages = ["redis_cache"],
+    packages = ["redis_cache", "redis_cache.management", "redis_cache.management.commands"],
     description = "Redis Cache Backend for Django",
     install_requires=['redis>=2.4.5',],
     classifiers = [
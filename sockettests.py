@@ -12,6 +12,7 @@ cache_settings = {
     },
     'INSTALLED_APPS': [
         'tests.testapp',
+        'redis_cache',
     ],
     'ROOT_URLCONF': 'tests.urls',
     'CACHES': {
@@ -8,6 +8,7 @@ DATABASES = {
 
 INSTALLED_APPS = [
     'tests.testapp',
+    'redis_cache',
 ]
 
 CACHES = {
@@ -1,5 +1,6 @@
 from datetime import datetime
 from django.db import models
+from redis_cache.orm import CachingManager
 
 def expensive_calculation():
     expensive_calculation.num_runs += 1
@@ -9,3 +10,6 @@ class Poll(models.Model):
     question = models.CharField(max_length=200)
     answer = models.CharField(max_length=200)
     pub_date = models.DateTimeField('date published', default=expensive_calculation)
+
+    objects = models.Manager()
+    cached = CachingManager(timeout=60)
@@ -1,6 +1,11 @@
 # -*- coding: utf-8 -*-
 
+import os
+import socket
+import tempfile
+import threading
 import time
+from io import BytesIO
 
 try:
     import cPickle as pickle
@@ -8,11 +13,26 @@ except ImportError:
     import pickle
 from django import VERSION
 from django.core.cache import get_cache
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.utils.six import StringIO
 from .models import Poll, expensive_calculation
 import redis
 from redis.connection import UnixDomainSocketConnection
-from redis_cache.cache import RedisCache, ImproperlyConfigured, pool
+from redis_cache.cache import RedisCache, ImproperlyConfigured, pool, request_memo
+from redis_cache.chunking import CHUNKS_PREFIX, chunk_key
+from redis_cache.compat import smart_bytes
+from redis_cache.middleware import RequestMemoMiddleware
+from redis_cache.breaker import CircuitBreaker, CircuitOpenError, circuit_breaker_state_changed
+from redis_cache.retry import RetryPolicy
+from redis_cache.writebehind import WriteBehindBuffer, close_all
+from redis_cache.negative import BloomFilter
+from redis_cache.warmup import export_keys, import_keys, key_pattern, warmup
+from redis_cache.analysis import analyze_keys, group_pattern
+from redis_cache.session import SessionStore
+from redis_cache import fake, orm
+from redis_cache.cluster import ClusterError, ClusterCrossSlotError, key_slot
 
 
 # functions/classes for complex data type tests
@@ -36,7 +56,10 @@ class RedisCacheTests(TestCase):
         self.cache = self.get_cache()
 
     def tearDown(self):
+        # Background threads must not outlive the test, nor write after it
+        close_all()
         self.cache.clear()
+        self.cache._client.connection_pool.disconnect()
 
     def reset_pool(self):
         if hasattr(self, 'cache'):
@@ -49,6 +72,17 @@ class RedisCacheTests(TestCase):
             cache = get_cache(backend or 'default')
         return cache
 
+    def get_redis_cache(self, options, **params):
+        """
+        Returns a backend for the test server with the given options, using
+        the connection pool class of the default backend.
+        """
+        options = dict(options)
+        for name in ('CONNECTION_POOL_CLASS', 'PARSER_CLASS'):
+            if name in self.cache.options:
+                options.setdefault(name, self.cache.options[name])
+        return get_cache('redis_cache.RedisCache', LOCATION=self.cache.server, OPTIONS=options, **params)
+
     def test_bad_db_initialization(self):
         self.assertRaises(ImproperlyConfigured, self.get_cache, 'redis_cache.cache://127.0.0.1:6379?db=not_a_number')
 
@@ -337,6 +371,37 @@ class RedisCacheTests(TestCase):
         new_value = self.cache.incr(key, 7)
         self.assertEqual(new_value, number + 8)
 
+    def test_incr_with_pickled_integer_keeps_ttl(self):
+        key = self.cache.make_key("key")
+        self.cache._client.setex(key, pickle.dumps(42), 100)
+        self.assertEqual(self.cache.incr(key), 43)
+        self.assertTrue(0 < self.cache.ttl(key) <= 100)
+
+    def test_incr_version_without_expiry(self):
+        self.cache.set("key1", "spam", timeout=0)
+        self.assertEqual(self.cache.incr_version("key1"), 2)
+        self.assertEqual(self.cache.get("key1", version=2), "spam")
+        self.assertFalse(self.cache.persist("key1", version=2))
+
+    def test_touch(self):
+        self.cache.set("key1", "spam", timeout=0)
+        self.assertTrue(self.cache.touch("key1", 100))
+        self.assertTrue(0 < self.cache.ttl("key1") <= 100)
+        self.assertFalse(self.cache.touch("does_not_exist", 100))
+        self.assertTrue(self.cache.persist("key1"))
+        self.assertFalse(self.cache.persist("key1"))
+        self.assertEqual(self.cache.get("key1"), "spam")
+
+    def test_touch_many(self):
+        self.cache.set_many({"key1": "spam", "key2": "eggs"}, timeout=0)
+        self.assertEqual(sorted(self.cache.touch_many(["key1", "key2", "key3"], 100)), ["key1", "key2"])
+        ttls = self.cache.ttl_many(["key1", "key2"])
+        self.assertTrue(0 < ttls["key1"] <= 100 and 0 < ttls["key2"] <= 100)
+        self.assertEqual(self.cache.touch_many(["key1", "key3"], 0), ["key1"])
+        self.assertEqual(self.cache.ttl_many(["key1"]), {"key1": self.cache._client.ttl(self.cache.make_key("key1"))})
+        self.assertEqual(self.cache.touch_many(["key1"], -1), [])
+        self.assertEqual(self.cache.get("key1"), "spam")
+
     def test_pickling_cache_object(self):
         p = pickle.dumps(self.cache)
         cache = pickle.loads(p)
@@ -407,6 +472,983 @@ class RedisCacheTests(TestCase):
         self.assertEqual(self.cache.rem_from_sorted_set(key, polls[0]), True)
         self.assertEqual(self.cache.rem_from_sorted_set(key, polls[0]), False)
 
+    def test_sorted_sets_many(self):
+        key = self.cache.make_key("key")
+        members = dict(("member%d" % i, i) for i in range(2500))
+        self.assertEqual(self.cache.add_many_to_sorted_set(key, members), 2500)
+        self.assertEqual(self.cache.sorted_set_count(key), 2500)
+        self.assertEqual(self.cache.sorted_set_range(key, 0, 1, withscores=True),
+                         [("member0", 0), ("member1", 1)])
+        self.assertEqual(self.cache.sorted_set_rev_range(key, 0, 0, withscores=True), [("member2499", 2499)])
+        self.assertEqual(self.cache.sorted_set_range_by_score(key, 10, 11, withscores=True),
+                         [("member10", 10), ("member11", 11)])
+        self.assertEqual(self.cache.sorted_set_rev_range_by_score(key, 11, 10), ["member11", "member10"])
+        removed = ["member%d" % i for i in range(2000)] + ["missing"]
+        self.assertEqual(self.cache.rem_many_from_sorted_set(key, removed), 2000)
+        self.assertEqual(self.cache.sorted_set_count(key), 500)
+        self.assertEqual(self.cache.add_many_to_sorted_set(key, {}), 0)
+
+    def test_iter_sorted_set(self):
+        key = self.cache.make_key("key")
+        # Scores with many ties so pages split runs of equal scores
+        members = dict(("member%03d" % i, i // 7) for i in range(100))
+        self.cache.add_many_to_sorted_set(key, members)
+        expected = self.cache.sorted_set_range(key, 0, -1, withscores=True)
+        self.assertEqual(list(self.cache.iter_sorted_set(key, batch=3, withscores=True)), expected)
+        self.assertEqual(list(self.cache.iter_sorted_set(key, by='score', batch=3, withscores=True)), expected)
+        self.assertEqual(list(self.cache.iter_sorted_set(key, by='score', batch=3, reverse=True, withscores=True)),
+                         self.cache.sorted_set_rev_range(key, 0, -1, withscores=True))
+        self.assertEqual(list(self.cache.iter_sorted_set(key, by='score', batch=4, min=2, max=3)),
+                         self.cache.sorted_set_range_by_score(key, 2, 3))
+        self.assertEqual(list(self.cache.iter_sorted_set(key, reverse=True))[0], "member099")
+        self.assertEqual(list(self.cache.iter_sorted_set("does_not_exist")), [])
+        self.assertRaises(ValueError, list, self.cache.iter_sorted_set(key, by='lex'))
+
+    def test_sorted_set_union(self):
+        self.cache.add_many_to_sorted_set("a", {"x": 1, "y": 2})
+        self.cache.add_many_to_sorted_set("b", {"y": 3, "z": 4})
+        self.assertEqual(self.cache.sorted_set_union("dest", ["a", "b"]), 3)
+        self.assertEqual(self.cache.sorted_set_range("dest", 0, -1, withscores=True),
+                         [("x", 1), ("z", 4), ("y", 5)])
+        self.assertEqual(self.cache.sorted_set_intercept("dest", {"a": 2, "b": 1}), 1)
+        self.assertEqual(self.cache.sorted_set_range("dest", 0, -1, withscores=True), [("y", 7)])
+
+    def test_sorted_set_query(self):
+        self.cache.add_many_to_sorted_set("a", {"x": 1, "y": 2})
+        self.cache.add_many_to_sorted_set("b", {"y": 3, "z": 4})
+        key = self.cache.sorted_set_query(["a", "b"], operation='union', timeout=10)
+        self.assertEqual(self.cache.sorted_set_range(key, 0, -1), ["x", "z", "y"])
+        self.assertTrue(0 < self.cache._client.ttl(key) <= 10)
+        # The same query is served from the stored result until it expires
+        self.cache.add_to_sorted_set("a", "w", 10)
+        self.assertEqual(self.cache.sorted_set_query(["b", "a"], operation='union'), key)
+        self.assertEqual(self.cache.sorted_set_count(key), 3)
+        # Different weights make a different query
+        weighted = self.cache.sorted_set_query({"a": 1, "b": 2})
+        self.assertNotEqual(weighted, key)
+        self.assertEqual(self.cache.sorted_set_range(weighted, 0, -1, withscores=True), [("y", 8)])
+        self.assertRaises(ValueError, self.cache.sorted_set_query, ["a"], operation='difference')
+
+    def test_sorted_set_query_in_pipeline(self):
+        self.cache.add_many_to_sorted_set("a", {"x": 1, "y": 2})
+        self.cache.add_many_to_sorted_set("b", {"y": 3, "z": 4})
+        pipeline = self.cache.pipeline()
+        key = pipeline.sorted_set_query(["a", "b"], operation='union', timeout=10)
+        self.assertEqual(pipeline.execute(), [3, True])
+        self.assertEqual(key, self.cache.sorted_set_query(["a", "b"], operation='union'))
+        self.assertEqual(self.cache.sorted_set_range(key, 0, -1), ["x", "z", "y"])
+        self.assertTrue(0 < self.cache._client.ttl(key) <= 10)
+
+    def test_sorted_sets_many_in_pipeline(self):
+        key = self.cache.make_key("key")
+        pipeline = self.cache.pipeline()
+        pipeline.add_many_to_sorted_set(key, {"a": 1, "b": 2})
+        self.assertEqual(self.cache.sorted_set_count(key), 0)
+        pipeline.execute()
+        self.assertEqual(self.cache.sorted_set_range(key, 0, -1), ["a", "b"])
+
+    def test_hashes(self):
+        key = self.cache.make_key("key")
+        poll = Poll.objects.create(question="Well?")
+        self.assertTrue(self.cache.hset_many(key, {"poll": poll, "views": 1, "title": "spam"}, timeout=10))
+        self.assertTrue(0 < self.cache._client.ttl(key) <= 10)
+        self.assertEqual(self.cache.hget_fields(key, ["views", "title", "missing"]), {"views": 1, "title": "spam"})
+        self.assertEqual(self.cache.hget(key, "poll").question, poll.question)
+        self.assertEqual(self.cache.hget(key, "missing", "default"), "default")
+        self.assertEqual(self.cache.hincr(key, "views", 5), 6)
+        self.assertEqual(self.cache.hget(key, "views"), 6)
+        self.cache.hset(key, "title", "eggs", timeout=0)
+        self.assertEqual(self.cache.hget(key, "title"), "eggs")
+        self.assertEqual(self.cache.hdel_fields(key, ["poll"]), 1)
+        self.assertEqual(self.cache.hget_all(key), {"views": 6, "title": "eggs"})
+        self.assertFalse(self.cache.hset(key, "title", "ham", timeout=-1))
+        self.assertEqual(self.cache.hget_fields("does_not_exist", ["a"]), {})
+
+    def test_hashes_in_pipeline(self):
+        key = self.cache.make_key("key")
+        pipeline = self.cache.pipeline()
+        pipeline.hset_many(key, {"a": 1, "b": "b"}, timeout=10)
+        pipeline.hincr(key, "a")
+        self.assertEqual(self.cache.hget_all(key), {})
+        pipeline.execute()
+        self.assertEqual(self.cache.hget_all(key), {"a": 2, "b": "b"})
+        self.assertTrue(0 < self.cache._client.ttl(key) <= 10)
+
+    def test_batch(self):
+        self.cache.set_many({"a": "a", "b": 2})
+        with self.cache.batch() as batch:
+            a = batch.get("a")
+            many = batch.get_many(["a", "b", "missing"])
+            missing = batch.get("missing", "default")
+            batch.set("a", "new a")
+            new_a = batch.get("a")
+            batch.delete("b")
+            b = batch.get("b")
+            added = batch.add("a", "not added")
+            self.assertEqual(self.cache.get("a"), "a")
+        self.assertEqual(a.value, "a")
+        self.assertEqual(many.value, {"a": "a", "b": 2})
+        self.assertEqual(missing.value, "default")
+        self.assertEqual(new_a.value, "new a")
+        self.assertEqual(b.value, None)
+        self.assertEqual(added.value, False)
+        self.assertEqual(self.cache.get("a"), "new a")
+        # A failed add leaves the expiry alone
+        self.cache.set("a", "a", 1000)
+        with self.cache.batch() as batch:
+            added = batch.add("a", "not added", 5)
+        self.assertEqual(added.value, False)
+        self.assertTrue(self.cache.ttl("a") > 5)
+        with self.cache.batch() as batch:
+            added = batch.add("c", "c", 5)
+        self.assertEqual(added.value, True)
+        self.assertTrue(0 < self.cache.ttl("c") <= 5)
+
+    def test_batch_flushes_on_access(self):
+        batch = self.cache.batch()
+        batch.set("a", 1)
+        result = batch.get("a")
+        self.assertEqual(self.cache.get("a"), None)
+        self.assertEqual(result.value, 1)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(batch.get_many([]).value, {})
+        with self.assertRaises(KeyError):
+            with self.cache.batch() as batch:
+                batch.set("b", 1)
+                raise KeyError
+        self.assertEqual(self.cache.get("b"), None)
+
+    def test_batch_failure(self):
+        # Nothing listens on port 2
+        cache = get_cache('redis_cache.RedisCache', LOCATION='127.0.0.1:2')
+        batch = cache.batch()
+        result = batch.get("a")
+        written = batch.set("a", 1)
+        self.assertRaises(redis.ConnectionError, batch.flush)
+        self.assertRaises(redis.ConnectionError, getattr, result, 'value')
+        self.assertRaises(redis.ConnectionError, getattr, written, 'value')
+        try:
+            with self.cache.batch() as batch:
+                result = batch.get("a")
+                raise KeyError("a")
+        except KeyError:
+            pass
+        self.assertRaises(KeyError, getattr, result, 'value')
+
+    def test_request_memo(self):
+        self.cache.set("a", "a")
+        key = self.cache.make_key("a")
+        with request_memo:
+            self.assertEqual(self.cache.get("a"), "a")
+            self.assertEqual(self.cache.get("missing"), None)
+            # Changes made behind the backend's back are not seen...
+            self.cache._client.set(key, pickle.dumps("changed"))
+            self.cache._client.set(self.cache.make_key("missing"), 1)
+            self.assertEqual(self.cache.get("a"), "a")
+            self.assertEqual(self.cache.get_many(["a", "missing", "b"]), {"a": "a"})
+            # ...but writes through the backend are
+            self.cache.set("a", "b")
+            self.assertEqual(self.cache.get_many(["a", "missing"]), {"a": "b"})
+            self.cache.delete("a")
+            self.assertEqual(self.cache.get("a"), None)
+            get_cache('default').set("a", "c")
+            self.assertEqual(self.cache.get("a"), "c")
+            pipeline = self.cache.pipeline()
+            pipeline.set("a", "d")
+            pipeline.execute()
+            self.assertEqual(self.cache.get("a"), "d")
+            # ...and so are flushed counters
+            self.assertEqual(self.cache.get("n"), None)
+            counter = self.cache.counter("n")
+            counter.add(2)
+            counter.flush()
+            self.assertEqual(self.cache.get("n"), 2)
+        self.assertFalse(request_memo.active)
+        self.assertEqual(self.cache.get("missing"), 1)
+
+    def test_request_memo_middleware(self):
+        middleware = RequestMemoMiddleware()
+        middleware.process_request(None)
+        self.assertTrue(request_memo.active)
+        self.assertEqual(middleware.process_response(None, "response"), "response")
+        self.assertFalse(request_memo.active)
+
+    def test_socket_timeouts(self):
+        cache = self.get_redis_cache({
+            'DB': 13, 'SOCKET_TIMEOUT': 2, 'SOCKET_CONNECT_TIMEOUT': '0.5'
+        })
+        connection_kwargs = cache._client.connection_pool.connection_kwargs
+        self.assertEqual(connection_kwargs['socket_timeout'], 2.0)
+        self.assertEqual(connection_kwargs['socket_connect_timeout'], 0.5)
+        other = self.get_redis_cache({'DB': 13, 'SOCKET_TIMEOUT': 3})
+        self.assertEqual(other._client.connection_pool.connection_kwargs['socket_timeout'], 3.0)
+        self.assertRaises(ImproperlyConfigured, get_cache, 'redis_cache.RedisCache', LOCATION='127.0.0.1:6379',
+                          OPTIONS={'SOCKET_TIMEOUT': 'never'})
+
+    def test_unhashable_connection_pool_kwargs(self):
+        def get_cache_with(idle):
+            return self.get_redis_cache({'DB': 13, 'CONNECTION_POOL_CLASS_KWARGS': {
+                'socket_keepalive': True, 'socket_keepalive_options': {socket.TCP_KEEPIDLE: idle}
+            }})
+        cache = get_cache_with(60)
+        self.assertTrue(cache.set("a", 1))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertTrue(get_cache_with(60)._client.connection_pool is cache._client.connection_pool)
+        self.assertFalse(get_cache_with(30)._client.connection_pool is cache._client.connection_pool)
+        cache.clear()
+
+    def test_circuit_breaker(self):
+        # Nothing listens on port 1
+        cache = get_cache('redis_cache.RedisCache', LOCATION='127.0.0.1:1', OPTIONS={
+            'CIRCUIT_BREAKER': {'FAILURE_THRESHOLD': 2, 'RECOVERY_TIMEOUT': 1}
+        })
+        breaker = cache.circuit_breaker
+        self.assertTrue(breaker is get_cache('redis_cache.RedisCache', LOCATION='127.0.0.1:1', OPTIONS={
+            'CIRCUIT_BREAKER': {'FAILURE_THRESHOLD': '2', 'RECOVERY_TIMEOUT': 1}
+        }).circuit_breaker)
+        # Backends with other thresholds get a breaker of their own
+        self.assertFalse(breaker is get_cache('redis_cache.RedisCache', LOCATION='127.0.0.1:1', OPTIONS={
+            'CIRCUIT_BREAKER': {}
+        }).circuit_breaker)
+        changes = []
+
+        def receiver(sender, breaker, old_state, new_state, **kwargs):
+            changes.append((old_state, new_state))
+        circuit_breaker_state_changed.connect(receiver)
+        try:
+            self.assertRaises(redis.ConnectionError, cache.get, "a")
+            self.assertRaises(redis.ConnectionError, cache.set, "a", "a")
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+            # Degraded mode: reads miss and writes are dropped without network
+            self.assertEqual(cache.get("a", "default"), "default")
+            self.assertEqual(cache.get_many(["a", "b"]), {})
+            self.assertEqual(cache.set("a", "a"), False)
+            self.assertEqual(cache.has_key("a"), False)
+            cache.delete("a")
+            cache.set_many({"a": "a"})
+            self.assertRaises(CircuitOpenError, cache.incr, "a")
+            self.assertEqual(breaker.stats['rejected'], 7)
+            time.sleep(1)
+            # The half-open probe fails and opens the circuit again
+            self.assertRaises(redis.ConnectionError, cache.get, "a")
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+            breaker._opened_at -= 1
+            breaker.call(lambda: None)
+            self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+            self.assertEqual(changes, [('closed', 'open'), ('open', 'half-open'), ('half-open', 'open'),
+                                       ('open', 'half-open'), ('half-open', 'closed')])
+        finally:
+            circuit_breaker_state_changed.disconnect(receiver)
+
+    def test_retry_policy(self):
+        attempts = []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise redis.ConnectionError
+            return "ok"
+        policy = RetryPolicy(max_attempts=3, backoff=0.001)
+        self.assertEqual(policy.call(flaky), "ok")
+        self.assertEqual(policy.stats, {'retries': 2, 'gave_up': 0})
+        attempts[:] = []
+        self.assertRaises(redis.ConnectionError, RetryPolicy(max_attempts=2, backoff=0.001).call, flaky)
+        self.assertEqual(len(attempts), 2)
+        attempts[:] = []
+        self.assertRaises(redis.ConnectionError, RetryPolicy(max_attempts=5, backoff=1, deadline=0).call, flaky)
+        self.assertEqual(len(attempts), 1)
+        self.assertTrue(policy.is_idempotent([('GET', 'a'), (b'mget', 'a', 'b'), ('set', 'a', 'NX', 'EX', 1)]))
+        self.assertFalse(policy.is_idempotent([('GET', 'a'), ('INCRBY', 'a', 1)]))
+        self.assertFalse(policy.is_idempotent([('SET', 'a', 1, 'EX', 1, 'NX')]))
+        self.assertFalse(policy.is_idempotent([('SET', 'a', 1, b'xx')]))
+
+    def test_retry_only_idempotent_commands(self):
+        # Nothing listens on port 2
+        cache = get_cache('redis_cache.RedisCache', LOCATION='127.0.0.1:2', OPTIONS={
+            'RETRY': {'MAX_ATTEMPTS': 3, 'BACKOFF': 0.001}
+        })
+        stats = cache.retry_policy.stats
+        self.assertFalse(cache.retry_policy is get_cache('redis_cache.RedisCache', LOCATION='127.0.0.1:2', OPTIONS={
+            'RETRY': {'MAX_ATTEMPTS': 5}
+        }).retry_policy)
+        self.assertRaises(redis.ConnectionError, cache.get, "a")
+        self.assertEqual(stats, {'retries': 2, 'gave_up': 1})
+        self.assertRaises(redis.ConnectionError, cache._client.incr, "a")
+        self.assertEqual(stats, {'retries': 2, 'gave_up': 1})
+        self.assertRaises(redis.ConnectionError, cache.add, "a", 1)
+        self.assertEqual(stats, {'retries': 2, 'gave_up': 1})
+        self.assertRaises(redis.ConnectionError, cache.set_many, {"a": 1, "b": 2})
+        self.assertEqual(stats, {'retries': 4, 'gave_up': 2})
+        pipeline = cache._client.pipeline()
+        pipeline.set("a", 1)
+        pipeline.incr("a")
+        self.assertRaises(redis.ConnectionError, pipeline.execute)
+        self.assertEqual(stats, {'retries': 4, 'gave_up': 2})
+
+    def test_retry_policy_resends_pipeline(self):
+        cache = self.get_redis_cache({
+            'DB': 15, 'RETRY': {'BACKOFF': 0.001}
+        })
+        pipeline = cache._client.pipeline()
+        pipeline.set("a", 1)
+        execute = redis.client.BasePipeline.execute
+        attempts = []
+
+        def flaky_execute(self, raise_on_error=True):
+            attempts.append(list(self.command_stack))
+            if len(attempts) == 1:
+                self.reset()
+                raise redis.ConnectionError
+            return execute(self, raise_on_error)
+        redis.client.BasePipeline.execute = flaky_execute
+        try:
+            self.assertEqual(pipeline.execute(), [True])
+        finally:
+            redis.client.BasePipeline.execute = execute
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(attempts[0], attempts[1])
+        self.assertEqual(cache._client.get("a"), b"1")
+
+    def test_write_behind(self):
+        cache = self.get_redis_cache({
+            'DB': self.cache.db, 'WRITE_BEHIND': {'FLUSH_INTERVAL': 60}
+        })
+        buffer = cache.write_behind
+        self.assertTrue(buffer is self.get_redis_cache({
+            'DB': self.cache.db, 'WRITE_BEHIND': {'FLUSH_INTERVAL': '60'}
+        }).write_behind)
+        # Backends configured differently get a buffer of their own
+        self.assertFalse(buffer is self.get_redis_cache({
+            'DB': self.cache.db, 'WRITE_BEHIND': {}
+        }).write_behind)
+        self.assertFalse(buffer is self.get_redis_cache({
+            'DB': self.cache.db, 'WRITE_BEHIND': {'FLUSH_INTERVAL': 60}, 'MAX_VALUE_SIZE': 100
+        }).write_behind)
+        self.assertFalse(buffer is self.get_redis_cache({
+            'DB': self.cache.db, 'WRITE_BEHIND': {'FLUSH_INTERVAL': 60}, 'NEGATIVE_CACHE': {}
+        }).write_behind)
+        self.assertEqual(cache.set("a", "first"), True)
+        self.assertEqual(cache.set("a", "second"), True)
+        cache.set_many({"b": 2, "c": "c"})
+        cache.delete("c")
+        self.assertEqual(len(buffer), 3)
+        # Pending writes are visible to this process only
+        self.assertEqual(self.cache.get("a"), None)
+        self.assertEqual(cache.get("a"), "second")
+        self.assertEqual(cache.get("c", "deleted"), "deleted")
+        self.assertEqual(cache.get_many(["a", "b", "c"]), {"a": "second", "b": 2})
+        self.assertTrue(cache.has_key("b"))
+        self.assertFalse(cache.has_key("c"))
+        buffer.flush()
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(self.cache.get_many(["a", "b", "c"]), {"a": "second", "b": 2})
+        # Commands depending on the stored value send the pending writes first
+        cache.set("b", 5)
+        self.assertEqual(cache.incr("b"), 6)
+        self.assertEqual(self.cache.get("b"), 6)
+        cache.set("d", 1)
+        self.assertEqual(cache.add("d", 2), False)
+
+    def test_write_behind_background_flush(self):
+        client = self.cache._client
+        buffer = WriteBehindBuffer(client, lambda pipeline, key, operation: pipeline.set(key, operation),
+                                   flush_interval=0.01)
+        buffer.put("a", 1)
+        buffer.put("a", 2)
+        self.assertEqual(buffer.stats['coalesced'], 1)
+        for i in range(100):
+            if buffer.stats['written']:
+                break
+            time.sleep(0.01)
+        self.assertEqual(client.get("a"), b"2")
+        self.assertEqual(buffer.stats['written'], 1)
+        # The thread sleeps while nothing is pending
+        flushes = buffer.stats['flushes']
+        time.sleep(0.05)
+        self.assertEqual(buffer.stats['flushes'], flushes)
+        buffer.put("b", 1)
+        for i in range(100):
+            if buffer.stats['written'] > 1:
+                break
+            time.sleep(0.01)
+        self.assertEqual(client.get("b"), b"1")
+
+    def test_write_behind_keeps_writes_on_connection_errors(self):
+        failures = []
+
+        def write(pipeline, key, operation):
+            if failures:
+                if key == "a":
+                    # Written while the flush fails
+                    buffer.put("c", 1)
+                failures.pop()
+                raise redis.ConnectionError
+            pipeline.set(key, operation)
+        buffer = WriteBehindBuffer(self.cache._client, write, max_size=2, flush_interval=60)
+        buffer.put("a", 1)
+        buffer.put("b", 1)
+        failures.append(True)
+        buffer.flush()
+        self.assertEqual(buffer.stats['errors'], 1)
+        # "c" is newer than the writes kept for retry: the oldest is dropped
+        self.assertEqual(buffer.stats['dropped'], 1)
+        self.assertEqual(buffer.get("a"), None)
+        self.assertEqual(list(buffer._pending), ["b", "c"])
+        buffer.flush()
+        self.assertEqual(self.cache._client.mget(["a", "b", "c"]), [None, b"1", b"1"])
+
+    def test_write_behind_rejects_large_values(self):
+        cache = self.get_redis_cache({
+            'DB': self.cache.db, 'WRITE_BEHIND': {'FLUSH_INTERVAL': 60}, 'MAX_VALUE_SIZE': 100
+        })
+        self.assertTrue(cache.set("a", "small"))
+        self.assertFalse(cache.set("a", "x" * 200))
+        self.assertEqual(cache.get("a"), None)
+        cache.write_behind.flush()
+        self.assertEqual(self.cache.get("a"), None)
+
+    def test_write_behind_overflow(self):
+        write = lambda pipeline, key, operation: pipeline.set(key, operation)
+        buffer = WriteBehindBuffer(self.cache._client, write, max_size=2, flush_interval=60, overflow='drop_newest')
+        buffer.put("a", 1)
+        buffer.put("b", 1)
+        self.assertFalse(buffer.put("c", 1))
+        self.assertTrue(buffer.put("a", 2))
+        self.assertEqual(buffer.get("c"), None)
+        buffer = WriteBehindBuffer(self.cache._client, write, max_size=2, flush_interval=60, overflow='drop_oldest')
+        buffer.put("a", 1)
+        buffer.put("b", 1)
+        self.assertTrue(buffer.put("c", 1))
+        self.assertEqual(buffer.get("a"), None)
+        self.assertEqual(buffer.stats['dropped'], 1)
+        buffer = WriteBehindBuffer(self.cache._client, write, max_size=2, flush_interval=60)
+        buffer.put("a", 1)
+        buffer.put("b", 1)
+        buffer.put("c", 1)
+        # The writing thread flushed the full buffer
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(self.cache._client.mget(["a", "b", "c"]), [b"1", b"1", b"1"])
+        self.assertRaises(ImproperlyConfigured, get_cache, 'redis_cache.RedisCache', LOCATION='127.0.0.1:6379',
+                          OPTIONS={'WRITE_BEHIND': {'OVERFLOW': 'spill'}})
+
+    def test_warmup(self):
+        items = (("key%s" % i, i, 10 if i % 2 else None) for i in range(25))
+        self.assertEqual(warmup(self.cache, items, chunk_size=10), 25)
+        self.assertEqual(self.cache.get("key24"), 24)
+        self.assertEqual(self.cache.ttl("key1"), 10)
+        self.assertEqual(self.cache.ttl("key2"), self.cache.default_timeout)
+
+    def test_export_import(self):
+        self.cache.set("a", "a", 100)
+        self.cache.set("b", 2, 0)
+        self.cache.set("c", "c", version=2)
+        self.cache.set("d", "d", 100)
+        for format in ("dump", "raw"):
+            stream = BytesIO()
+            self.assertEqual(export_keys(self.cache, stream, format=format, chunk_size=1), 3)
+            self.cache.clear()
+            self.cache.set("b", 3)
+            self.cache.set("d", 4, 0)
+            stream.seek(0)
+            # Existing keys are kept with their expiry and not counted
+            self.assertEqual(import_keys(self.cache, stream, workers=2, chunk_size=1, replace=False), 1)
+            self.assertEqual(self.cache.get_many(["a", "b", "d"]), {"a": "a", "b": 3, "d": 4})
+            self.assertTrue(0 < self.cache.ttl("a") <= 100)
+            self.assertEqual(self.cache.ttl("d"), None)
+            self.assertEqual(self.cache.get("c", version=2), None)
+            stream.seek(0)
+            self.assertEqual(import_keys(self.cache, stream), 3)
+            self.assertEqual(self.cache.get("b"), 2)
+            self.assertEqual(self.cache.ttl("b"), None)
+            self.assertTrue(0 < self.cache.ttl("d") <= 100)
+        self.assertRaises(ValueError, import_keys, self.cache, BytesIO(b"not an export"))
+
+    def test_key_pattern_escapes_prefix(self):
+        cache = self.get_redis_cache({'DB': self.cache.db}, KEY_PREFIX='pre*fix')
+        other = self.get_redis_cache({'DB': self.cache.db}, KEY_PREFIX='pre-other-fix')
+        cache.set("a", 1)
+        other.set("a", 2)
+        self.assertEqual(key_pattern(cache), 'pre\\*fix:1:*')
+        self.assertEqual(key_pattern(cache, all_versions=True), 'pre\\*fix:*:*')
+        stream = BytesIO()
+        self.assertEqual(export_keys(cache, stream), 1)
+        self.assertEqual(analyze_keys(cache)['groups'][0]['pattern'], 'pre*fix:1:a')
+        other.delete("a")
+
+    def test_export_import_commands(self):
+        self.cache.set("a", "a")
+        self.cache.set("b", "b", version=2)
+        fd, path = tempfile.mkstemp(suffix=".gz")
+        os.close(fd)
+        try:
+            call_command("redis_cache_export", path, all_versions=True, stdout=StringIO())
+            self.cache.clear()
+            call_command("redis_cache_import", path, rate=1000, stdout=StringIO())
+        finally:
+            os.remove(path)
+        self.assertEqual(self.cache.get("a"), "a")
+        self.assertEqual(self.cache.get("b", version=2), "b")
+
+    def test_analyze_keys(self):
+        prefix = key_pattern(self.cache)[:-1]
+        for i in range(20):
+            self.cache.set("user:%s:profile" % i, "x" * 100, timeout=0)
+        self.cache.set("user:1:avatar", "x" * 10000, timeout=30)
+        self.cache.set("session", 1, timeout=7200)
+        self.cache.set("other", 1, version=2)
+        report = analyze_keys(self.cache, depth=1, top=2, chunk_size=7, rate=1000)
+        self.assertEqual((report['scanned'], report['analyzed']), (22, 22))
+        user, session = report['groups']
+        self.assertEqual(user['pattern'], prefix + "user:*")
+        self.assertEqual(user['count'], 21)
+        self.assertEqual(user['ttls']['no expiry'], 20)
+        self.assertEqual(user['ttls']['< 1m'], 1)
+        self.assertEqual(user['max'], report['largest'][0][1])
+        self.assertTrue(user['p50'] <= user['p90'] <= user['p99'] <= user['max'])
+        self.assertEqual(session['pattern'], prefix + "session")
+        self.assertEqual(session['ttls']['< 1d'], 1)
+        self.assertEqual(session['encodings'], {'int': 1})
+        self.assertEqual(report['bytes'], user['bytes'] + session['bytes'])
+        self.assertEqual([key for key, size in report['largest']][0], prefix + "user:1:avatar")
+        self.assertEqual(len(report['largest']), 2)
+        self.assertEqual(group_pattern(prefix + "user:1:profile", prefix, depth=2), prefix + "user:1:*")
+        report = analyze_keys(self.cache, key_pattern(self.cache, all_versions=True), sample=0.5)
+        self.assertEqual(report['scanned'], 23)
+        self.assertTrue(report['analyzed'] < 23)
+        out = StringIO()
+        call_command("redis_cache_analyze", depth=1, rate=0, stdout=out)
+        self.assertTrue("Analyzed 22 of 22 keys" in out.getvalue())
+        self.assertTrue(prefix + "user:*" in out.getvalue())
+
+    def test_max_value_size_reject(self):
+        cache = self.get_redis_cache({
+            'DB': self.cache.db, 'MAX_VALUE_SIZE': 100
+        })
+        self.assertTrue(cache.set("a", "small"))
+        self.assertFalse(cache.set("a", "x" * 200))
+        # The previous value is dropped rather than left stale
+        self.assertEqual(cache.get("a"), None)
+        self.assertTrue(cache.set("b", 10))
+        self.assertRaises(ImproperlyConfigured, get_cache, 'redis_cache.RedisCache', LOCATION='127.0.0.1:6379',
+                          OPTIONS={'MAX_VALUE_SIZE': {'SIZE': 100, 'POLICY': 'truncate'}})
+
+    def test_max_value_size_warn(self):
+        cache = self.get_redis_cache({
+            'DB': self.cache.db, 'MAX_VALUE_SIZE': {'SIZE': 100, 'POLICY': 'warn'}
+        })
+        self.assertTrue(cache.set("a", "x" * 200))
+        self.assertEqual(cache.get("a"), "x" * 200)
+
+    def test_max_value_size_chunk(self):
+        cache = self.get_redis_cache({
+            'DB': self.cache.db, 'MAX_VALUE_SIZE': {'SIZE': 1000, 'POLICY': 'chunk', 'CHUNK_BYTES': 1000}
+        })
+        client = self.cache._client
+
+        def stored_chunks():
+            return [key for key in client.keys('*') if key.startswith(smart_bytes(CHUNKS_PREFIX))]
+        value = [str(i) for i in range(2000)]
+        self.assertTrue(cache.set("a", value, 100))
+        self.assertTrue(cache.set("b", "b"))
+        chunks = chunk_key(cache.make_key("a"))
+        self.assertEqual(stored_chunks(), [smart_bytes(chunks)])
+        self.assertTrue(client.hlen(chunks) > 1)
+        self.assertTrue(0 < client.ttl(chunks) <= 100)
+        self.assertEqual(cache.get("a"), value)
+        self.assertEqual(cache.get_many(["a", "b", "c"]), {"a": value, "b": "b"})
+        with cache.batch() as batch:
+            result = batch.get("a")
+        self.assertEqual(result.value, value)
+        # A failed add leaves the value, its chunks and their expiry alone
+        client.expire(chunks, 50)
+        self.assertFalse(cache.add("a", "other"))
+        self.assertFalse(cache.add("a", list(reversed(value)), 200))
+        self.assertEqual(cache.get("a"), value)
+        self.assertTrue(client.ttl(chunks) <= 50)
+        self.assertTrue(cache.add("c", value, 200))
+        self.assertEqual(cache.get("c"), value)
+        self.assertTrue(100 < client.ttl(chunk_key(cache.make_key("c"))) <= 200)
+        if not isinstance(client.connection_pool, fake.FakeConnectionPool) or fake.lupa is not None:
+            # Added in a batch with a script
+            with cache.batch() as batch:
+                added = [batch.add("a", list(reversed(value)), 200), batch.add("d", value, 200)]
+                other = batch.get("b")
+            self.assertEqual([result.value for result in added], [False, True])
+            self.assertEqual(other.value, "b")
+            self.assertEqual(cache.get("a"), value)
+            self.assertTrue(client.ttl(chunks) <= 50)
+            self.assertEqual(cache.get("d"), value)
+            self.assertTrue(100 < client.ttl(chunk_key(cache.make_key("d"))) <= 200)
+            cache.delete("d")
+        # The chunks follow the expiry of their value
+        self.assertTrue(cache.touch("a", 0))
+        self.assertEqual(client.ttl(chunks), None)
+        self.assertEqual(cache.touch_many(["a", "b", "missing"], 300), ["a", "b"])
+        self.assertTrue(200 < client.ttl(chunks) <= 300)
+        self.assertTrue(cache.persist("a"))
+        self.assertEqual(client.ttl(chunks), None)
+        cache.incr_version("a")
+        self.assertEqual(cache.get("a", version=2), value)
+        self.assertFalse(client.exists(chunks))
+        # A corrupted chunk turns the value into a miss
+        chunks = chunk_key(cache.make_key("a", version=2))
+        client.hset(chunks, 0, "x")
+        self.assertEqual(cache.get("a", version=2), None)
+        # Deletes remove the chunks without reading the manifest first
+        pipeline = cache.pipeline()
+        pipeline.delete("a", version=2)
+        self.assertEqual(pipeline.execute(), [2])
+        with cache.batch() as batch:
+            batch.delete("c")
+        self.assertEqual(stored_chunks(), [])
+        # So do smaller values and values rejected by other backends
+        cache.set("a", value)
+        cache.set("a", "small")
+        self.assertFalse(client.exists(chunk_key(cache.make_key("a"))))
+        cache.set("a", value)
+        self.assertFalse(self.get_redis_cache({'DB': self.cache.db, 'MAX_VALUE_SIZE': 1000}).set("a", value))
+        self.assertEqual(stored_chunks(), [])
+        # Only the replies of the commands queued by the caller are returned
+        pipeline = cache.pipeline()
+        pipeline.set("e", "small")
+        pipeline.set("f", value)
+        pipeline.delete("missing")
+        self.assertEqual(pipeline.execute(), [True, True, 0])
+        with cache.batch() as batch:
+            results = [batch.set("e", value), batch.set("f", "small")]
+        self.assertEqual([result.value for result in results], [True, True])
+        self.assertEqual(cache.get_many(["e", "f"]), {"e": value, "f": "small"})
+        # Keys named like chunks are left alone
+        cache.set("report:chunks", "mine")
+        cache.set("report", "small")
+        cache.delete("report")
+        self.assertEqual(cache.get("report:chunks"), "mine")
+        # Chunks that are not a hash are a miss
+        cache.set("a", value)
+        client.set(chunk_key(cache.make_key("a")), "x")
+        self.assertEqual(cache.get("a"), None)
+
+    def test_max_key_length(self):
+        cache = self.get_redis_cache({
+            'DB': self.cache.db, 'MAX_KEY_LENGTH': 50
+        }, KEY_PREFIX='prefix')
+        self.assertEqual(str(cache.make_key("short", version=3)), "prefix:3:short")
+        long_key = "long" * 20
+        key = str(cache.make_key(long_key))
+        self.assertTrue(key.startswith("prefix:1:#"))
+        self.assertTrue(len(key) < 60)
+        self.assertNotEqual(key, str(cache.make_key(long_key, version=2)))
+        self.assertTrue(str(cache.make_key("{user:1}" + long_key)).startswith("prefix:1:{user:1}#"))
+        cache.set(long_key, "value")
+        self.assertEqual(cache.get(long_key), "value")
+        self.assertEqual(self.cache._client.get(key), pickle.dumps("value"))
+
+    def test_cache_key(self):
+        key = self.cache.make_key(u"ключ")
+        self.assertFalse(hasattr(key, '__dict__'))
+        self.assertEqual(key.encoded, u":1:ключ".encode('utf-8'))
+        self.assertTrue(key == u":1:ключ")
+        self.assertFalse(key != u":1:ключ")
+        self.assertTrue(self.cache.make_key(key) is key)
+
+    def test_negative_cache(self):
+        cache = self.get_redis_cache({
+            'DB': self.cache.db, 'NEGATIVE_CACHE': {'TIMEOUT': 0.2}
+        })
+        negative_cache = cache.negative_cache
+        self.assertEqual(cache.get("a", "default"), "default")
+        self.assertEqual(negative_cache.stats['hits'], 0)
+        # Written by another backend: not seen until the entry expires
+        self.cache.set("a", "a")
+        self.assertEqual(cache.get("a", "default"), "default")
+        self.assertEqual(cache.get_many(["a"]), {})
+        self.assertEqual(negative_cache.stats['hits'], 2)
+        time.sleep(0.3)
+        self.assertEqual(cache.get_many(["a", "b"]), {"a": "a"})
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(negative_cache.stats['hits'], 3)
+        # Written through a backend sharing the negative cache: seen at once
+        cache.set("b", "b")
+        self.assertEqual(cache.get("b"), "b")
+        cache.get("c")
+        pipeline = cache.pipeline()
+        pipeline.set("c", "c")
+        pipeline.execute()
+        self.assertEqual(cache.get("c"), "c")
+        # Backends with other options have their own negative cache
+        other = self.get_redis_cache({'DB': self.cache.db, 'NEGATIVE_CACHE': {'TIMEOUT': 60}})
+        self.assertFalse(other.negative_cache is negative_cache)
+        self.assertEqual(other.negative_cache.timeout, 60)
+
+    def test_bloom_filter(self):
+        # Negative caches are shared per server, db and options: use another db
+        cache = self.get_redis_cache({
+            'DB': 14, 'NEGATIVE_CACHE': {
+                'TIMEOUT': 0, 'BLOOM_FILTER': {'KEY': 'test:bloom', 'BITS': 1024, 'REFRESH_INTERVAL': 60}
+            }
+        })
+        bloom_filter = cache.negative_cache.bloom_filter
+        try:
+            # Until the bitmap is seeded every key may exist
+            cache._client.set(cache.make_key("a"), 1)
+            bloom_filter.refresh()
+            self.assertEqual(cache.get("a"), 1)
+            # Keys written before the bitmap existed are added when seeding it
+            bloom_filter._seeder.join()
+            bloom_filter.refresh()
+            self.assertIsNotNone(bloom_filter._bitmap)
+            cache.set_many({"b": "b", "c": "c"})
+            self.assertEqual(cache.get_many(["a", "b", "c", "d"]), {"a": 1, "b": "b", "c": "c"})
+            self.assertEqual(cache.negative_cache.stats['hits'], 1)
+            pipeline = cache.pipeline()
+            pipeline.set("d", "d")
+            pipeline.delete("missing")
+            self.assertEqual(pipeline.execute(), [True, 0])
+            self.assertEqual(cache.get("d"), "d")
+            self.assertTrue(bloom_filter.might_contain(cache.make_key("d")))
+            self.assertFalse(bloom_filter.might_contain(cache.make_key("e")))
+            # A write and its mark are sent in one transaction
+            execute_command = cache._client.execute_command
+            cache._client.execute_command = None
+            try:
+                self.assertTrue(cache.set("g", "g"))
+                self.assertFalse(cache.add("g", "h"))
+                self.assertTrue(cache.add("h", "h", 60))
+            finally:
+                cache._client.execute_command = execute_command
+            self.assertEqual(cache.get_many(["g", "h"]), {"g": "g", "h": "h"})
+            self.assertTrue(bloom_filter.might_contain(cache.make_key("h")))
+            # Keys created by INCRBY
+            counter = cache.counter("n")
+            counter.add(3)
+            counter.flush()
+            self.assertEqual(cache.get("n"), 3)
+            # Keys written by another process are seen after a refresh
+            key = cache.make_key("f")
+            BloomFilter(cache._client, 'test:bloom', 1024).add(cache._client, [key])
+            cache._client.set(key, 1)
+            self.assertEqual(cache.get("f"), None)
+            bloom_filter.refresh()
+            self.assertEqual(cache.get("f"), 1)
+            # A stale copy is not used while another thread downloads it
+            bloom_filter._refreshed_at -= 60
+            with bloom_filter._lock:
+                self.assertTrue(bloom_filter.might_contain(cache.make_key("e")))
+            self.assertFalse(bloom_filter.might_contain(cache.make_key("e")))
+            # Once the bitmap is gone every key may exist again
+            cache._client.delete('test:bloom')
+            bloom_filter.refresh()
+            self.assertTrue(bloom_filter.might_contain(cache.make_key("e")))
+            bloom_filter._seeder.join()
+        finally:
+            cache.clear()
+
+    def test_scripts(self):
+        if isinstance(self.cache._client.connection_pool, fake.FakeConnectionPool) and fake.lupa is None:
+            self.skipTest("Lua scripts need lupa with the in-memory server")
+        self.cache.register_script('getset', "return redis.call('GETSET', KEYS[1], ARGV[1])")
+        self.cache.register_script('strlen', "return {redis.call('STRLEN', KEYS[1]), KEYS[1]}",
+                                   decode_result=False)
+        self.assertRaises(ValueError, self.cache.call_script, 'unknown')
+        self.cache._client.script_flush()
+        self.assertEqual(self.cache.call_script('getset', keys=["a"], args=[{"b": 1}]), None)
+        self.assertEqual(self.cache.call_script('getset', keys=["a"], args=[2]), {"b": 1})
+        self.assertEqual(self.cache.get("a"), 2)
+        self.assertEqual(self.cache.call_script('strlen', keys=["a"]), [1, b":1:a"])
+        self.assertEqual(self.cache.call_script('getset', keys=["a"], args=["v2"], version=2), None)
+        self.assertEqual(self.cache.get("a", version=2), "v2")
+        # Scripts are loaded before the pipeline is sent
+        self.cache._client.script_flush()
+        pipeline = self.cache.pipeline()
+        pipeline.set("b", "b")
+        pipeline.call_script('getset', keys=["b"], args=["c"])
+        pipeline.call_script('getset', keys=["b"], args=["d"])
+        self.assertEqual(pipeline.execute(), [True, "b", "c"])
+        self.assertEqual(self.cache.get("b"), "d")
+        self.cache._client.script_flush()
+        self.cache.load_scripts()
+        sha = self.cache.scripts['getset'].sha
+        self.assertEqual(self.cache._client.script_exists(sha), [True])
+
+    def test_queryset_caching(self):
+        Poll.objects.create(question="What?", answer="This")
+        self.assertEqual([poll.answer for poll in Poll.cached.filter(question="What?")], ["This"])
+        # Served from the cache: changes made without the ORM are not seen
+        Poll.objects.filter(question="What?").update(answer="That")
+        with self.assertNumQueries(0):
+            self.assertEqual([poll.answer for poll in Poll.cached.filter(question="What?")], ["This"])
+        with self.assertNumQueries(1):
+            self.assertEqual([poll.answer for poll in Poll.cached.nocache().filter(question="What?")], ["That"])
+        with self.assertNumQueries(1):
+            self.assertEqual([poll.answer for poll in Poll.cached.select_for_update().filter(question="What?")],
+                             ["That"])
+        # Saving any poll invalidates every cached poll query
+        Poll.objects.create(question="Who?")
+        with self.assertNumQueries(1):
+            self.assertEqual([poll.answer for poll in Poll.cached.filter(question="What?")], ["That"])
+        poll = Poll.cached.get(question="Who?")
+        with self.assertNumQueries(0):
+            self.assertEqual(Poll.cached.get(question="Who?"), poll)
+        poll.delete()
+        self.assertRaises(Poll.DoesNotExist, Poll.cached.get, question="Who?")
+        Poll.cached.filter(question="What?").update(answer="Them")
+        self.assertEqual([poll.answer for poll in Poll.cached.all()], ["Them"])
+        self.assertEqual(list(Poll.cached.filter(pk__in=[])), [])
+
+    def test_queryset_caching_in_transaction(self):
+        orm._local.pending = []
+        cache = get_cache('default')
+        key = orm.generation_key(Poll._meta.db_table)
+        # Tests run in a transaction: the generation is bumped at once, and
+        # again once it is committed
+        Poll.objects.create(question="What?")
+        generation = cache.get(key)
+        self.assertEqual(len(orm._local.pending), 1)
+        orm._run_committed()
+        self.assertEqual(cache.get(key), generation)
+        connection.in_atomic_block = False
+        try:
+            orm._run_committed()
+        finally:
+            connection.in_atomic_block = True
+        self.assertEqual(cache.get(key), generation + 1)
+        self.assertEqual(orm._local.pending, [])
+
+    def test_session(self):
+        session = SessionStore()
+        session['a'] = 1
+        session['b'] = [1, 2]
+        session.save()
+        key = session._hash_key()
+        self.assertTrue(session.exists(session.session_key))
+        self.assertTrue(0 < self.cache._client.ttl(key) <= session.get_expiry_age())
+        session = SessionStore(session.session_key)
+        self.assertEqual(session['b'], [1, 2])
+        # Only the changed fields are written
+        self.cache._client.hset(key, 'a', session._field_serializer.dumps(2))
+        self.cache._client.expire(key, 10)
+        session['b'] = [3]
+        session['c'] = 'c'
+        session.save()
+        self.assertTrue(self.cache._client.ttl(key) > 10)
+        session = SessionStore(session.session_key)
+        self.assertEqual(dict(session.items()), {'a': 2, 'b': [3], 'c': 'c'})
+        del session['a']
+        session.save()
+        self.assertEqual(dict(SessionStore(session.session_key).items()), {'b': [3], 'c': 'c'})
+        # Expired since loaded: written again as a whole
+        self.cache._client.delete(key)
+        session['c'] = 'd'
+        session.save()
+        self.assertEqual(dict(SessionStore(session.session_key).items()), {'b': [3], 'c': 'd'})
+        self.assertTrue(self.cache._client.ttl(key) > 10)
+        # Empty sessions still exist
+        session.clear()
+        session.save()
+        self.assertTrue(session.exists(session.session_key))
+        self.assertEqual(dict(SessionStore(session.session_key).items()), {})
+        session['d'] = 'd'
+        old_key = session.session_key
+        session.cycle_key()
+        self.assertFalse(session.exists(old_key))
+        self.assertEqual(dict(SessionStore(session.session_key).items()), {'d': 'd'})
+        session.flush()
+        self.assertFalse(session.exists(old_key))
+        self.assertEqual(dict(SessionStore("unknown").items()), {})
+
+    def test_counter(self):
+        # The buffer is created by the first counter
+        self.assertEqual(self.cache.counters, None)
+        views = self.cache.counter("views")
+        self.assertTrue(self.cache.counter("other").buffer is views.buffer)
+        views.add()
+        views.add(2)
+        self.assertEqual(views.value(), 3)
+        views.flush()
+        self.assertEqual(views.pending(), 0)
+        self.assertEqual(self.cache.get("views"), 3)
+        views.add(-1)
+        self.assertEqual(views.value(), 2)
+        hits = self.cache.counter("hits", field="home", timeout=60)
+        hits.add(5)
+        self.assertEqual(hits.value(), 5)
+        self.cache.counter("hits", field="about").add()
+        hits.flush()
+        self.assertEqual(self.cache.hget_all("hits"), {"home": 5, "about": 1})
+        self.assertTrue(0 < self.cache.ttl("hits") <= 60)
+        self.assertEqual(self.cache.get("views"), 2)
+
+        def add():
+            for i in range(1000):
+                views.add()
+        threads = [threading.Thread(target=add) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(views.value(), 4002)
+        views.flush()
+        self.assertEqual(self.cache.get("views"), 4002)
+        # A backend with other options flushes its counters with its own
+        # callbacks: the negative cache forgets them once they are stored
+        cache = self.get_redis_cache({'DB': self.cache.db, 'NEGATIVE_CACHE': {'TIMEOUT': 60}})
+        self.assertEqual(cache.get("views:other"), None)
+        other = cache.counter("views:other")
+        self.assertFalse(other.buffer is views.buffer)
+        other.add(2)
+        other.flush()
+        self.assertEqual(cache.get("views:other"), 2)
+
+    def test_hyperloglog(self):
+        self.assertTrue(self.cache.pfadd("visitors:mon", ["a", "b", "c"], timeout=60))
+        self.assertFalse(self.cache.pfadd("visitors:mon", ["a"]))
+        self.assertFalse(self.cache.pfadd("visitors:mon", []))
+        self.cache.pfadd("visitors:tue", ["c", "d", 1], timeout=0)
+        self.assertEqual(self.cache.pfcount("visitors:mon"), 3)
+        self.assertEqual(self.cache.pfcount(["visitors:mon", "visitors:tue"]), 5)
+        self.assertEqual(self.cache.pfcount("visitors:wed"), 0)
+        self.cache.pfmerge("visitors:week", ["visitors:mon", "visitors:tue"], timeout=60)
+        self.assertEqual(self.cache.pfcount("visitors:week"), 5)
+        self.assertTrue(0 < self.cache.ttl("visitors:week") <= 60)
+        self.assertEqual(self.cache.ttl("visitors:tue"), None)
+
+    def test_bitmaps(self):
+        self.assertEqual(self.cache.setbit_many("flags", [1, 5, 1000], timeout=60), [0, 0, 0])
+        self.assertEqual(self.cache.setbit_many("flags", [5, 6]), [1, 0])
+        self.assertEqual(self.cache.setbit_many("flags", []), [])
+        self.assertEqual(self.cache.getbit_many("flags", [0, 1, 5, 6, 1000, 10 ** 6]), [0, 1, 1, 1, 1, 0])
+        self.assertEqual(self.cache.bitcount("flags"), 4)
+        self.assertEqual(self.cache.bitcount("flags", 0, 0), 3)
+        self.assertEqual(self.cache.setbit_many("flags", [6], value=False), [1])
+        self.assertEqual(self.cache.bitcount("flags"), 3)
+        self.assertEqual(self.cache.getbit_many("other", [1]), [0])
+        self.assertEqual(self.cache.bitcount("other"), 0)
+        pipeline = self.cache.pipeline()
+        pipeline.setbit_many("flags", [7])
+        pipeline.getbit_many("flags", [7])
+        self.assertEqual(pipeline.execute()[-1], [1])
+
+    def test_bitmaps_from_replicas(self):
+        self.cache.setbit_many("flags", [1, 5])
+        replica = redis.StrictRedis(connection_pool=self.cache._client.connection_pool)
+        execute_command = replica.execute_command
+        unknown = set()
+
+        def execute_on_replica(*args, **options):
+            if args[0] in ('BITFIELD', 'SETBIT'):
+                raise redis.ResponseError("READONLY You can't write against a read only replica.")
+            if args[0] in unknown:
+                raise redis.ResponseError("ERR unknown command '%s'" % args[0])
+            return execute_command(*args, **options)
+        replica.execute_command = execute_on_replica
+        self.cache._read_client = replica
+        self.assertEqual(self.cache.getbit_many("flags", [0, 1, 5]), [0, 1, 1])
+        self.assertEqual(self.cache.getbit_many("flags", []), [])
+        # Replicas older than Redis 6.2 get one GETBIT per offset
+        unknown.add('BITFIELD_RO')
+        self.assertEqual(self.cache.getbit_many("flags", [0, 1, 5]), [0, 1, 1])
+        self.assertFalse(self.cache._bitfield_ro)
+
     def test_pipeline(self):
         pipeline = self.cache.pipeline()
         key = self.cache.make_key("key")
@@ -417,6 +1459,211 @@ class RedisCacheTests(TestCase):
         self.assertEqual(self.cache.get(key).question, poll.question)
 
 
+class FakeRedisTests(TestCase):
+    """
+    Tests of the in-memory server used by ``faketests.py``.
+    """
+    def setUp(self):
+        self.cache = get_cache('redis_cache.RedisCache', LOCATION='127.0.0.1:6399', OPTIONS={
+            'DB': 15, 'CONNECTION_POOL_CLASS': 'redis_cache.fake.FakeConnectionPool'
+        })
+
+    def tearDown(self):
+        close_all()
+        self.cache.clear()
+        self.cache._client.connection_pool.disconnect()
+
+    def test_shared_server(self):
+        self.cache.set("a", 1)
+        other = get_cache('redis_cache.RedisCache', LOCATION='127.0.0.1:6399', OPTIONS={
+            'DB': 15, 'CONNECTION_POOL_CLASS': 'redis_cache.fake.FakeConnectionPool'
+        })
+        self.assertEqual(other.get("a"), 1)
+        other = get_cache('redis_cache.RedisCache', LOCATION='127.0.0.1:6399', OPTIONS={
+            'DB': 14, 'CONNECTION_POOL_CLASS': 'redis_cache.fake.FakeConnectionPool'
+        })
+        self.assertEqual(other.get("a"), None)
+
+    def test_expiry(self):
+        client = self.cache._client
+        client.set("a", "a", px=50)
+        client.set("b", "b")
+        self.assertTrue(0 < client.pttl("a") <= 50)
+        self.assertEqual(client.ttl("b"), None)
+        time.sleep(0.06)
+        self.assertEqual(client.get("a"), None)
+        self.assertEqual(client.keys("*"), [b"b"])
+        client.expire("b", 0)
+        self.assertFalse(client.exists("b"))
+
+    def test_transactions(self):
+        client = self.cache._client
+        pipeline = client.pipeline()
+        pipeline.set("a", 1).incr("a").get("a").hset("a", "field", 1)
+        results = pipeline.execute(raise_on_error=False)
+        self.assertEqual(results[:3], [True, 2, b"2"])
+        self.assertTrue(isinstance(results[3], redis.ResponseError))
+        pipeline.set("a", 3)
+        pipeline.execute_command("NOPE")
+        self.assertRaises(redis.ResponseError, pipeline.execute)
+        self.assertEqual(client.get("a"), b"2")
+
+    def test_latency(self):
+        cache = get_cache('redis_cache.RedisCache', LOCATION='127.0.0.1:6399', OPTIONS={
+            'DB': 13, 'CONNECTION_POOL_CLASS': 'redis_cache.fake.FakeConnectionPool',
+            'CONNECTION_POOL_CLASS_KWARGS': {'latency': 0.02},
+        })
+        start = time.time()
+        cache.set_many(dict(("key%s" % i, i) for i in range(10)))
+        cache.get("key0")
+        self.assertTrue(0.04 <= time.time() - start < 0.2)
+        cache.clear()
+
+
+class RedisSentinelCacheTests(TestCase):
+    """
+    Runs against a Sentinel on 127.0.0.1:26379 monitoring a master named
+    ``mymaster``, and is skipped when there is none.
+    """
+    def setUp(self):
+        self.cache = get_cache('redis_cache.RedisCache', LOCATION='sentinel://127.0.0.1:26379/mymaster',
+                               OPTIONS={'DB': 15, 'READ_FROM_REPLICAS': True})
+        try:
+            self.cache._client.connection_pool.get_master_address()
+        except redis.ConnectionError:
+            self.skipTest("No Sentinel on 127.0.0.1:26379")
+
+    def tearDown(self):
+        self.cache.clear()
+
+    def test_bad_location(self):
+        self.assertRaises(ImproperlyConfigured, get_cache, 'redis_cache.RedisCache',
+                          LOCATION='sentinel://127.0.0.1/mymaster')
+        self.assertRaises(ImproperlyConfigured, get_cache, 'redis_cache.RedisCache',
+                          LOCATION='sentinel://127.0.0.1:26379/')
+
+    def test_master_and_replica_clients(self):
+        self.assertTrue(self.cache._client.connection_pool.is_master)
+        self.assertFalse(self.cache._read_client.connection_pool.is_master)
+        self.cache.set("a", "a")
+        # Without replicas, reads fall back to the master
+        self.assertEqual(self.cache.get("a"), "a")
+        self.assertEqual(self.cache.get_many(["a", "b"]), {"a": "a"})
+
+    def test_failover_does_not_drop_other_connections(self):
+        connection_pool = self.cache._client.connection_pool
+        self.cache.set("a", "a")
+        in_flight = connection_pool.get_connection('GET')
+        in_flight.connect()
+        # Simulate the master moving: the pool must not close the in flight
+        # connection, but connections to the old master are reconnected when
+        # they are taken from the pool again.
+        connection_pool.master_address = ('10.255.255.1', 6379)
+        self.assertTrue(in_flight._sock is not None)
+        connection_pool.release(in_flight)
+        connection = connection_pool.get_connection('GET')
+        self.assertTrue(connection is in_flight)
+        self.assertTrue(connection._sock is None)
+        connection_pool.release(connection)
+        self.assertTrue(self.cache.set("a", "b"))
+        self.assertEqual(tuple(connection_pool.master_address), ('127.0.0.1', 6379))
+
+
+class RedisClusterCacheTests(TestCase):
+    """
+    Runs against a Redis Cluster with a node on 127.0.0.1:7000, and is
+    skipped when there is none.
+    """
+    def setUp(self):
+        self.cache = get_cache('redis_cache.RedisClusterCache', LOCATION='127.0.0.1:7000')
+        try:
+            self.cache._client.refresh_slots()
+        except redis.ConnectionError:
+            self.skipTest("No Redis Cluster node on 127.0.0.1:7000")
+
+    def tearDown(self):
+        self.cache.clear()
+
+    def test_key_slot(self):
+        self.assertEqual(key_slot("123456789"), 12739)
+        self.assertEqual(key_slot("foo"), 12182)
+        self.assertEqual(key_slot("{user1000}.following"), key_slot("{user1000}.followers"))
+        # Examples from the Redis Cluster specification
+        self.assertEqual(key_slot("foo{{bar}}zap"), key_slot("{bar"))
+        self.assertEqual(key_slot("foo{bar}{zap}"), key_slot("bar"))
+
+    def test_scripts(self):
+        self.cache.register_script('getset', "return redis.call('GETSET', KEYS[1], ARGV[1])")
+        self.cache._client.script_flush()
+        for i in range(10):
+            self.assertEqual(self.cache.call_script('getset', keys=["key%d" % i], args=[i]), None)
+        self.assertEqual(self.cache.get_many(["key0", "key9"]), {"key0": 0, "key9": 9})
+        # A script missing on a single master is loaded again
+        client = self.cache._client
+        client.get_node_client(client.master_nodes()[-1]).script_flush()
+        sha = self.cache.scripts['getset'].sha
+        self.assertEqual(client.script_exists(sha), [False])
+        self.cache.load_scripts()
+        self.assertEqual(client.script_exists(sha), [True])
+
+    def test_keys_are_spread_over_nodes(self):
+        keys = ["key%d" % i for i in range(20)]
+        nodes = set(self.cache._client.node_for_slot(key_slot(self.cache.make_key(key))) for key in keys)
+        self.assertTrue(len(nodes) > 1)
+        self.cache.set_many(dict((key, key) for key in keys))
+        self.assertEqual(self.cache.get("key1"), "key1")
+        self.assertEqual(self.cache.get_many(keys + ["missing"]), dict((key, key) for key in keys))
+        self.cache.delete_many(keys[:10])
+        self.assertEqual(sorted(self.cache.get_many(keys)), sorted(keys[10:]))
+        self.assertTrue(self.cache.touch("key10", 10))
+        with self.cache.batch() as batch:
+            many = batch.get_many(keys)
+            batch.set("key0", 0)
+            zero = batch.get("key0")
+        self.assertEqual(len(many.value), 10)
+        self.assertEqual(zero.value, 0)
+        self.cache.clear()
+        self.assertEqual(self.cache.get_many(keys), {})
+
+    def test_redirections(self):
+        key = self.cache.make_key("key")
+        self.cache.set(key, "value")
+        client = self.cache._client
+        right = client.node_for_slot(key_slot(key))
+        wrong = [node for node in client.master_nodes() if node != right][0]
+        # Point every slot to the wrong node: MOVED replies fix the map
+        client.slots = [wrong] * len(client.slots)
+        self.assertEqual(self.cache.get(key), "value")
+        self.assertEqual(client.node_for_slot(key_slot(key)), right)
+        client.slots = [wrong] * len(client.slots)
+        self.assertEqual(self.cache.get_many([key]), {key: "value"})
+
+    def test_sorted_sets_with_hash_tags(self):
+        self.cache.add_many_to_sorted_set("{feed}:a", {"x": 1, "y": 2})
+        self.cache.add_many_to_sorted_set("{feed}:b", {"y": 3})
+        self.assertEqual(self.cache.sorted_set_intercept("{feed}:dest", ["{feed}:a", "{feed}:b"]), 1)
+        key = self.cache.sorted_set_query(["{feed}:a", "{feed}:b"], operation='union')
+        self.assertEqual(self.cache.sorted_set_range(key, 0, -1), ["x", "y"])
+        self.cache.add_to_sorted_set("other", "z", 1)
+        self.assertRaises(ClusterCrossSlotError, self.cache.sorted_set_union, "{feed}:dest", ["{feed}:a", "other"])
+
+    def test_hyperloglog_with_hash_tags(self):
+        self.cache.pfadd("{visitors}:mon", ["a", "b"])
+        self.cache.pfadd("{visitors}:tue", ["b", "c"])
+        self.assertEqual(self.cache.pfcount(["{visitors}:mon", "{visitors}:tue"]), 3)
+        self.cache.pfmerge("{visitors}:week", ["{visitors}:mon", "{visitors}:tue"])
+        self.assertEqual(self.cache.pfcount("{visitors}:week"), 3)
+        self.assertRaises(ClusterCrossSlotError, self.cache.pfcount, ["{visitors}:mon", "other"])
+
+    def test_pipeline(self):
+        pipeline = self.cache.pipeline()
+        pipeline.set("a", 1)
+        pipeline.set("b", 2)
+        pipeline.execute()
+        self.assertEqual(self.cache.get_many(["a", "b"]), {"a": 1, "b": 2})
+        self.assertRaises(ClusterError, self.cache.pipeline, transaction=True)
+
+
 if __name__ == '__main__':
     import unittest
     unittest.main()